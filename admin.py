@@ -1,76 +1,95 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
-from models import User, Product, License, Transaction, Download, Category
-from datetime import datetime, timedelta
+import base64
+import json
+from sqlalchemy.orm import Session, contains_eager
+from sqlalchemy import func, desc, or_, and_, select
+from models import User, Product, License, Transaction, Download, Category, DailyProductDownloads, DailyRevenue, DailySignups
+from license import invalidate_license_cache
+from auth import invalidate_principal
+from catalog import invalidate_catalog
+from rollups import PAID_STATUSES
+from cache import TTLCache
+from config import get_config
+from datetime import date, datetime, timedelta
+from typing import Optional
 import logging
 
 logger = logging.getLogger(__name__)
 
-def get_admin_stats(db: Session) -> dict:
-    """Obter estatísticas para o painel administrativo"""
+# Estatísticas do painel, recalculadas no máximo uma vez por janela
+admin_stats_cache = TTLCache(max_size=1, ttl=get_config().ADMIN_STATS_CACHE_SECONDS)
+
+def get_admin_stats(db: Session, use_cache: bool = True) -> dict:
+    """Obter estatísticas para o painel administrativo
+    
+    Usuários, produtos e licenças vêm de uma consulta com agregações
+    condicionais por tabela; transações, receita, downloads e cadastros vêm
+    dos rollups diários (O(dias), não O(eventos)). O resultado fica em cache
+    por ADMIN_STATS_CACHE_SECONDS.
+    """
+    if use_cache:
+        cached = admin_stats_cache.get("stats")
+        if cached is not None:
+            return cached
+    
     try:
-        # Estatísticas básicas
-        total_users = db.query(User).count()
-        active_users = db.query(User).filter(User.is_active == True).count()
-        total_products = db.query(Product).count()
-        active_products = db.query(Product).filter(Product.is_active == True).count()
-        
-        # Licenças
-        total_licenses = db.query(License).count()
-        active_licenses = db.query(License).filter(
-            License.status == "active",
-            License.expires_at > datetime.utcnow()
-        ).count()
-        expired_licenses = db.query(License).filter(
-            License.expires_at <= datetime.utcnow()
-        ).count()
-        
-        # Transações
-        total_transactions = db.query(Transaction).count()
-        approved_transactions = db.query(Transaction).filter(
-            Transaction.status == "approved"
-        ).count()
-        pending_transactions = db.query(Transaction).filter(
-            Transaction.status == "pending"
-        ).count()
-        
-        # Receita total
-        total_revenue = db.query(func.sum(Transaction.amount)).filter(
-            Transaction.status == "approved"
+        now = datetime.utcnow()
+        today = now.date()
+        start_of_month = today.replace(day=1)
+        week_start = today - timedelta(days=6)
+        
+        # Usuários (is_active é derivado de status_licenca)
+        user_active = or_(User.status_licenca.is_(None), User.status_licenca.notin_(["suspenso", "inativo"]))
+        total_users, active_users = db.query(
+            func.count(User.id),
+            func.count(User.id).filter(user_active)
+        ).one()
+        new_users_week = db.query(func.sum(DailySignups.signups)).filter(
+            DailySignups.day >= week_start
         ).scalar() or 0
         
-        # Receita do mês atual
-        start_of_month = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        monthly_revenue = db.query(func.sum(Transaction.amount)).filter(
-            Transaction.status == "approved",
-            Transaction.created_at >= start_of_month
-        ).scalar() or 0
+        total_products, active_products = db.query(
+            func.count(Product.id),
+            func.count(Product.id).filter(Product.is_active == True)
+        ).one()
         
-        # Downloads
-        total_downloads = db.query(Download).count()
-        downloads_today = db.query(Download).filter(
-            func.date(Download.downloaded_at) == datetime.utcnow().date()
-        ).count()
+        # Licenças
+        total_licenses, active_licenses, expired_licenses = db.query(
+            func.count(License.id),
+            func.count(License.id).filter(License.status == "active", License.expires_at > now),
+            func.count(License.id).filter(License.expires_at <= now)
+        ).one()
+        
+        # Transações e receita (rollup por dia, status e forma de pagamento)
+        paid = DailyRevenue.status.in_(PAID_STATUSES)
+        (total_transactions, approved_transactions, pending_transactions,
+         new_transactions_week, total_revenue, monthly_revenue) = db.query(
+            func.sum(DailyRevenue.transactions),
+            func.sum(DailyRevenue.transactions).filter(paid),
+            func.sum(DailyRevenue.transactions).filter(DailyRevenue.status == "pending"),
+            func.sum(DailyRevenue.transactions).filter(DailyRevenue.day >= week_start),
+            func.sum(DailyRevenue.amount).filter(paid),
+            func.sum(DailyRevenue.amount).filter(paid, DailyRevenue.day >= start_of_month)
+        ).one()
+        
+        # Downloads (rollup por dia e produto)
+        total_downloads, downloads_today = db.query(
+            func.sum(DailyProductDownloads.downloads),
+            func.sum(DailyProductDownloads.downloads).filter(DailyProductDownloads.day == today)
+        ).one()
         
         # Produtos mais populares
+        top_downloads = db.query(
+            DailyProductDownloads.product_id,
+            func.sum(DailyProductDownloads.downloads).label("download_count")
+        ).group_by(DailyProductDownloads.product_id).order_by(desc("download_count")).limit(5).subquery()
         popular_products = db.query(
             Product.name,
-            func.count(Download.id).label('download_count')
-        ).join(Download).group_by(Product.id, Product.name).order_by(
-            desc('download_count')
-        ).limit(5).all()
-        
-        # Registros recentes (últimos 7 dias)
-        week_ago = datetime.utcnow() - timedelta(days=7)
-        new_users_week = db.query(User).filter(
-            User.created_at >= week_ago
-        ).count()
-        
-        new_transactions_week = db.query(Transaction).filter(
-            Transaction.created_at >= week_ago
-        ).count()
+            top_downloads.c.download_count
+        ).join(top_downloads, Product.id == top_downloads.c.product_id).order_by(
+            desc(top_downloads.c.download_count)
+        ).all()
         
-        return {
+        stats = {
             "users": {
                 "total": total_users,
                 "active": active_users,
@@ -86,18 +105,18 @@ def get_admin_stats(db: Session) -> dict:
                 "expired": expired_licenses
             },
             "transactions": {
-                "total": total_transactions,
-                "approved": approved_transactions,
-                "pending": pending_transactions,
-                "new_this_week": new_transactions_week
+                "total": total_transactions or 0,
+                "approved": approved_transactions or 0,
+                "pending": pending_transactions or 0,
+                "new_this_week": new_transactions_week or 0
             },
             "revenue": {
-                "total": total_revenue,
-                "monthly": monthly_revenue
+                "total": total_revenue or 0,
+                "monthly": monthly_revenue or 0
             },
             "downloads": {
-                "total": total_downloads,
-                "today": downloads_today
+                "total": total_downloads or 0,
+                "today": downloads_today or 0
             },
             "popular_products": [
                 {"name": name, "downloads": count} 
@@ -105,10 +124,152 @@ def get_admin_stats(db: Session) -> dict:
             ]
         }
         
+        admin_stats_cache.set("stats", stats)
+        return stats
+        
     except Exception as e:
         logger.error(f"Erro ao obter estatísticas: {e}")
         return {}
 
+# Ordenações aceitas nas listagens paginadas do painel
+USER_SORTS = {"id": User.id, "created_at": User.created_at, "email": User.email}
+LICENSE_SORTS = {"id": License.id, "created_at": License.created_at, "expires_at": License.expires_at}
+
+def encode_cursor(value, row_id: int) -> str:
+    """Cursor opaco com a chave de ordenação do último item da página"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str, column) -> tuple:
+    """Ler cursor gerado por encode_cursor (ValueError se inválido)"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, row_id = json.loads(raw)
+        if column.type.python_type is datetime:
+            value = datetime.fromisoformat(value)
+        elif column.type.python_type is int:
+            value = int(value)
+        return value, int(row_id)
+    except Exception:
+        raise ValueError("Cursor inválido")
+
+def _paginate(query, column, id_column, order: str, cursor: Optional[str]):
+    """Aplicar ordenação e o predicado de keyset (coluna, id) à consulta"""
+    if order not in ("asc", "desc"):
+        raise ValueError("Ordem inválida")
+    descending = order == "desc"
+    
+    if column is not id_column:
+        # Registros sem valor na coluna de ordenação ficam fora dessa ordenação
+        query = query.filter(column.isnot(None))
+    
+    if cursor:
+        value, last_id = decode_cursor(cursor, column)
+        if column is id_column:
+            query = query.filter(id_column < last_id if descending else id_column > last_id)
+        elif descending:
+            query = query.filter(or_(column < value, and_(column == value, id_column < last_id)))
+        else:
+            query = query.filter(or_(column > value, and_(column == value, id_column > last_id)))
+    
+    ordering = [column] if column is id_column else [column, id_column]
+    return query.order_by(*[desc(c) if descending else c for c in ordering])
+
+def _prefix_filter(column, prefix: str):
+    """Filtro por prefixo em forma de intervalo (aproveita o índice da coluna)"""
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return and_(column >= prefix, column < upper)
+
+def _date_range_filters(column, date_from: Optional[date], date_to: Optional[date]) -> list:
+    filters = []
+    if date_from:
+        filters.append(column >= datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        filters.append(column < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    return filters
+
+def list_users_page(db: Session, limit: int = 50, cursor: Optional[str] = None,
+                    status: Optional[str] = None, email_prefix: Optional[str] = None,
+                    created_from: Optional[date] = None, created_to: Optional[date] = None,
+                    sort: str = "id", order: str = "desc") -> tuple:
+    """Página de usuários com a contagem de licenças ativas
+    
+    Paginação por keyset: o custo depende do tamanho da página, não do
+    total de usuários. As contagens vêm de um único JOIN agrupado restrito
+    aos usuários da página. Retorna ([(user, license_count)], next_cursor).
+    """
+    column = USER_SORTS.get(sort)
+    if column is None:
+        raise ValueError("Ordenação inválida")
+    
+    query = db.query(User.id)
+    if status:
+        query = query.filter(User.status_licenca == status)
+    if email_prefix and email_prefix.strip():
+        query = query.filter(_prefix_filter(User.email, email_prefix.strip()))
+    for condition in _date_range_filters(User.created_at, created_from, created_to):
+        query = query.filter(condition)
+    query = _paginate(query, column, User.id, order, cursor)
+    
+    page_ids = query.limit(limit + 1).subquery()
+    license_counts = select(
+        License.user_id,
+        func.count(License.id).label("license_count")
+    ).where(
+        License.status == "active",
+        License.user_id.in_(select(page_ids.c.id))
+    ).group_by(License.user_id).subquery()
+    
+    rows = _paginate(
+        db.query(User, func.coalesce(license_counts.c.license_count, 0))
+        .join(page_ids, page_ids.c.id == User.id)
+        .outerjoin(license_counts, license_counts.c.user_id == User.id),
+        column, User.id, order, None
+    ).all()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_user = rows[-1][0]
+        next_cursor = encode_cursor(getattr(last_user, column.key), last_user.id)
+    return rows, next_cursor
+
+def list_licenses_page(db: Session, limit: int = 50, cursor: Optional[str] = None,
+                       status: Optional[str] = None, product_id: Optional[int] = None,
+                       email_prefix: Optional[str] = None, created_from: Optional[date] = None,
+                       created_to: Optional[date] = None, sort: str = "id", order: str = "desc") -> tuple:
+    """Página de licenças com usuário e produto carregados no mesmo SELECT
+    
+    Retorna ([license], next_cursor).
+    """
+    column = LICENSE_SORTS.get(sort)
+    if column is None:
+        raise ValueError("Ordenação inválida")
+    
+    query = db.query(License).join(License.user).join(License.product).options(
+        contains_eager(License.user),
+        contains_eager(License.product)
+    )
+    if status:
+        query = query.filter(License.status == status)
+    if product_id:
+        query = query.filter(License.product_id == product_id)
+    if email_prefix and email_prefix.strip():
+        query = query.filter(_prefix_filter(User.email, email_prefix.strip()))
+    for condition in _date_range_filters(License.created_at, created_from, created_to):
+        query = query.filter(condition)
+    
+    licenses = _paginate(query, column, License.id, order, cursor).limit(limit + 1).all()
+    
+    next_cursor = None
+    if len(licenses) > limit:
+        licenses = licenses[:limit]
+        last_license = licenses[-1]
+        next_cursor = encode_cursor(getattr(last_license, column.key), last_license.id)
+    return licenses, next_cursor
+
 def create_product(db: Session, product_data: dict) -> Product:
     """Criar novo produto"""
     try:
@@ -128,6 +289,7 @@ def create_product(db: Session, product_data: dict) -> Product:
         db.add(product)
         db.commit()
         db.refresh(product)
+        invalidate_catalog()
         
         logger.info(f"Produto criado: {product.name}")
         return product
@@ -153,6 +315,7 @@ def update_product(db: Session, product_id: int, product_data: dict) -> Product:
         
         db.commit()
         db.refresh(product)
+        invalidate_catalog()
         
         logger.info(f"Produto atualizado: {product.name}")
         return product
@@ -185,6 +348,7 @@ def delete_product(db: Session, product_id: int) -> bool:
             db.delete(product)
         
         db.commit()
+        invalidate_catalog()
         
         logger.info(f"Produto deletado/desativado: {product.name}")
         return True
@@ -206,6 +370,7 @@ def create_category(db: Session, category_data: dict) -> Category:
         db.add(category)
         db.commit()
         db.refresh(category)
+        invalidate_catalog()
         
         logger.info(f"Categoria criada: {category.name}")
         return category
@@ -222,13 +387,15 @@ def update_user_status(db: Session, user_id: int, is_active: bool, is_admin: boo
         if not user:
             raise ValueError("Usuário não encontrado")
         
-        user.is_active = is_active
+        # is_active é derivado de status_licenca
+        user.status_licenca = "ativo" if is_active else "inativo"
         if is_admin is not None:
             user.is_admin = is_admin
         user.updated_at = datetime.utcnow()
         
         db.commit()
         db.refresh(user)
+        invalidate_principal(user)
         
         logger.info(f"Status do usuário atualizado: {user.username}")
         return user
@@ -291,6 +458,7 @@ def suspend_license(db: Session, license_id: int, reason: str = None) -> bool:
         
         license_obj.status = "suspended"
         db.commit()
+        invalidate_license_cache(license_obj.license_key)
         
         logger.info(f"Licença suspensa: {license_obj.license_key} - Motivo: {reason}")
         return True
@@ -313,6 +481,7 @@ def reactivate_license(db: Session, license_id: int) -> bool:
         
         license_obj.status = "active"
         db.commit()
+        invalidate_license_cache(license_obj.license_key)
         
         logger.info(f"Licença reativada: {license_obj.license_key}")
         return True
@@ -323,13 +492,30 @@ def reactivate_license(db: Session, license_id: int) -> bool:
         return False
 
 def get_system_logs(db: Session, limit: int = 100) -> list:
-    """Obter logs do sistema"""
+    """Obter logs recentes do sistema
+    
+    Consulta mês a mês, do atual para trás, até completar `limit` ou passar
+    do mês do log mais antigo; cada consulta é limitada ao intervalo de um
+    mês e toca uma única partição.
+    """
     try:
         from models import SecurityLog
-        
-        logs = db.query(SecurityLog).order_by(
-            desc(SecurityLog.created_at)
-        ).limit(limit).all()
+        from retention import months_since, recent_months
+        
+        oldest = db.query(func.min(SecurityLog.created_at)).scalar()
+        if oldest is None:
+            return []
+        
+        logs = []
+        for start, end in recent_months(months_since(oldest)):
+            logs.extend(db.query(SecurityLog).filter(
+                SecurityLog.created_at >= start,
+                SecurityLog.created_at < end
+            ).order_by(
+                desc(SecurityLog.created_at)
+            ).limit(limit - len(logs)).all())
+            if len(logs) >= limit:
+                break
         
         return logs
         
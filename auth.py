@@ -1,11 +1,22 @@
 import os
 import jwt
+import asyncio
+import calendar
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
 from datetime import datetime, timedelta
+from typing import Optional
 from passlib.context import CryptContext
 from fastapi import HTTPException, status, Depends, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import select, or_
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import User
+from cache import TTLCache
+from config import get_config
 import logging
 
 logger = logging.getLogger(__name__)
@@ -16,11 +27,54 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 # Contexto de criptografia
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# min/max iguais ao custo atual: hashes com outro custo são marcados para rehash
+BCRYPT_ROUNDS = get_config().BCRYPT_ROUNDS
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
+
+# Pool dedicado ao bcrypt para não bloquear o event loop
+PASSWORD_HASH_WORKERS = max(1, get_config().PASSWORD_HASH_WORKERS)
+_password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_password_pool_lock = threading.Lock()
+_password_pool_state = {"submitted": 0, "running": 0, "completed": 0}
 
 # Bearer token security
 security = HTTPBearer(auto_error=False)
 
+# Cache do usuário autenticado por `sub` do token (email ou username)
+principal_cache = TTLCache(
+    max_size=get_config().PRINCIPAL_CACHE_MAX_SIZE,
+    ttl=get_config().PRINCIPAL_CACHE_TTL_SECONDS
+)
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """Dados imutáveis do usuário autenticado, seguros para cache"""
+    id: int
+    email: str
+    username: Optional[str]
+    is_admin: bool
+    is_active: bool
+    status: Optional[str]
+    created_at: Optional[datetime]
+    
+    @classmethod
+    def from_user(cls, user: User) -> "UserSnapshot":
+        return cls(
+            id=user.id,
+            email=user.email,
+            username=user.username,
+            is_admin=bool(user.is_admin),
+            is_active=user.is_active,
+            status=user.status_licenca,
+            created_at=user.created_at
+        )
+
 def hash_password(password: str) -> str:
     """Hash da senha usando bcrypt"""
     return pwd_context.hash(password)
@@ -29,6 +83,52 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verificar senha"""
     return pwd_context.verify(plain_password, hashed_password)
 
+def _run_password_task(func, *args):
+    with _password_pool_lock:
+        _password_pool_state["running"] += 1
+    try:
+        return func(*args)
+    finally:
+        with _password_pool_lock:
+            _password_pool_state["running"] -= 1
+            _password_pool_state["completed"] += 1
+
+async def _run_in_password_pool(func, *args):
+    """Executar operação de bcrypt no pool dedicado"""
+    with _password_pool_lock:
+        _password_pool_state["submitted"] += 1
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_executor, _run_password_task, func, *args)
+
+async def hash_password_async(password: str) -> str:
+    """Hash da senha fora do event loop"""
+    return await _run_in_password_pool(hash_password, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verificar senha fora do event loop"""
+    return await _run_in_password_pool(verify_password, plain_password, hashed_password)
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> tuple:
+    """Verificar senha e gerar novo hash se o custo configurado mudou
+    
+    Retorna (válida, novo_hash); novo_hash é None quando não há rehash.
+    """
+    return await _run_in_password_pool(pwd_context.verify_and_update, plain_password, hashed_password)
+
+def get_password_pool_stats() -> dict:
+    """Estatísticas do pool de hash de senhas"""
+    with _password_pool_lock:
+        submitted = _password_pool_state["submitted"]
+        running = _password_pool_state["running"]
+        completed = _password_pool_state["completed"]
+    return {
+        "workers": PASSWORD_HASH_WORKERS,
+        "bcrypt_rounds": BCRYPT_ROUNDS,
+        "running": running,
+        "queued": max(0, submitted - completed - running),
+        "completed": completed
+    }
+
 def create_access_token(data: dict, expires_delta: timedelta = None):
     """Criar token JWT de acesso"""
     to_encode = data.copy()
@@ -41,6 +141,78 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+@lru_cache(maxsize=4)
+def _public_key_from_private(private_key_pem: str) -> str:
+    """Chave pública (PEM) derivada da chave privada"""
+    from cryptography.hazmat.primitives import serialization
+    
+    private_key = serialization.load_pem_private_key(private_key_pem.encode(), password=None)
+    return private_key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+
+def _license_token_keys() -> tuple:
+    """Chaves e algoritmo dos tokens de licença (EdDSA se configurado, senão HS256)
+    
+    Sem LICENSE_TOKEN_PUBLIC_KEY, a chave pública é derivada da privada.
+    """
+    from config import get_config
+    config = get_config()
+    
+    if config.LICENSE_TOKEN_PRIVATE_KEY:
+        public_key = config.LICENSE_TOKEN_PUBLIC_KEY or _public_key_from_private(config.LICENSE_TOKEN_PRIVATE_KEY)
+        return config.LICENSE_TOKEN_PRIVATE_KEY, public_key, "EdDSA"
+    return config.LICENSE_TOKEN_SECRET, config.LICENSE_TOKEN_SECRET, "HS256"
+
+def create_license_token(license_obj, hwid: str = None, expires_delta: timedelta = None) -> dict:
+    """Criar token assinado de licença para validação offline no cliente
+    
+    O token nunca vale além da expiração da própria licença.
+    """
+    from config import get_config
+    config = get_config()
+    
+    now = datetime.utcnow()
+    expire = now + (expires_delta or timedelta(minutes=config.LICENSE_TOKEN_EXPIRE_MINUTES))
+    expire = min(expire, license_obj.expires_at)
+    
+    signing_key, _, algorithm = _license_token_keys()
+    to_encode = {
+        "typ": "license",
+        "sub": license_obj.license_key,
+        "pid": license_obj.product_id,
+        "hwid": license_obj.hwid or hwid,
+        "lexp": calendar.timegm(license_obj.expires_at.utctimetuple()),
+        "iat": now,
+        "exp": expire
+    }
+    
+    return {
+        "token": jwt.encode(to_encode, signing_key, algorithm=algorithm),
+        "algorithm": algorithm,
+        "expires_at": expire
+    }
+
+def verify_license_token(token: str, hwid: str = None):
+    """Verificar token de licença (e o HWID vinculado, se informado)"""
+    _, verify_key, algorithm = _license_token_keys()
+    try:
+        payload = jwt.decode(token, verify_key, algorithms=[algorithm])
+    except jwt.PyJWTError:
+        return None
+    
+    if payload.get("typ") != "license":
+        return None
+    if hwid and payload.get("hwid") and payload["hwid"] != hwid:
+        return None
+    return payload
+
+def get_license_token_public_key():
+    """Chave pública para os clientes validarem tokens EdDSA (None com HMAC)"""
+    _, verify_key, algorithm = _license_token_keys()
+    return verify_key if algorithm == "EdDSA" else None
+
 def verify_token(token: str):
     """Verificar e decodificar token JWT"""
     try:
@@ -49,6 +221,53 @@ def verify_token(token: str):
     except jwt.PyJWTError:
         return None
 
+def get_principal(db: Session, subject: str) -> Optional[UserSnapshot]:
+    """Obter snapshot do usuário pelo `sub` do token, usando o cache"""
+    if not subject:
+        return None
+    
+    snapshot = principal_cache.get(subject)
+    if snapshot is not None:
+        return snapshot
+    
+    user = db.query(User).filter(
+        or_(
+            User.email == subject,
+            User.username == subject
+        )
+    ).first()
+    if user is None:
+        return None
+    
+    snapshot = UserSnapshot.from_user(user)
+    principal_cache.set(subject, snapshot)
+    return snapshot
+
+async def get_principal_async(db: AsyncSession, subject: str) -> Optional[UserSnapshot]:
+    """Versão assíncrona de get_principal"""
+    if not subject:
+        return None
+    
+    snapshot = principal_cache.get(subject)
+    if snapshot is not None:
+        return snapshot
+    
+    result = await db.execute(
+        select(User).where(or_(User.email == subject, User.username == subject))
+    )
+    user = result.scalars().first()
+    if user is None:
+        return None
+    
+    snapshot = UserSnapshot.from_user(user)
+    principal_cache.set(subject, snapshot)
+    return snapshot
+
+def invalidate_principal(user) -> None:
+    """Remover usuário do cache de autenticação (após alterar status ou senha)"""
+    subjects = {user.email, user.username} - {None}
+    principal_cache.delete_where(lambda key: key in subjects)
+
 def authenticate_user(db: Session, username_or_email: str, password: str):
     """Autenticar usuário - aceita email ou nome de usuário"""
     from sqlalchemy import or_
@@ -72,6 +291,34 @@ def authenticate_user(db: Session, username_or_email: str, password: str):
     
     return user
 
+async def authenticate_user_async(db: Session, username_or_email: str, password: str):
+    """Autenticar usuário com o bcrypt fora do event loop
+    
+    Refaz o hash da senha quando o custo do bcrypt foi alterado.
+    """
+    user = db.query(User).filter(
+        or_(
+            User.email == username_or_email,
+            User.username == username_or_email
+        )
+    ).first()
+    
+    if not user:
+        return False
+    
+    valid, new_hash = await verify_and_update_password_async(password, user.password_hash)
+    if not valid:
+        return False
+    
+    if new_hash:
+        user.password_hash = new_hash
+    
+    # Atualizar último login
+    user.ultimo_login = datetime.utcnow()
+    db.commit()
+    
+    return user
+
 def get_current_user(request: Request, db: Session):
     """Obter usuário atual a partir do token"""
     # Tentar obter token do cookie primeiro
@@ -92,21 +339,15 @@ def get_current_user(request: Request, db: Session):
             detail="Token de acesso não encontrado"
         )
     
-    username = verify_token(token)
-    if username is None:
+    payload = verify_token(token)
+    if payload is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token inválido"
         )
     
-    # Buscar por email ou username
-    from sqlalchemy import or_
-    user = db.query(User).filter(
-        or_(
-            User.email == username,
-            User.username == username
-        )
-    ).first()
+    # Buscar por email ou username (via cache)
+    user = get_principal(db, payload.get("sub"))
     
     if user is None:
         raise HTTPException(
@@ -122,7 +363,7 @@ def get_current_user(request: Request, db: Session):
     
     return user
 
-def get_current_admin_user(current_user: User):
+def get_current_admin_user(current_user: UserSnapshot):
     """Obter usuário admin atual"""
     if not current_user.is_admin:
         raise HTTPException(
@@ -0,0 +1,153 @@
+"""
+Benchmark de admin.get_admin_stats contra um banco populado
+
+Uso: python benchmarks/admin_stats_bench.py [downloads] [transações] [url_do_banco]
+
+Popula um SQLite temporário (ou o banco informado, que deve estar vazio)
+com 1M downloads e 100k transações por padrão, recalcula os rollups diários
+(as inserções em massa não passam pela sessão) e mede número de consultas e
+latência da implementação atual frente à antiga (uma consulta por métrica).
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+_tmp = tempfile.mkdtemp()
+DATABASE_URL = sys.argv[3] if len(sys.argv) > 3 else f"sqlite:///{os.path.join(_tmp, 'bench.db')}"
+os.environ["DATABASE_URL"] = DATABASE_URL
+os.environ.setdefault("RATELIMIT_STORAGE_URL", f"sqlite:///{os.path.join(_tmp, 'ratelimits.db')}")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event, func, desc, insert
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, User, Category, Product, License, Transaction, Download
+from admin import get_admin_stats
+from rollups import rebuild_rollups
+
+USERS = 5000
+PRODUCTS = 50
+LICENSES = 20000
+CHUNK = 20000
+
+def seed(engine, downloads: int, transactions: int):
+    now = datetime.utcnow()
+    rnd = random.Random(42)
+
+    def when(days: int = 365) -> datetime:
+        return now - timedelta(seconds=rnd.randint(0, days * 86400))
+
+    with engine.begin() as conn:
+        conn.execute(insert(Category), [{"id": 1, "name": "Bench", "is_active": True}])
+        conn.execute(insert(User), [
+            {"id": i, "email": f"user{i}@bench.local", "username": f"user{i}", "password_hash": "x",
+             "status_licenca": rnd.choice(["ativo", "ativo", "inativo"]), "created_at": when()}
+            for i in range(1, USERS + 1)
+        ])
+        conn.execute(insert(Product), [
+            {"id": i, "name": f"Produto {i}", "price": 10.0, "category_id": 1, "is_active": i % 10 != 0}
+            for i in range(1, PRODUCTS + 1)
+        ])
+        conn.execute(insert(License), [
+            {"id": i, "license_key": f"BENCH{i:012d}", "user_id": rnd.randint(1, USERS),
+             "product_id": rnd.randint(1, PRODUCTS), "status": rnd.choice(["active", "expired", "suspended"]),
+             "created_at": when(), "expires_at": now + timedelta(days=rnd.randint(-60, 60))}
+            for i in range(1, LICENSES + 1)
+        ])
+
+    for offset in range(0, transactions, CHUNK):
+        with engine.begin() as conn:
+            conn.execute(insert(Transaction), [
+                {"user_id": rnd.randint(1, USERS), "product_id": rnd.randint(1, PRODUCTS),
+                 "amount": rnd.choice([9.9, 19.9, 49.9]), "payment_id": f"pay_{i}",
+                 "payment_method": rnd.choice(["pix", "card", "stripe"]),
+                 "status": rnd.choice(["approved", "approved", "pending", "rejected"]), "created_at": when()}
+                for i in range(offset, min(offset + CHUNK, transactions))
+            ])
+
+    for offset in range(0, downloads, CHUNK):
+        with engine.begin() as conn:
+            conn.execute(insert(Download), [
+                {"user_id": rnd.randint(1, USERS), "product_id": rnd.randint(1, PRODUCTS),
+                 "license_id": rnd.randint(1, LICENSES), "ip_address": "127.0.0.1", "downloaded_at": when()}
+                for _ in range(offset, min(offset + CHUNK, downloads))
+            ])
+
+def legacy_stats(db) -> dict:
+    """Implementação anterior: uma consulta por métrica"""
+    now = datetime.utcnow()
+    start_of_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    week_ago = now - timedelta(days=7)
+    approved = Transaction.status == "approved"
+    return {
+        "users": db.query(User).count(),
+        "active_users": db.query(User).filter(User.status_licenca.notin_(["suspenso", "inativo"])).count(),
+        "products": db.query(Product).count(),
+        "active_products": db.query(Product).filter(Product.is_active == True).count(),
+        "licenses": db.query(License).count(),
+        "active_licenses": db.query(License).filter(License.status == "active", License.expires_at > now).count(),
+        "expired_licenses": db.query(License).filter(License.expires_at <= now).count(),
+        "transactions": db.query(Transaction).count(),
+        "approved": db.query(Transaction).filter(approved).count(),
+        "pending": db.query(Transaction).filter(Transaction.status == "pending").count(),
+        "revenue": db.query(func.sum(Transaction.amount)).filter(approved).scalar(),
+        "monthly": db.query(func.sum(Transaction.amount)).filter(approved, Transaction.created_at >= start_of_month).scalar(),
+        "downloads": db.query(Download).count(),
+        "today": db.query(Download).filter(func.date(Download.downloaded_at) == now.date()).count(),
+        "popular": db.query(Product.name, func.count(Download.id).label("c")).join(Download).group_by(
+            Product.id, Product.name).order_by(desc("c")).limit(5).all(),
+        "new_users": db.query(User).filter(User.created_at >= week_ago).count(),
+        "new_transactions": db.query(Transaction).filter(Transaction.created_at >= week_ago).count()
+    }
+
+def measure(label: str, engine, func_, runs: int = 5):
+    counter = {"queries": 0}
+
+    def count(*args):
+        counter["queries"] += 1
+
+    event.listen(engine, "before_cursor_execute", count)
+    Session = sessionmaker(bind=engine)
+    timings = []
+    try:
+        for _ in range(runs):
+            db = Session()
+            start = time.perf_counter()
+            func_(db)
+            timings.append(time.perf_counter() - start)
+            db.close()
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+    timings.sort()
+    print(f"{label:<24} consultas={counter['queries'] // runs:<4} "
+          f"mediana={timings[len(timings) // 2] * 1000:9.1f}ms  mínimo={timings[0] * 1000:9.1f}ms")
+
+def main():
+    downloads = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    transactions = int(sys.argv[2]) if len(sys.argv) > 2 else 100_000
+
+    engine = create_engine(DATABASE_URL)
+    Base.metadata.create_all(bind=engine)
+
+    start = time.perf_counter()
+    seed(engine, downloads, transactions)
+    print(f"Banco populado em {time.perf_counter() - start:.1f}s: {downloads} downloads, {transactions} transações")
+
+    start = time.perf_counter()
+    db = sessionmaker(bind=engine)()
+    try:
+        rows = rebuild_rollups(db)
+    finally:
+        db.close()
+    print(f"Rollups recalculados em {time.perf_counter() - start:.1f}s: {rows}")
+
+    measure("antiga (por métrica)", engine, legacy_stats)
+    measure("agregada", engine, lambda db: get_admin_stats(db, use_cache=False))
+    measure("agregada (cache)", engine, get_admin_stats)
+
+if __name__ == "__main__":
+    main()
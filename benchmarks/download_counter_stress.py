@@ -0,0 +1,108 @@
+"""
+Teste de concorrência do contador de downloads (counters.download_counter)
+
+Uso: python benchmarks/download_counter_stress.py [processos] [threads] [downloads_por_thread] [url_do_banco]
+
+Vários processos (simulando os workers do gunicorn), cada um com várias
+threads, contabilizam downloads do mesmo produto. Ao final o valor de
+download_count deve ser exatamente processos x threads x downloads. Para
+comparação, o mesmo volume é gravado com o antigo read-modify-write
+(`product.download_count += 1; commit`), que perde incrementos.
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import Process
+
+_tmp = tempfile.mkdtemp()
+DATABASE_URL = sys.argv[4] if len(sys.argv) > 4 else f"sqlite:///{os.path.join(_tmp, 'counter.db')}"
+os.environ["DATABASE_URL"] = DATABASE_URL
+os.environ.setdefault("RATELIMIT_STORAGE_URL", f"sqlite:///{os.path.join(_tmp, 'ratelimits.db')}")
+os.environ.setdefault("DOWNLOAD_COUNT_FLUSH_SECONDS", "0.05")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert
+
+from database import engine, SessionLocal
+from models import Base, Category, Product
+
+def buffered_worker(product_id: int, threads: int, downloads: int):
+    from counters import download_counter, record_product_download
+
+    def run():
+        for _ in range(downloads):
+            record_product_download(product_id)
+
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    download_counter.stop()
+    stats = download_counter.stats()
+    if stats["pending"] or stats["failed_flushes"]:
+        print(f"  pid {os.getpid()}: pendentes={stats['pending']} falhas de gravação (repetidas)={stats['failed_flushes']}")
+
+def naive_worker(product_id: int, threads: int, downloads: int):
+    def run():
+        for _ in range(downloads):
+            db = SessionLocal()
+            try:
+                product = db.get(Product, product_id)
+                product.download_count += 1
+                db.commit()
+            except Exception:
+                db.rollback()
+            finally:
+                db.close()
+
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+
+def run(label: str, target, product_id: int, processes: int, threads: int, downloads: int):
+    engine.dispose()
+    start = time.perf_counter()
+    workers = [Process(target=target, args=(product_id, threads, downloads)) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    db = SessionLocal()
+    try:
+        counted = db.get(Product, product_id).download_count
+    finally:
+        db.close()
+    expected = processes * threads * downloads
+    status = "OK" if counted == expected else f"PERDIDOS={expected - counted}"
+    print(f"{label:<20} contado={counted:<8} esperado={expected:<8} {status:<14} {elapsed:6.2f}s")
+    return counted == expected
+
+def main():
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    downloads = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        category_id = conn.execute(insert(Category).values(name=f"Stress {time.time()}")).inserted_primary_key[0]
+        buffered_id = conn.execute(insert(Product).values(
+            name="Contador agregado", price=0, category_id=category_id, download_count=0
+        )).inserted_primary_key[0]
+        naive_id = conn.execute(insert(Product).values(
+            name="Read-modify-write", price=0, category_id=category_id, download_count=0
+        )).inserted_primary_key[0]
+
+    ok = run("agregado", buffered_worker, buffered_id, processes, threads, downloads)
+    # O read-modify-write é lento (um commit por download); usa 1/100 do volume
+    run("read-modify-write", naive_worker, naive_id, processes, threads, max(1, downloads // 100))
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark de renderização de emails em campanha (avisos de expiração)
+
+Uso: python benchmarks/email_render_bench.py [mensagens]
+
+Compara o custo por mensagem de compilar o template a cada envio (como
+faziam as funções de email_utils com jinja2.Template de uma string inline)
+com o Environment cacheado atual, renderizando HTML e texto de cada aviso.
+Também mede a pré-compilação na inicialização com o cache de bytecode vazio
+e já populado (novo processo reaproveitando o cache).
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("EMAIL_TEMPLATE_CACHE_DIR", tempfile.mkdtemp())
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+import email_utils
+from email_utils import EMAIL_TEMPLATE_DIR, render_license_expiry_warning
+
+def campaign(count: int) -> list:
+    now = datetime.utcnow()
+    return [
+        (f"FOVDARK-{i:012d}", f"Produto {i % 50}", i % 50, now + timedelta(days=i % 7 + 1), i % 7 + 1)
+        for i in range(count)
+    ]
+
+def render_uncached(rows: list) -> float:
+    """Compilar HTML e texto a cada mensagem (comportamento anterior)"""
+    environment = Environment(
+        loader=FileSystemLoader(EMAIL_TEMPLATE_DIR),
+        autoescape=select_autoescape(["html"]),
+        cache_size=0,
+        keep_trailing_newline=True
+    )
+    environment.globals["site_url"] = email_utils.SITE_URL
+    start = time.perf_counter()
+    for license_key, product_name, product_id, expires_at, days in rows:
+        context = {
+            "product_name": product_name, "license_key": license_key, "days_remaining": days,
+            "expires_at": expires_at.strftime("%d/%m/%Y %H:%M"), "product_id": product_id
+        }
+        environment.get_template("license_expiry_warning.html").render(context)
+        environment.get_template("license_expiry_warning.txt").render(context)
+    return time.perf_counter() - start
+
+def render_cached(rows: list) -> float:
+    email_utils.precompile_email_templates()
+    start = time.perf_counter()
+    for row in rows:
+        render_license_expiry_warning(*row)
+    return time.perf_counter() - start
+
+def precompile_time() -> float:
+    """Pré-compilação em um Environment novo (como na inicialização de um worker)"""
+    email_utils.template_env = email_utils._template_environment()
+    start = time.perf_counter()
+    email_utils.precompile_email_templates()
+    return time.perf_counter() - start
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rows = campaign(count)
+
+    cold = precompile_time()
+    warm = precompile_time()
+    uncached = render_uncached(rows)
+    cached = render_cached(rows)
+
+    print(f"Campanha de {count} avisos (HTML + texto)")
+    print(f"  compilando a cada mensagem: {uncached * 1e6 / count:8.1f} µs/mensagem ({uncached:.2f}s)")
+    print(f"  Environment cacheado:       {cached * 1e6 / count:8.1f} µs/mensagem ({cached:.2f}s)")
+    print(f"  redução: {uncached / cached:.1f}x")
+    print(f"Pré-compilação na inicialização: {cold * 1000:.1f} ms sem cache de bytecode, {warm * 1000:.1f} ms com cache")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Verificação dos planos de consulta dos predicados mais usados
+
+Uso: python benchmarks/index_plan_check.py [url_do_banco]
+
+Popula um SQLite temporário (ou o banco informado, que deve estar vazio),
+atualiza as estatísticas e confere, via EXPLAIN, que cada consulta usa o
+índice esperado em vez de varrer a tabela. Sai com código 1 se algum plano
+regredir; serve como teste de regressão ao alterar modelos ou consultas.
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+_tmp = tempfile.mkdtemp()
+DATABASE_URL = sys.argv[1] if len(sys.argv) > 1 else f"sqlite:///{os.path.join(_tmp, 'plans.db')}"
+os.environ["DATABASE_URL"] = DATABASE_URL
+os.environ.setdefault("RATELIMIT_STORAGE_URL", f"sqlite:///{os.path.join(_tmp, 'ratelimits.db')}")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, desc, func, insert, select, text
+
+from models import Base, User, Category, Product, License, Transaction, Download, SecurityLog
+
+USERS = 5000
+PRODUCTS = 50
+LICENSES = 100_000
+TRANSACTIONS = 100_000
+DOWNLOADS = 200_000
+SECURITY_LOGS = 100_000
+CHUNK = 20000
+
+def seed(engine):
+    now = datetime.utcnow()
+    rnd = random.Random(20)
+
+    def when(days: int = 365) -> datetime:
+        return now - timedelta(seconds=rnd.randint(0, days * 86400))
+
+    def bulk(model, count: int, row):
+        for offset in range(0, count, CHUNK):
+            with engine.begin() as conn:
+                conn.execute(insert(model), [row(i) for i in range(offset, min(offset + CHUNK, count))])
+
+    with engine.begin() as conn:
+        conn.execute(insert(Category), [{"id": 1, "name": "Plans", "is_active": True}])
+        conn.execute(insert(Product), [
+            {"id": i, "name": f"Produto {i}", "price": 10.0, "category_id": 1, "is_active": True}
+            for i in range(1, PRODUCTS + 1)
+        ])
+
+    bulk(User, USERS, lambda i: {
+        "id": i + 1, "email": f"user{i}@plans.local", "username": f"user{i}", "password_hash": "x",
+        "created_at": when()
+    })
+    bulk(License, LICENSES, lambda i: {
+        "license_key": f"PLANS{i:012d}", "user_id": rnd.randint(1, USERS), "product_id": rnd.randint(1, PRODUCTS),
+        "status": rnd.choice(["active", "expired", "expired", "suspended"]), "created_at": when(),
+        "expires_at": now + timedelta(days=rnd.randint(-365, 60))
+    })
+    bulk(Transaction, TRANSACTIONS, lambda i: {
+        "user_id": rnd.randint(1, USERS), "product_id": rnd.randint(1, PRODUCTS), "amount": 19.9,
+        "payment_id": f"plan_{i}", "payment_method": rnd.choice(["pix", "card", "stripe"]),
+        "status": rnd.choice(["approved", "pending", "rejected", "expired"]), "created_at": when()
+    })
+    bulk(Download, DOWNLOADS, lambda i: {
+        "user_id": rnd.randint(1, USERS), "product_id": rnd.randint(1, PRODUCTS),
+        "license_id": rnd.randint(1, LICENSES), "downloaded_at": when()
+    })
+    bulk(SecurityLog, SECURITY_LOGS, lambda i: {
+        "event_type": rnd.choice(["login", "login_failed", "rate_limit_exceeded", "audit"]), "created_at": when()
+    })
+
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+
+def checks():
+    """(descrição, consulta, tabela, índice esperado)"""
+    now = datetime.utcnow()
+    return [
+        ("licença do usuário para o produto", select(License.id).where(
+            License.user_id == 42, License.product_id == 7, License.status == "active", License.expires_at > now
+        ), "licenses", "ix_licenses_user_product_status_expires"),
+        ("licença ativa sem validade (stripe)", select(License.id).where(
+            License.user_id == 42, License.product_id == 7, License.status == "active"
+        ), "licenses", "ix_licenses_user_product_status_expires"),
+        ("licenças ativas do produto", select(func.count(License.id)).where(
+            License.product_id == 7, License.status == "active", License.expires_at > now
+        ), "licenses", "ix_licenses_product_status_expires"),
+        ("varredura de expiração", select(License.id).where(
+            License.status == "active", License.expires_at <= now
+        ).limit(1000), "licenses", "ix_licenses_status_expires"),
+        ("licenças por criação (paginação)", select(License.id).order_by(
+            License.created_at, License.id
+        ).limit(50), "licenses", "ix_licenses_created_at_id"),
+        ("usuários por criação (paginação)", select(User.id).order_by(
+            User.created_at, User.id
+        ).limit(50), "users", "ix_users_created_at_id"),
+        ("transações por status e período", select(func.sum(Transaction.amount)).where(
+            Transaction.status == "approved", Transaction.created_at >= now - timedelta(days=7)
+        ), "transactions", "ix_transactions_status_created_at"),
+        ("downloads do dia", select(func.count(Download.id)).where(
+            Download.downloaded_at >= datetime.combine(now.date(), datetime.min.time())
+        ), "downloads", "ix_downloads_downloaded_at"),
+        ("logs recentes", select(SecurityLog.id).where(
+            SecurityLog.created_at >= now - timedelta(days=30)
+        ).order_by(desc(SecurityLog.created_at)).limit(100), "security_logs", "ix_security_logs_created_at"),
+    ]
+
+def sqlite_plan(conn, sql: str) -> list:
+    return [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+
+def sqlite_uses_index(plan: list, table: str, index: str) -> bool:
+    steps = [step for step in plan if f" {table} " in f" {step} "]
+    return bool(steps) and all(f"INDEX {index}" in step for step in steps)
+
+def postgres_plan(conn, sql: str) -> list:
+    return conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}").scalar()
+
+def postgres_uses_index(plan, table: str, index: str) -> bool:
+    nodes = []
+
+    def walk(node):
+        nodes.append(node)
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(plan[0]["Plan"])
+    if any(node.get("Relation Name") == table and node["Node Type"] == "Seq Scan" for node in nodes):
+        return False
+    return any(node.get("Index Name") == index for node in nodes)
+
+def main():
+    engine = create_engine(DATABASE_URL)
+    Base.metadata.create_all(bind=engine)
+    seed(engine)
+
+    is_postgres = engine.dialect.name == "postgresql"
+    failures = 0
+    with engine.connect() as conn:
+        for label, query, table, index in checks():
+            sql = str(query.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+            if is_postgres:
+                plan = postgres_plan(conn, sql)
+                ok = postgres_uses_index(plan, table, index)
+                detail = json.dumps(plan)[:200]
+            else:
+                plan = sqlite_plan(conn, sql)
+                ok = sqlite_uses_index(plan, table, index)
+                detail = " | ".join(plan)
+            failures += not ok
+            print(f"{'OK   ' if ok else 'FALHA'} {label:<38} {index}")
+            if not ok:
+                print(f"      plano: {detail}")
+
+    if failures:
+        print(f"{failures} consulta(s) sem o índice esperado")
+        sys.exit(1)
+    print("Todos os predicados usam os índices esperados")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark do custo por verificação de rate limit (memory:// x sqlite://)
+
+Uso: python benchmarks/rate_limit_bench.py [iterações] [processos]
+
+Mede a latência de FixedWindowRateLimiter.hit em cada armazenamento e, com
+vários processos simulando os workers do gunicorn, confirma que o contador
+do SQLite é compartilhado (o total contado deve ser processos x iterações).
+"""
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from limits import RateLimitItemPerMinute
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter
+import rate_limit_store  # registra o esquema sqlite://
+
+ITEM = RateLimitItemPerMinute(10 ** 9)
+
+def run_checks(uri: str, iterations: int, key: str = "bench") -> list:
+    limiter = FixedWindowRateLimiter(storage_from_string(uri))
+    timings = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        limiter.hit(ITEM, key, str(i % 100))
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def report(label: str, timings: list):
+    timings = sorted(timings)
+    total = len(timings)
+    mean = sum(timings) / total
+    p50 = timings[total // 2]
+    p99 = timings[min(total - 1, int(total * 0.99))]
+    print(f"{label:<28} n={total:<8} média={mean * 1e6:8.1f}µs  p50={p50 * 1e6:8.1f}µs  p99={p99 * 1e6:8.1f}µs")
+
+def _worker(args):
+    uri, iterations = args
+    limiter = FixedWindowRateLimiter(storage_from_string(uri))
+    start = time.perf_counter()
+    for _ in range(iterations):
+        limiter.hit(ITEM, "shared", "ip")
+    return time.perf_counter() - start
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite_uri = f"sqlite:///{os.path.join(tmp, 'ratelimits.db')}"
+
+        report("memory:// (1 processo)", run_checks("memory://", iterations))
+        report("sqlite:// (1 processo)", run_checks(sqlite_uri, iterations))
+
+        with Pool(processes) as pool:
+            elapsed = pool.map(_worker, [(sqlite_uri, iterations)] * processes)
+
+        counted = FixedWindowRateLimiter(storage_from_string(sqlite_uri)).get_window_stats(ITEM, "shared", "ip")
+        used = ITEM.amount - counted.remaining
+        per_check = max(elapsed) / iterations
+        print(f"sqlite:// ({processes} processos)        {per_check * 1e6:8.1f}µs por verificação; "
+              f"contado={used} esperado={processes * iterations}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Snapshot imutável do catálogo (produtos e categorias) em memória
+"""
+import re
+import threading
+import time
+import unicodedata
+import logging
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from types import MappingProxyType
+from typing import Mapping, Optional
+
+from sqlalchemy.orm import Session, joinedload
+
+from config import get_config
+from models import Category, Product
+from page_cache import invalidate_catalog_pages
+
+logger = logging.getLogger(__name__)
+
+config = get_config()
+
+def slugify(value: str) -> str:
+    """Converter nome em slug (sem acentos, minúsculo, separado por hífens)"""
+    value = unicodedata.normalize("NFKD", value or "").encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z0-9]+", "-", value.lower()).strip("-")
+
+@dataclass(frozen=True)
+class CategoryView:
+    """Categoria ativa do catálogo"""
+    id: int
+    name: str
+    description: Optional[str]
+    icon: Optional[str]
+    slug: str
+
+    @classmethod
+    def from_category(cls, category: Category) -> "CategoryView":
+        return cls(
+            id=category.id,
+            name=category.name,
+            description=category.description,
+            icon=category.icon,
+            slug=slugify(category.name)
+        )
+
+@dataclass(frozen=True)
+class ProductView:
+    """Produto ativo do catálogo, com categoria e tags já resolvidas"""
+    id: int
+    name: str
+    description: Optional[str]
+    price: float
+    category_id: int
+    category: CategoryView
+    duration_days: Optional[int]
+    image_url: Optional[str]
+    download_url: Optional[str]
+    requirements: Optional[str]
+    tags: Optional[str]
+    tags_list: tuple
+    is_active: bool
+    is_featured: bool
+    download_count: int
+    stripe_price_id: Optional[str]
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+
+    @classmethod
+    def from_product(cls, product: Product, category: CategoryView) -> "ProductView":
+        return cls(
+            id=product.id,
+            name=product.name,
+            description=product.description,
+            price=product.price,
+            category_id=product.category_id,
+            category=category,
+            duration_days=product.duration_days,
+            image_url=product.image_url,
+            download_url=product.download_url,
+            requirements=product.requirements,
+            tags=product.tags,
+            tags_list=tuple(product.tags_list),
+            is_active=bool(product.is_active),
+            is_featured=bool(product.is_featured),
+            download_count=product.download_count or 0,
+            stripe_price_id=product.stripe_price_id,
+            created_at=product.created_at,
+            updated_at=product.updated_at
+        )
+
+    @property
+    def is_free(self) -> bool:
+        return self.price == 0.0 or self.price is None
+
+    @property
+    def is_paid(self) -> bool:
+        return not self.is_free
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """Versão imutável do catálogo com os índices usados pelas rotas"""
+    version: int
+    built_at: float
+    categories: tuple
+    products: tuple
+    by_id: Mapping[int, ProductView]
+    by_category: Mapping[int, tuple]
+    featured: tuple
+    by_tag: Mapping[str, tuple]
+    category_slugs: Mapping[str, CategoryView]
+
+    def get_product(self, product_id: int) -> Optional[ProductView]:
+        return self.by_id.get(product_id)
+
+    def products_in_category(self, category_id: int) -> tuple:
+        return self.by_category.get(category_id, ())
+
+    def products_with_tag(self, tag: str) -> tuple:
+        return self.by_tag.get(tag.strip().lower(), ())
+
+    def find_category(self, name: str) -> Optional[CategoryView]:
+        """Categoria pelo slug exato ou, em seguida, por correspondência parcial"""
+        slug = slugify(name)
+        if not slug:
+            return None
+        category = self.category_slugs.get(slug)
+        if category:
+            return category
+        for category in self.categories:
+            if slug in category.slug:
+                return category
+        return None
+
+    def related(self, product: ProductView, limit: int = 4) -> list:
+        """Produtos da mesma categoria, priorizando os que compartilham tags"""
+        shared = Counter()
+        for tag in product.tags_list:
+            for other in self.products_with_tag(tag):
+                shared[other.id] += 1
+
+        candidates = [p for p in self.products_in_category(product.category_id) if p.id != product.id]
+        candidates.sort(key=lambda p: -shared[p.id])
+        return candidates[:limit]
+
+def build_catalog(db: Session, version: int = 0) -> CatalogSnapshot:
+    """Montar snapshot a partir do banco (uma consulta por tabela)"""
+    categories = {
+        category.id: CategoryView.from_category(category)
+        for category in db.query(Category).filter(Category.is_active == True).order_by(Category.id)
+    }
+
+    products = []
+    query = db.query(Product).options(joinedload(Product.category, innerjoin=True)).filter(
+        Product.is_active == True
+    ).order_by(Product.id)
+    for product in query:
+        category = categories.get(product.category_id) or CategoryView.from_category(product.category)
+        products.append(ProductView.from_product(product, category))
+
+    by_category: dict = {}
+    by_tag: dict = {}
+    for product in products:
+        by_category.setdefault(product.category_id, []).append(product)
+        for tag in product.tags_list:
+            by_tag.setdefault(tag.lower(), []).append(product)
+
+    return CatalogSnapshot(
+        version=version,
+        built_at=time.monotonic(),
+        categories=tuple(categories.values()),
+        products=tuple(products),
+        by_id=MappingProxyType({product.id: product for product in products}),
+        by_category=MappingProxyType({key: tuple(value) for key, value in by_category.items()}),
+        featured=tuple(product for product in products if product.is_featured),
+        by_tag=MappingProxyType({key: tuple(value) for key, value in by_tag.items()}),
+        category_slugs=MappingProxyType({category.slug: category for category in categories.values()})
+    )
+
+class CatalogStore:
+    """Mantém o snapshot atual e o substitui atomicamente.
+
+    Leituras nunca bloqueiam após a primeira carga: quando o snapshot passa
+    de `max_age` segundos ele é reconstruído em segundo plano (o que também
+    traz alterações feitas por outros workers), e alterações no catálogo
+    feitas neste worker chamam `refresh()` imediatamente.
+    """
+
+    def __init__(self, max_age: float = 60.0):
+        self.max_age = max_age
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._build_lock = threading.Lock()
+        self._refreshing = threading.Event()
+        self._version = 0
+
+    def get(self) -> CatalogSnapshot:
+        """Snapshot atual (carrega na primeira chamada)"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return self.refresh()
+        if time.monotonic() - snapshot.built_at > self.max_age:
+            self._refresh_in_background()
+        return snapshot
+
+    def refresh(self) -> CatalogSnapshot:
+        """Reconstruir o snapshot a partir do banco e publicá-lo"""
+        from database import SessionLocal
+
+        with self._build_lock:
+            db = SessionLocal()
+            try:
+                self._version += 1
+                snapshot = build_catalog(db, version=self._version)
+            finally:
+                db.close()
+            self._snapshot = snapshot
+        logger.info(f"Catálogo carregado: versão {snapshot.version}, {len(snapshot.products)} produtos")
+        return snapshot
+
+    def _refresh_in_background(self):
+        if self._refreshing.is_set():
+            return
+        self._refreshing.set()
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Erro ao atualizar catálogo: {e}")
+            finally:
+                self._refreshing.clear()
+
+        threading.Thread(target=run, name="catalog-refresh", daemon=True).start()
+
+catalog_store = CatalogStore(max_age=config.CATALOG_MAX_AGE_SECONDS)
+
+def get_catalog() -> CatalogSnapshot:
+    """Snapshot atual do catálogo"""
+    return catalog_store.get()
+
+def invalidate_catalog():
+    """Publicar novo snapshot e descartar páginas cacheadas após alterações"""
+    try:
+        catalog_store.refresh()
+    except Exception as e:
+        logger.error(f"Erro ao recarregar catálogo: {e}")
+    invalidate_catalog_pages()
@@ -2,6 +2,7 @@
 Configurações centralizadas da aplicação FovDark Gaming
 """
 import os
+import tempfile
 from typing import Optional
 from datetime import timedelta
 
@@ -16,6 +17,41 @@ class Config:
     JWT_ALGORITHM: str = os.getenv("JWT_ALGORITHM", "HS256")
     JWT_ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("JWT_ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
     
+    # Hash de senhas (bcrypt)
+    # Alterar BCRYPT_ROUNDS faz com que as senhas sejam refeitas no próximo login
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+    
+    # Cache de páginas do catálogo (por processo)
+    PAGE_CACHE_TTL_SECONDS: int = int(os.getenv("PAGE_CACHE_TTL_SECONDS", "60"))
+    PAGE_CACHE_MAX_SIZE: int = int(os.getenv("PAGE_CACHE_MAX_SIZE", "500"))
+    
+    # Snapshot do catálogo em memória: idade máxima antes de recarregar em segundo plano
+    CATALOG_MAX_AGE_SECONDS: int = int(os.getenv("CATALOG_MAX_AGE_SECONDS", "60"))
+    
+    # Janela de cache das estatísticas do painel administrativo
+    ADMIN_STATS_CACHE_SECONDS: int = int(os.getenv("ADMIN_STATS_CACHE_SECONDS", "60"))
+    
+    # Cache do usuário autenticado (por processo; o TTL limita dados desatualizados entre workers)
+    PRINCIPAL_CACHE_TTL_SECONDS: int = int(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "30"))
+    PRINCIPAL_CACHE_MAX_SIZE: int = int(os.getenv("PRINCIPAL_CACHE_MAX_SIZE", "5000"))
+    
+    # Tokens de licença verificáveis offline pelos clientes
+    # Com LICENSE_TOKEN_PRIVATE_KEY (PEM Ed25519, requer o pacote cryptography) os tokens
+    # usam EdDSA e o cliente valida com a chave pública; sem ela usam HMAC (HS256)
+    # LICENSE_TOKEN_PUBLIC_KEY é opcional: se ausente, é derivada da chave privada
+    LICENSE_TOKEN_SECRET: str = os.getenv("LICENSE_TOKEN_SECRET", "dev-license-token-secret-change-in-production")
+    LICENSE_TOKEN_PRIVATE_KEY: Optional[str] = os.getenv("LICENSE_TOKEN_PRIVATE_KEY")
+    LICENSE_TOKEN_PUBLIC_KEY: Optional[str] = os.getenv("LICENSE_TOKEN_PUBLIC_KEY")
+    LICENSE_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("LICENSE_TOKEN_EXPIRE_MINUTES", "1440"))
+    
+    # URLs de download assinadas (HMAC, validade curta)
+    # DOWNLOAD_OFFLOAD: vazio (o app envia o arquivo), "x-accel" (nginx) ou "x-sendfile" (Apache/lighttpd)
+    DOWNLOAD_URL_SECRET: str = os.getenv("DOWNLOAD_URL_SECRET", "dev-download-url-secret-change-in-production")
+    DOWNLOAD_URL_TTL_SECONDS: int = int(os.getenv("DOWNLOAD_URL_TTL_SECONDS", "600"))
+    DOWNLOAD_OFFLOAD: str = os.getenv("DOWNLOAD_OFFLOAD", "")
+    DOWNLOAD_ACCEL_PREFIX: str = os.getenv("DOWNLOAD_ACCEL_PREFIX", "/protected-downloads/")
+    
     # Application Configuration
     SECRET_KEY: str = os.getenv("SECRET_KEY", "dev-flask-secret-change-in-production")
     DEBUG: bool = os.getenv("DEBUG", "false").lower() == "true"
@@ -44,7 +80,81 @@ class Config:
     ALLOWED_EXTENSIONS: set = {"png", "jpg", "jpeg", "gif", "pdf", "zip", "rar"}
     
     # Rate Limiting
-    RATELIMIT_STORAGE_URL: str = os.getenv("RATELIMIT_STORAGE_URL", "memory://")
+    # sqlite:///arquivo compartilha os contadores entre os workers do gunicorn (rate_limit_store.py)
+    RATELIMIT_STORAGE_URL: str = os.getenv("RATELIMIT_STORAGE_URL", "sqlite:///ratelimits.db")
+    # Proxies confiáveis na frente da aplicação (roteador do Render/Heroku = 1); o IP do
+    # cliente é o que o último deles acrescentou ao X-Forwarded-For. 0 = sem proxy
+    TRUSTED_PROXY_HOPS: int = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+    
+    # Cache de verificação de licenças
+    LICENSE_CACHE_TTL_SECONDS: int = int(os.getenv("LICENSE_CACHE_TTL_SECONDS", "60"))
+    LICENSE_CACHE_NEGATIVE_TTL_SECONDS: int = int(os.getenv("LICENSE_CACHE_NEGATIVE_TTL_SECONDS", "30"))
+    LICENSE_CACHE_MAX_SIZE: int = int(os.getenv("LICENSE_CACHE_MAX_SIZE", "10000"))
+    LICENSE_BATCH_MAX_ITEMS: int = int(os.getenv("LICENSE_BATCH_MAX_ITEMS", "300"))
+    
+    # Gravação em lote de License.last_verified
+    LAST_VERIFIED_FLUSH_SECONDS: float = float(os.getenv("LAST_VERIFIED_FLUSH_SECONDS", "10"))
+    LAST_VERIFIED_FLUSH_MAX_ENTRIES: int = int(os.getenv("LAST_VERIFIED_FLUSH_MAX_ENTRIES", "500"))
+    
+    # Cache dos hashes (ETag) dos arquivos dos produtos; fora de static/ e do repositório
+    FILE_HASH_CACHE_DIR: str = os.getenv("FILE_HASH_CACHE_DIR", os.path.join(tempfile.gettempdir(), "fovdark-file-hashes"))
+    
+    # Gravação em lote de Product.download_count
+    DOWNLOAD_COUNT_FLUSH_SECONDS: float = float(os.getenv("DOWNLOAD_COUNT_FLUSH_SECONDS", "5"))
+    DOWNLOAD_COUNT_FLUSH_MAX_ENTRIES: int = int(os.getenv("DOWNLOAD_COUNT_FLUSH_MAX_ENTRIES", "200"))
+    
+    # Fila de eventos (downloads e logs de segurança) gravados em lote
+    # EVENT_OVERFLOW_POLICY com a fila cheia: "block", "spill" (arquivo local) ou "drop"
+    EVENT_QUEUE_MAX_SIZE: int = int(os.getenv("EVENT_QUEUE_MAX_SIZE", "10000"))
+    EVENT_BATCH_SIZE: int = int(os.getenv("EVENT_BATCH_SIZE", "500"))
+    EVENT_FLUSH_SECONDS: float = float(os.getenv("EVENT_FLUSH_SECONDS", "1"))
+    EVENT_OVERFLOW_POLICY: str = os.getenv("EVENT_OVERFLOW_POLICY", "spill")
+    EVENT_SPILL_PATH: str = os.getenv("EVENT_SPILL_PATH", "event_spill.ndjson")
+    
+    # Retenção de logs de segurança e downloads (arquivados em NDJSON.gz antes de remover)
+    # SECURITY_LOG_RETENTION_BY_TYPE: "tipo:dias,..." (ex.: "rate_limit_exceeded:30,audit:730")
+    # RETENTION_ENABLED liga a execução periódica pelo agendador (remove dados; desligada por padrão)
+    RETENTION_ENABLED: bool = os.getenv("RETENTION_ENABLED", "false").lower() == "true"
+    SECURITY_LOG_RETENTION_DAYS: int = int(os.getenv("SECURITY_LOG_RETENTION_DAYS", "180"))
+    SECURITY_LOG_RETENTION_BY_TYPE: str = os.getenv("SECURITY_LOG_RETENTION_BY_TYPE", "")
+    DOWNLOAD_RETENTION_DAYS: int = int(os.getenv("DOWNLOAD_RETENTION_DAYS", "730"))
+    RETENTION_ARCHIVE_DIR: str = os.getenv("RETENTION_ARCHIVE_DIR", "archive")
+    RETENTION_BATCH_SIZE: int = int(os.getenv("RETENTION_BATCH_SIZE", "5000"))
+    
+    # Agendador de tarefas periódicas (executadas por um único worker, eleito por lock)
+    # A liderança é um lease em leader_leases (funciona com pgbouncer/Supabase em modo transação);
+    # sem renovação, outro worker assume após LEADER_LEASE_SECONDS
+    SCHEDULER_ENABLED: bool = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true"
+    LEADER_LEASE_SECONDS: int = int(os.getenv("LEADER_LEASE_SECONDS", "60"))
+    LICENSE_SWEEP_SECONDS: int = int(os.getenv("LICENSE_SWEEP_SECONDS", "60"))
+    LICENSE_SWEEP_BATCH_SIZE: int = int(os.getenv("LICENSE_SWEEP_BATCH_SIZE", "1000"))
+    TOKEN_CLEANUP_SECONDS: int = int(os.getenv("TOKEN_CLEANUP_SECONDS", "3600"))
+    ROLLUP_COMPACT_SECONDS: int = int(os.getenv("ROLLUP_COMPACT_SECONDS", "3600"))
+    RETENTION_RUN_SECONDS: int = int(os.getenv("RETENTION_RUN_SECONDS", "86400"))
+    
+    # Avisos de expiração de licença: dias de antecedência de cada aviso
+    EXPIRY_WARNING_DAYS: str = os.getenv("EXPIRY_WARNING_DAYS", "7,3,1")
+    EXPIRY_WARNING_SECONDS: int = int(os.getenv("EXPIRY_WARNING_SECONDS", "3600"))
+    EXPIRY_WARNING_BATCH_SIZE: int = int(os.getenv("EXPIRY_WARNING_BATCH_SIZE", "200"))
+    
+    # Fila de emails (outbox): enviada por um único worker, com conexão SMTP reutilizada
+    MAIL_SENDER_ENABLED: bool = os.getenv("MAIL_SENDER_ENABLED", "true").lower() == "true"
+    MAIL_POLL_SECONDS: float = float(os.getenv("MAIL_POLL_SECONDS", "5"))
+    MAIL_BATCH_SIZE: int = int(os.getenv("MAIL_BATCH_SIZE", "50"))
+    MAIL_RATE_PER_MINUTE: int = int(os.getenv("MAIL_RATE_PER_MINUTE", "120"))  # 0 = sem limite
+    MAIL_MAX_ATTEMPTS: int = int(os.getenv("MAIL_MAX_ATTEMPTS", "8"))
+    MAIL_RETRY_BASE_SECONDS: int = int(os.getenv("MAIL_RETRY_BASE_SECONDS", "60"))
+    MAIL_SMTP_IDLE_SECONDS: int = int(os.getenv("MAIL_SMTP_IDLE_SECONDS", "60"))
+    MAIL_OUTBOX_RETENTION_DAYS: int = int(os.getenv("MAIL_OUTBOX_RETENTION_DAYS", "30"))
+    
+    # Webhooks do Stripe: recebidos e confirmados na hora, processados por um único worker
+    STRIPE_WEBHOOK_SECRET: str = os.getenv("STRIPE_WEBHOOK_SECRET", "")
+    STRIPE_WEBHOOK_WORKER_ENABLED: bool = os.getenv("STRIPE_WEBHOOK_WORKER_ENABLED", "true").lower() == "true"
+    STRIPE_WEBHOOK_POLL_SECONDS: float = float(os.getenv("STRIPE_WEBHOOK_POLL_SECONDS", "2"))
+    STRIPE_WEBHOOK_BATCH_SIZE: int = int(os.getenv("STRIPE_WEBHOOK_BATCH_SIZE", "20"))
+    STRIPE_WEBHOOK_MAX_ATTEMPTS: int = int(os.getenv("STRIPE_WEBHOOK_MAX_ATTEMPTS", "10"))
+    STRIPE_WEBHOOK_RETRY_BASE_SECONDS: int = int(os.getenv("STRIPE_WEBHOOK_RETRY_BASE_SECONDS", "30"))
+    STRIPE_WEBHOOK_RETENTION_DAYS: int = int(os.getenv("STRIPE_WEBHOOK_RETENTION_DAYS", "90"))
     
     # Logging Configuration
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
@@ -77,6 +187,15 @@ class Config:
             if cls.SECRET_KEY == "dev-flask-secret-change-in-production":
                 errors.append("SECRET_KEY deve ser alterado em produção")
             
+            if not cls.LICENSE_TOKEN_PRIVATE_KEY and cls.LICENSE_TOKEN_SECRET == "dev-license-token-secret-change-in-production":
+                errors.append("LICENSE_TOKEN_SECRET ou LICENSE_TOKEN_PRIVATE_KEY deve ser configurado em produção")
+            
+            if cls.DOWNLOAD_URL_SECRET == "dev-download-url-secret-change-in-production":
+                errors.append("DOWNLOAD_URL_SECRET deve ser alterado em produção")
+            
+            if os.getenv("STRIPE_SECRET_KEY") and not cls.STRIPE_WEBHOOK_SECRET:
+                errors.append("STRIPE_WEBHOOK_SECRET deve ser configurado em produção (webhooks sem assinatura são recusados)")
+            
             if not cls.DATABASE_URL or cls.DATABASE_URL.startswith("sqlite"):
                 errors.append("DATABASE_URL deve ser PostgreSQL em produção")
         
@@ -0,0 +1,52 @@
+"""
+Contador de downloads por produto agregado em memória e gravado em lote
+"""
+import operator
+import logging
+
+from sqlalchemy import bindparam, func, update
+
+from config import get_config
+from models import Product
+from write_behind import WriteBehindBuffer
+
+logger = logging.getLogger(__name__)
+
+config = get_config()
+
+def _flush_download_counts(batch: dict):
+    """Somar os incrementos acumulados em Product.download_count (uma transação por lote)"""
+    from database import SessionLocal
+    
+    products = Product.__table__
+    stmt = update(products).where(products.c.id == bindparam("product_id")).values(
+        download_count=func.coalesce(products.c.download_count, 0) + bindparam("increment")
+    )
+    
+    db = SessionLocal()
+    try:
+        # Ordem fixa dos produtos evita deadlock entre workers gravando ao mesmo tempo
+        db.connection().execute(stmt, [
+            {"product_id": product_id, "increment": increment}
+            for product_id, increment in sorted(batch.items()) if increment
+        ])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+# Incrementos por produto somados em memória; cada gravação é download_count = download_count + N,
+# e lotes que falham voltam ao buffer, então nenhum incremento se perde ou é contado duas vezes
+download_counter = WriteBehindBuffer(
+    "download_count",
+    _flush_download_counts,
+    merge=operator.add,
+    interval=config.DOWNLOAD_COUNT_FLUSH_SECONDS,
+    max_entries=config.DOWNLOAD_COUNT_FLUSH_MAX_ENTRIES
+)
+
+def record_product_download(product_id: int, amount: int = 1):
+    """Contabilizar download(s) do produto (gravado no próximo flush)"""
+    download_counter.add(product_id, amount)
@@ -1,10 +1,15 @@
 import os
+import re
 import asyncio
-from sqlalchemy import create_engine, text
+import threading
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from models import Base, Category, User
 from config import get_config
+from rollups import backfill_rollups  # também registra a manutenção incremental dos rollups
 import logging
 
 logger = logging.getLogger(__name__)
@@ -41,6 +46,41 @@ else:
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def get_async_database_url(url: str) -> str:
+    """Converter a URL síncrona para o driver assíncrono equivalente"""
+    url_obj = make_url(url)
+    if url_obj.get_backend_name() == "sqlite":
+        return url_obj.set(drivername="sqlite+aiosqlite").render_as_string(hide_password=False)
+    
+    # asyncpg não aceita sslmode na URL; o SSL é passado em connect_args
+    query = {k: v for k, v in url_obj.query.items() if k != "sslmode"}
+    return url_obj.set(drivername="postgresql+asyncpg", query=query).render_as_string(hide_password=False)
+
+# Engine assíncrono (aiosqlite/asyncpg) para as rotas já portadas
+ASYNC_DATABASE_URL = get_async_database_url(DATABASE_URL)
+
+if DATABASE_URL.startswith("sqlite"):
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=False)
+else:
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        pool_pre_ping=True,
+        pool_recycle=300,
+        pool_size=10,
+        max_overflow=20,
+        pool_timeout=30,
+        echo=False,
+        connect_args={
+            "ssl": "require",
+            "timeout": 30,
+            # Compatível com o pooler do Supabase (pgbouncer em modo transação)
+            "statement_cache_size": 0,
+            "server_settings": {"application_name": "FovDark_Gaming"}
+        }
+    )
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 def get_db():
     """Dependency para obter sessão do banco"""
     db = SessionLocal()
@@ -49,20 +89,125 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """Dependency para obter sessão assíncrona do banco"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def create_tables():
     """Criar todas as tabelas e dados iniciais"""
     try:
         # Criar todas as tabelas
         Base.metadata.create_all(bind=engine)
+        build_missing_indexes()
         logger.info("Tabelas criadas com sucesso")
         
         # Criar dados iniciais
         create_initial_data()
         
+        # Popular rollups de estatísticas em bancos que já têm eventos
+        db = SessionLocal()
+        try:
+            backfill_rollups(db)
+        finally:
+            db.close()
+        
     except Exception as e:
         logger.error(f"Erro ao criar tabelas: {e}")
         raise
 
+def ensure_indexes(bind=None) -> list:
+    """Criar os índices declarados nos modelos que ainda não existem no banco
+    
+    `create_all` não altera tabelas existentes; esta função completa os
+    índices de bancos já criados (SQLite ou Supabase). No PostgreSQL os
+    índices são criados com CONCURRENTLY, sem bloquear gravações, e índices
+    inválidos deixados por uma criação interrompida são recriados. Um índice
+    ainda em construção por outra sessão também aparece como inválido: esse
+    é ignorado, não removido. Na inicialização use `build_missing_indexes`,
+    que executa esta função em um único worker.
+    """
+    bind = bind or engine
+    is_postgres = bind.dialect.name == "postgresql"
+    inspector = inspect(bind)
+    created = []
+    
+    invalid = set()
+    building = set()
+    if is_postgres:
+        with bind.connect() as conn:
+            for name, in_progress in conn.execute(text(
+                "SELECT c.relname, EXISTS (SELECT 1 FROM pg_stat_progress_create_index p WHERE p.index_relid = i.indexrelid) "
+                "FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE NOT i.indisvalid"
+            )):
+                (building if in_progress else invalid).add(name)
+    
+    for table in Base.metadata.sorted_tables:
+        if not table.indexes or not inspector.has_table(table.name):
+            continue
+        reflected = [index for index in inspector.get_indexes(table.name) if index["name"] not in invalid]
+        reflected += inspector.get_unique_constraints(table.name)
+        existing = {index["name"] for index in reflected}
+        # Índices equivalentes criados com outro nome (ex.: migration_supabase.sql)
+        existing_columns = {tuple(index["column_names"]) for index in reflected}
+        
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name in building:
+                logger.info(f"Índice {index.name} em construção por outra sessão")
+                continue
+            if index.name in existing or tuple(column.name for column in index.columns) in existing_columns:
+                continue
+            try:
+                ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=bind.dialect))
+                with bind.connect() as conn:
+                    if is_postgres:
+                        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+                        if index.name in invalid:
+                            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"'))
+                        # Tabelas particionadas não aceitam CONCURRENTLY
+                        partitioned = conn.execute(text(
+                            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:name)"
+                        ), {"name": table.name}).first()
+                        if not partitioned:
+                            ddl = re.sub(r"^CREATE (UNIQUE )?INDEX", r"CREATE \1INDEX CONCURRENTLY", ddl)
+                    conn.execute(text(ddl))
+                    conn.commit()
+                created.append(index.name)
+                logger.info(f"Índice criado: {index.name}")
+            except Exception as e:
+                logger.error(f"Erro ao criar índice {index.name}: {e}")
+    
+    return created
+
+def build_missing_indexes(wait: bool = False) -> bool:
+    """Executar `ensure_indexes` em um único worker (lease "ensure_indexes")
+    
+    Os demais workers seguem a inicialização sem criar nada. Por padrão a
+    criação roda em uma thread, para que índices grandes não atrasem o boot;
+    com `wait=True` (linha de comando) roda na hora. Retorna False se outro
+    worker já está criando os índices.
+    """
+    from scheduler import LeaderLock
+    
+    lock = LeaderLock("ensure_indexes")
+    if not lock.acquire():
+        logger.info("Índices sendo verificados por outro worker")
+        return False
+    
+    def run():
+        try:
+            ensure_indexes()
+        except Exception as e:
+            logger.error(f"Erro ao criar índices: {e}")
+        finally:
+            lock.release()
+    
+    if wait:
+        run()
+    else:
+        threading.Thread(target=run, name="ensure-indexes", daemon=True).start()
+    return True
+
 def create_initial_data():
     """Criar dados iniciais do sistema"""
     db = SessionLocal()
@@ -130,14 +275,22 @@ def create_initial_data():
     finally:
         db.close()
 
-def init_db():
+def init_db(wait_for_indexes: bool = False):
     """Inicializar banco de dados de forma síncrona"""
     try:
         Base.metadata.create_all(bind=engine)
+        build_missing_indexes(wait=wait_for_indexes)
         
         # Criar dados iniciais
         create_initial_data()
         
+        # Popular rollups de estatísticas em bancos que já têm eventos
+        db = SessionLocal()
+        try:
+            backfill_rollups(db)
+        finally:
+            db.close()
+        
         logger.info("Banco de dados inicializado com sucesso")
         
     except Exception as e:
@@ -175,6 +328,6 @@ def reset_database():
 if __name__ == "__main__":
     # Testar conexão e inicializar banco
     if test_connection():
-        init_db()
+        init_db(wait_for_indexes=True)
     else:
         logger.error("Falha na conexão com o banco de dados")
@@ -0,0 +1,145 @@
+"""
+URLs de download assinadas (HMAC) e com validade curta
+
+O app emite /dl/<token>/<arquivo> depois de conferir a licença. O token
+carrega usuário, licença, produto, caminho do arquivo e expiração, e é
+validado sem consulta ao banco: pelo `download_app` abaixo, que responde
+com X-Accel-Redirect (nginx) ou X-Sendfile (Apache/lighttpd) conforme
+DOWNLOAD_OFFLOAD, ou envia o próprio arquivo quando não há servidor
+estático na frente. Links vazados deixam de funcionar ao expirar.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+import logging
+from dataclasses import dataclass
+from typing import Optional
+from urllib.parse import quote
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from config import get_config
+from file_server import SecureFileResponse, get_file_info, resolve_download_path
+
+logger = logging.getLogger(__name__)
+
+config = get_config()
+
+# Prefixo em que o download_app é montado
+DOWNLOAD_PATH_PREFIX = "/dl"
+
+@dataclass(frozen=True)
+class DownloadGrant:
+    """Autorização de download contida em um token válido"""
+    user_id: int
+    license_id: int
+    product_id: int
+    path: str
+    expires_at: int
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+def _b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+def _signature(payload: str) -> str:
+    digest = hmac.new(config.DOWNLOAD_URL_SECRET.encode(), payload.encode(), hashlib.sha256).digest()
+    return _b64encode(digest)
+
+def _relative_path(download_url: str) -> Optional[str]:
+    path = resolve_download_path(download_url)
+    if not path:
+        return None
+    return os.path.relpath(path, os.path.abspath("."))
+
+def sign_download(user_id: int, license_id: int, product_id: int, download_url: str,
+                  ttl: Optional[int] = None) -> str:
+    """Token assinado para o arquivo de download_url (ValueError se não for arquivo local)"""
+    path = _relative_path(download_url)
+    if not path:
+        raise ValueError("Arquivo de download inválido")
+    expires_at = int(time.time()) + (ttl or config.DOWNLOAD_URL_TTL_SECONDS)
+    payload = _b64encode(json.dumps(
+        {"u": user_id, "l": license_id, "p": product_id, "f": path, "e": expires_at},
+        separators=(",", ":")
+    ).encode())
+    return f"{payload}.{_signature(payload)}"
+
+def signed_download_url(user_id: int, license_id: int, product_id: int, download_url: str,
+                        filename: str, ttl: Optional[int] = None) -> str:
+    """URL relativa /dl/<token>/<arquivo> para o download autorizado"""
+    token = sign_download(user_id, license_id, product_id, download_url, ttl)
+    return f"{DOWNLOAD_PATH_PREFIX}/{token}/{quote(filename)}"
+
+def verify_download_token(token: str) -> DownloadGrant:
+    """Validar assinatura e expiração do token (ValueError se inválido)"""
+    try:
+        payload, signature = token.split(".", 1)
+    except ValueError:
+        raise ValueError("Token de download inválido")
+
+    if not hmac.compare_digest(signature, _signature(payload)):
+        raise ValueError("Token de download inválido")
+
+    try:
+        data = json.loads(_b64decode(payload))
+        grant = DownloadGrant(
+            user_id=int(data["u"]),
+            license_id=int(data["l"]),
+            product_id=int(data["p"]),
+            path=str(data["f"]),
+            expires_at=int(data["e"])
+        )
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Token de download inválido")
+
+    if grant.expires_at < time.time():
+        raise ValueError("Link de download expirado")
+    return grant
+
+async def serve_download(request: Request) -> Response:
+    """Validar o token e entregar o arquivo (ou delegá-lo ao servidor estático)"""
+    try:
+        grant = verify_download_token(request.path_params["token"])
+    except ValueError as e:
+        return JSONResponse({"success": False, "message": str(e)}, status_code=403)
+
+    # Caminho confinado ao diretório da aplicação antes de qualquer entrega
+    path = resolve_download_path(grant.path)
+    if not path or not os.path.isfile(path):
+        return JSONResponse({"success": False, "message": "Arquivo não encontrado no servidor"}, status_code=404)
+    filename = request.path_params["filename"]
+    offload = config.DOWNLOAD_OFFLOAD.lower()
+
+    if offload == "x-accel":
+        # nginx: location <DOWNLOAD_ACCEL_PREFIX> { internal; alias <diretório da aplicação>/; }
+        relative_path = os.path.relpath(path, os.path.abspath("."))
+        return Response(headers={
+            "X-Accel-Redirect": config.DOWNLOAD_ACCEL_PREFIX.rstrip("/") + "/" + quote(relative_path),
+            "Content-Disposition": f"attachment; filename*=utf-8''{quote(filename)}",
+            "Content-Type": "application/octet-stream"
+        })
+    if offload == "x-sendfile":
+        return Response(headers={
+            "X-Sendfile": path,
+            "Content-Disposition": f"attachment; filename*=utf-8''{quote(filename)}",
+            "Content-Type": "application/octet-stream"
+        })
+
+    file_info = get_file_info(path)
+    if not file_info:
+        return JSONResponse({"success": False, "message": "Arquivo não encontrado no servidor"}, status_code=404)
+    return SecureFileResponse(file_info, filename=filename)
+
+# Aplicação ASGI mínima (sem banco), montada em /dl ou executada à parte:
+# uvicorn download_urls:download_app
+download_app = Starlette(routes=[
+    Route("/{token}/{filename}", serve_download, methods=["GET", "HEAD"])
+])
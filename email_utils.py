@@ -5,7 +5,7 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email import encoders
 import logging
-from jinja2 import Template
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
 from models import User, License, Product
 
 logger = logging.getLogger(__name__)
@@ -15,107 +15,124 @@ SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
 SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
 SMTP_USERNAME = os.getenv("SMTP_USERNAME", "")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
+SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "true").lower() == "true"
+SMTP_TIMEOUT = int(os.getenv("SMTP_TIMEOUT", "30"))
 FROM_EMAIL = os.getenv("FROM_EMAIL", "noreply@fovdark.com")
 FROM_NAME = os.getenv("FROM_NAME", "FovDark")
+SITE_URL = os.getenv("SITE_URL", "http://localhost:5000")
+
+# Templates de email (HTML + texto) e cache de bytecode compilado (vazio = diretório temporário do sistema)
+EMAIL_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "email")
+EMAIL_TEMPLATE_CACHE_DIR = os.getenv("EMAIL_TEMPLATE_CACHE_DIR", "")
+
+EXPIRY_WARNING_SUBJECT = "⚠️ Licença Expirando - FovDark"
+
+def build_message(to_email: str, subject: str, html_content: str, text_content: str = None) -> MIMEMultipart:
+    """Montar mensagem multipart (texto opcional + HTML)"""
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = subject
+    msg['From'] = f"{FROM_NAME} <{FROM_EMAIL}>"
+    msg['To'] = to_email
+    
+    # Adicionar conteúdo texto se fornecido
+    if text_content:
+        part1 = MIMEText(text_content, 'plain', 'utf-8')
+        msg.attach(part1)
+    
+    # Adicionar conteúdo HTML
+    part2 = MIMEText(html_content, 'html', 'utf-8')
+    msg.attach(part2)
+    return msg
+
+class SMTPConnection:
+    """Conexão SMTP autenticada, aberta sob demanda e reutilizada entre envios
+    
+    Sem SMTP_USERNAME não há login e, com SMTP_USE_TLS=false, não há STARTTLS
+    (servidor local de testes, ex.: python -m aiosmtpd -n -l 127.0.0.1:8025).
+    """
+    
+    def __init__(self):
+        self._server = None
+        self.connects = 0
+    
+    @property
+    def is_open(self) -> bool:
+        return self._server is not None
+    
+    def open(self) -> smtplib.SMTP:
+        """Abrir a conexão, se ainda não estiver aberta"""
+        if self._server is None:
+            server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT)
+            try:
+                if SMTP_USE_TLS:
+                    server.starttls()
+                if SMTP_USERNAME:
+                    server.login(SMTP_USERNAME, SMTP_PASSWORD)
+            except Exception:
+                server.close()
+                raise
+            self._server = server
+            self.connects += 1
+        return self._server
+    
+    def send(self, message: MIMEMultipart):
+        """Enviar a mensagem; se o servidor tiver encerrado a conexão, reabre uma vez"""
+        for attempt in range(2):
+            server = self.open()
+            try:
+                server.send_message(message)
+                return
+            except smtplib.SMTPServerDisconnected:
+                self._server = None
+                if attempt:
+                    raise
+    
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                self._server.close()
+            self._server = None
 
 def send_email(to_email: str, subject: str, html_content: str, text_content: str = None) -> bool:
-    """Enviar email via SMTP"""
-    try:
-        # Criar mensagem
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = subject
-        msg['From'] = f"{FROM_NAME} <{FROM_EMAIL}>"
-        msg['To'] = to_email
-        
-        # Adicionar conteúdo texto se fornecido
-        if text_content:
-            part1 = MIMEText(text_content, 'plain', 'utf-8')
-            msg.attach(part1)
-        
-        # Adicionar conteúdo HTML
-        part2 = MIMEText(html_content, 'html', 'utf-8')
-        msg.attach(part2)
-        
-        # Conectar ao servidor SMTP
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(SMTP_USERNAME, SMTP_PASSWORD)
-        
-        # Enviar email
-        server.send_message(msg)
-        server.quit()
-        
-        logger.info(f"Email enviado com sucesso para: {to_email}")
-        return True
-        
-    except Exception as e:
-        logger.error(f"Erro ao enviar email para {to_email}: {e}")
-        return False
+    """Enfileirar email na outbox (o envio SMTP é feito em segundo plano por mail_queue)"""
+    from mail_queue import enqueue_email
+    return enqueue_email(to_email, subject, html_content, text_content)
+
+def _template_environment() -> Environment:
+    bytecode_cache = FileSystemBytecodeCache(EMAIL_TEMPLATE_CACHE_DIR) if EMAIL_TEMPLATE_CACHE_DIR else FileSystemBytecodeCache()
+    environment = Environment(
+        loader=FileSystemLoader(EMAIL_TEMPLATE_DIR),
+        autoescape=select_autoescape(["html"]),
+        bytecode_cache=bytecode_cache,
+        auto_reload=False,
+        keep_trailing_newline=True
+    )
+    environment.globals["site_url"] = SITE_URL
+    return environment
+
+# Templates compilados uma vez por processo (e reaproveitados entre processos pelo cache de bytecode)
+template_env = _template_environment()
+
+def precompile_email_templates() -> int:
+    """Compilar todos os templates de email (na inicialização); retorna quantos foram carregados"""
+    names = template_env.list_templates(extensions=["html", "txt"])
+    for name in names:
+        template_env.get_template(name)
+    return len(names)
+
+def render_email(name: str, **context) -> tuple:
+    """Renderizar as variantes HTML e texto de um email; retorna (html, texto)"""
+    html_content = template_env.get_template(f"{name}.html").render(context)
+    text_content = template_env.get_template(f"{name}.txt").render(context)
+    return html_content, text_content
 
 def send_password_reset_email(email: str, reset_token: str) -> bool:
     """Enviar email de recuperação de senha"""
     try:
-        reset_url = f"{os.getenv('SITE_URL', 'http://localhost:5000')}/reset-password?token={reset_token}"
-        
-        # Template HTML
-        html_template = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="utf-8">
-            <title>Recuperação de Senha - FovDark</title>
-            <style>
-                body { font-family: Arial, sans-serif; line-height: 1.6; color: #333; }
-                .container { max-width: 600px; margin: 0 auto; padding: 20px; }
-                .header { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 20px; text-align: center; }
-                .content { background: #f8f9fa; padding: 30px; }
-                .button { display: inline-block; background: #667eea; color: white; padding: 12px 30px; text-decoration: none; border-radius: 5px; margin: 20px 0; }
-                .footer { text-align: center; padding: 20px; color: #666; font-size: 12px; }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>🔐 FovDark - Recuperação de Senha</h1>
-                </div>
-                <div class="content">
-                    <h2>Solicitação de Nova Senha</h2>
-                    <p>Você solicitou a recuperação de sua senha no FovDark.</p>
-                    <p>Clique no botão abaixo para definir uma nova senha:</p>
-                    <p style="text-align: center;">
-                        <a href="{{reset_url}}" class="button">🔑 Redefinir Senha</a>
-                    </p>
-                    <p><strong>Este link expira em 1 hora.</strong></p>
-                    <p>Se você não solicitou esta recuperação, ignore este email.</p>
-                </div>
-                <div class="footer">
-                    <p>© 2024 FovDark - Sistema de Licenças Digitais</p>
-                    <p>Este é um email automático, não responda.</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        
-        template = Template(html_template)
-        html_content = template.render(reset_url=reset_url)
-        
-        # Conteúdo texto simples
-        text_content = f"""
-        FovDark - Recuperação de Senha
-        
-        Você solicitou a recuperação de sua senha no FovDark.
-        
-        Acesse o link abaixo para definir uma nova senha:
-        {reset_url}
-        
-        Este link expira em 1 hora.
-        
-        Se você não solicitou esta recuperação, ignore este email.
-        
-        © 2024 FovDark
-        """
-        
+        reset_url = f"{SITE_URL}/reset-password?token={reset_token}"
+        html_content, text_content = render_email("password_reset", reset_url=reset_url)
         return send_email(email, "🔐 FovDark - Recuperação de Senha", html_content, text_content)
         
     except Exception as e:
@@ -125,117 +142,14 @@ def send_password_reset_email(email: str, reset_token: str) -> bool:
 def send_license_email(email: str, license_obj: License, product: Product) -> bool:
     """Enviar email com informações da licença"""
     try:
-        # Template HTML
-        html_template = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="utf-8">
-            <title>Nova Licença - FovDark</title>
-            <style>
-                body { font-family: Arial, sans-serif; line-height: 1.6; color: #333; }
-                .container { max-width: 600px; margin: 0 auto; padding: 20px; }
-                .header { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 20px; text-align: center; }
-                .content { background: #f8f9fa; padding: 30px; }
-                .license-box { background: white; border: 2px solid #667eea; padding: 20px; margin: 20px 0; border-radius: 8px; }
-                .license-key { font-family: monospace; font-size: 18px; font-weight: bold; color: #667eea; word-break: break-all; }
-                .button { display: inline-block; background: #28a745; color: white; padding: 12px 30px; text-decoration: none; border-radius: 5px; margin: 20px 0; }
-                .footer { text-align: center; padding: 20px; color: #666; font-size: 12px; }
-                .info-grid { display: grid; grid-template-columns: 1fr 1fr; gap: 15px; margin: 20px 0; }
-                .info-item { background: white; padding: 15px; border-radius: 5px; border-left: 4px solid #667eea; }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>🎉 Sua Licença Está Pronta!</h1>
-                    <p>FovDark - Sistema de Licenças Digitais</p>
-                </div>
-                <div class="content">
-                    <h2>Licença Ativada com Sucesso</h2>
-                    <p>Parabéns! Sua compra foi processada e sua licença está ativa.</p>
-                    
-                    <div class="license-box">
-                        <h3>🔑 Chave da Licença:</h3>
-                        <div class="license-key">{{license_key}}</div>
-                    </div>
-                    
-                    <div class="info-grid">
-                        <div class="info-item">
-                            <strong>📦 Produto:</strong><br>
-                            {{product_name}}
-                        </div>
-                        <div class="info-item">
-                            <strong>⏰ Válida até:</strong><br>
-                            {{expires_at}}
-                        </div>
-                        <div class="info-item">
-                            <strong>📊 Status:</strong><br>
-                            <span style="color: #28a745;">{{status}}</span>
-                        </div>
-                        <div class="info-item">
-                            <strong>📅 Ativada em:</strong><br>
-                            {{created_at}}
-                        </div>
-                    </div>
-                    
-                    <h3>📋 Como usar sua licença:</h3>
-                    <ol>
-                        <li>Acesse seu painel no FovDark</li>
-                        <li>Vá para a seção "Downloads"</li>
-                        <li>Baixe o produto usando sua licença</li>
-                        <li>Siga as instruções de instalação</li>
-                    </ol>
-                    
-                    <p style="text-align: center;">
-                        <a href="{{site_url}}/painel" class="button">🚀 Acessar Painel</a>
-                    </p>
-                    
-                    <div style="background: #fff3cd; border: 1px solid #ffeaa7; padding: 15px; border-radius: 5px; margin: 20px 0;">
-                        <h4>⚠️ Importante:</h4>
-                        <ul>
-                            <li>Guarde esta chave de licença em local seguro</li>
-                            <li>A licença é vinculada ao seu dispositivo</li>
-                            <li>Para suporte, entre em contato conosco</li>
-                        </ul>
-                    </div>
-                </div>
-                <div class="footer">
-                    <p>© 2024 FovDark - Sistema de Licenças Digitais</p>
-                    <p>Para suporte: support@fovdark.com</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        
-        template = Template(html_template)
-        html_content = template.render(
+        html_content, text_content = render_email(
+            "license",
             license_key=license_obj.license_key,
             product_name=product.name,
             expires_at=license_obj.expires_at.strftime("%d/%m/%Y %H:%M"),
             status="ATIVA",
-            created_at=license_obj.created_at.strftime("%d/%m/%Y %H:%M"),
-            site_url=os.getenv('SITE_URL', 'http://localhost:5000')
+            created_at=license_obj.created_at.strftime("%d/%m/%Y %H:%M")
         )
-        
-        # Conteúdo texto simples
-        text_content = f"""
-        FovDark - Nova Licença Ativada
-        
-        Sua compra foi processada e sua licença está ativa!
-        
-        Chave da Licença: {license_obj.license_key}
-        
-        Produto: {product.name}
-        Válida até: {license_obj.expires_at.strftime("%d/%m/%Y %H:%M")}
-        Status: ATIVA
-        
-        Acesse seu painel em: {os.getenv('SITE_URL', 'http://localhost:5000')}/painel
-        
-        © 2024 FovDark
-        """
-        
         return send_email(email, "🎉 Sua Licença FovDark Está Pronta!", html_content, text_content)
         
     except Exception as e:
@@ -245,145 +159,32 @@ def send_license_email(email: str, license_obj: License, product: Product) -> bo
 def send_welcome_email(email: str, username: str) -> bool:
     """Enviar email de boas-vindas"""
     try:
-        html_template = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="utf-8">
-            <title>Bem-vindo ao FovDark</title>
-            <style>
-                body { font-family: Arial, sans-serif; line-height: 1.6; color: #333; }
-                .container { max-width: 600px; margin: 0 auto; padding: 20px; }
-                .header { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 20px; text-align: center; }
-                .content { background: #f8f9fa; padding: 30px; }
-                .button { display: inline-block; background: #667eea; color: white; padding: 12px 30px; text-decoration: none; border-radius: 5px; margin: 20px 0; }
-                .footer { text-align: center; padding: 20px; color: #666; font-size: 12px; }
-                .feature-list { list-style: none; padding: 0; }
-                .feature-list li { padding: 10px 0; border-bottom: 1px solid #eee; }
-                .feature-list li:before { content: "✨ "; color: #667eea; font-weight: bold; }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>🎉 Bem-vindo ao FovDark!</h1>
-                    <p>Sistema de Licenças Digitais</p>
-                </div>
-                <div class="content">
-                    <h2>Olá, {{username}}!</h2>
-                    <p>Seja bem-vindo ao FovDark, sua plataforma para licenças digitais!</p>
-                    
-                    <h3>🚀 O que você pode fazer:</h3>
-                    <ul class="feature-list">
-                        <li>Explorar nossa coleção de ISOs customizadas</li>
-                        <li>Baixar programas e aplicativos otimizados</li>
-                        <li>Acessar cheats e trainers para seus jogos</li>
-                        <li>Encontrar mods exclusivos</li>
-                        <li>Gerenciar suas licenças no painel pessoal</li>
-                    </ul>
-                    
-                    <p style="text-align: center;">
-                        <a href="{{site_url}}" class="button">🔍 Explorar Produtos</a>
-                    </p>
-                    
-                    <div style="background: #d1ecf1; border: 1px solid #bee5eb; padding: 15px; border-radius: 5px; margin: 20px 0;">
-                        <h4>💡 Dica:</h4>
-                        <p>Mantenha suas licenças sempre ativas e aproveite nossos produtos exclusivos!</p>
-                    </div>
-                </div>
-                <div class="footer">
-                    <p>© 2024 FovDark - Sistema de Licenças Digitais</p>
-                    <p>Para suporte: support@fovdark.com</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        
-        template = Template(html_template)
-        html_content = template.render(
-            username=username,
-            site_url=os.getenv('SITE_URL', 'http://localhost:5000')
-        )
-        
-        text_content = f"""
-        Bem-vindo ao FovDark!
-        
-        Olá, {username}!
-        
-        Seja bem-vindo ao FovDark, sua plataforma para licenças digitais!
-        
-        Explore nossa coleção de produtos em: {os.getenv('SITE_URL', 'http://localhost:5000')}
-        
-        © 2024 FovDark
-        """
-        
+        html_content, text_content = render_email("welcome", username=username)
         return send_email(email, "🎉 Bem-vindo ao FovDark!", html_content, text_content)
         
     except Exception as e:
         logger.error(f"Erro ao enviar email de boas-vindas: {e}")
         return False
 
+def render_license_expiry_warning(license_key: str, product_name: str, product_id: int,
+                                  expires_at, days_remaining: int) -> tuple:
+    """HTML e texto do aviso de expiração de licença"""
+    return render_email(
+        "license_expiry_warning",
+        product_name=product_name,
+        license_key=license_key,
+        days_remaining=days_remaining,
+        expires_at=expires_at.strftime("%d/%m/%Y %H:%M"),
+        product_id=product_id
+    )
+
 def send_license_expiry_warning(email: str, license_obj: License, product: Product, days_remaining: int) -> bool:
     """Enviar aviso de expiração de licença"""
     try:
-        html_template = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="utf-8">
-            <title>Licença Expirando - FovDark</title>
-            <style>
-                body { font-family: Arial, sans-serif; line-height: 1.6; color: #333; }
-                .container { max-width: 600px; margin: 0 auto; padding: 20px; }
-                .header { background: linear-gradient(135deg, #f39c12 0%, #e74c3c 100%); color: white; padding: 20px; text-align: center; }
-                .content { background: #f8f9fa; padding: 30px; }
-                .warning-box { background: #fff3cd; border: 2px solid #ffc107; padding: 20px; margin: 20px 0; border-radius: 8px; }
-                .button { display: inline-block; background: #e74c3c; color: white; padding: 12px 30px; text-decoration: none; border-radius: 5px; margin: 20px 0; }
-                .footer { text-align: center; padding: 20px; color: #666; font-size: 12px; }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>⚠️ Licença Expirando!</h1>
-                    <p>FovDark - Aviso Importante</p>
-                </div>
-                <div class="content">
-                    <h2>Sua licença está prestes a expirar</h2>
-                    
-                    <div class="warning-box">
-                        <h3>📦 Produto: {{product_name}}</h3>
-                        <p><strong>🔑 Licença:</strong> {{license_key}}</p>
-                        <p><strong>⏰ Expira em:</strong> {{days_remaining}} dias</p>
-                        <p><strong>📅 Data de expiração:</strong> {{expires_at}}</p>
-                    </div>
-                    
-                    <p>Renove sua licença agora para continuar aproveitando todos os benefícios!</p>
-                    
-                    <p style="text-align: center;">
-                        <a href="{{site_url}}/products/{{product_id}}" class="button">🔄 Renovar Licença</a>
-                    </p>
-                </div>
-                <div class="footer">
-                    <p>© 2024 FovDark - Sistema de Licenças Digitais</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        
-        template = Template(html_template)
-        html_content = template.render(
-            product_name=product.name,
-            license_key=license_obj.license_key,
-            days_remaining=days_remaining,
-            expires_at=license_obj.expires_at.strftime("%d/%m/%Y %H:%M"),
-            site_url=os.getenv('SITE_URL', 'http://localhost:5000'),
-            product_id=product.id
+        html_content, text_content = render_license_expiry_warning(
+            license_obj.license_key, product.name, product.id, license_obj.expires_at, days_remaining
         )
-        
-        return send_email(email, "⚠️ Licença Expirando - FovDark", html_content)
+        return send_email(email, EXPIRY_WARNING_SUBJECT, html_content, text_content)
         
     except Exception as e:
         logger.error(f"Erro ao enviar aviso de expiração: {e}")
@@ -392,11 +193,10 @@ def send_license_expiry_warning(email: str, license_obj: License, product: Produ
 def test_email_configuration() -> bool:
     """Testar configuração de email"""
     try:
-        # Tentar conectar ao servidor SMTP
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(SMTP_USERNAME, SMTP_PASSWORD)
-        server.quit()
+        # Tentar conectar (e autenticar) ao servidor SMTP
+        connection = SMTPConnection()
+        connection.open()
+        connection.close()
         
         logger.info("Configuração de email testada com sucesso")
         return True
@@ -0,0 +1,403 @@
+"""
+Gravação assíncrona e em lote de eventos append-only (downloads e logs de segurança)
+"""
+import atexit
+import glob
+import json
+import os
+import queue
+import threading
+import time
+import logging
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+
+from config import get_config
+from models import Download, SecurityLog
+from rollups import record_downloads
+
+logger = logging.getLogger(__name__)
+
+config = get_config()
+
+# Tipos de evento aceitos e respectivas tabelas
+EVENT_MODELS = {
+    "download": Download,
+    "security_log": SecurityLog
+}
+
+# Campos de data serializados em ISO no arquivo de transbordo
+_DATETIME_FIELDS = ("downloaded_at", "created_at")
+
+OVERFLOW_POLICIES = ("block", "spill", "drop")
+
+# Reserva de arquivo de transbordo mais antiga que isto é retomada por outro worker
+# (cobre workers em outros hosts/containers, onde o PID não pode ser verificado)
+REPLAY_CLAIM_TIMEOUT = 600
+
+# Linhas do transbordo que não puderam ser lidas (mantidas para inspeção, nunca reprocessadas)
+CORRUPT_SUFFIX = ".corrupt"
+
+class EventWriter:
+    """Fila limitada de eventos drenada por uma thread que grava em lote.
+
+    Os handlers apenas enfileiram (`enqueue`); a thread agrupa até
+    `batch_size` eventos ou `flush_interval` segundos e grava cada tabela
+    com um único INSERT executemany por transação. Com a fila cheia, a
+    política de transbordo decide: "block" espera até `block_timeout` e
+    depois transborda, "spill" grava o evento em um arquivo NDJSON local
+    (reprocessado quando o banco volta a aceitar gravações) e "drop"
+    descarta contando o descarte. Lotes que falham por indisponibilidade do
+    banco também vão para o arquivo; eventos inválidos são descartados
+    individualmente para não bloquear o restante. `stop()` grava o que
+    restou e é registrado no atexit.
+    """
+
+    def __init__(
+        self,
+        name: str = "events",
+        max_queue: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        overflow: str = "spill",
+        spill_path: str = "event_spill.ndjson",
+        block_timeout: float = 0.05
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Política de transbordo inválida: {overflow}")
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.spill_path = spill_path
+        self.block_timeout = block_timeout
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._spill_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._atexit_registered = False
+        self._last_replay = 0.0
+        self.written = 0
+        self.spilled = 0
+        self.dropped = 0
+        self.invalid = 0
+        self.failed_batches = 0
+
+    def enqueue(self, kind: str, row: dict) -> bool:
+        """Enfileirar evento; retorna False se ele foi descartado"""
+        if kind not in EVENT_MODELS:
+            raise ValueError(f"Tipo de evento desconhecido: {kind}")
+        self._ensure_started()
+        event = (kind, row)
+
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            pass
+
+        if self.overflow == "block":
+            try:
+                self._queue.put(event, timeout=self.block_timeout)
+                return True
+            except queue.Full:
+                pass
+
+        if self.overflow == "drop":
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(f"Fila de eventos {self.name} cheia: {self.dropped} eventos descartados")
+            return False
+
+        self._spill([event])
+        return True
+
+    def flush(self) -> int:
+        """Gravar imediatamente tudo que está na fila; retorna nº de eventos gravados"""
+        total = 0
+        while True:
+            batch = self._take(self.batch_size, timeout=0)
+            if not batch:
+                return total
+            total += self._write(batch)
+
+    def start(self):
+        """Iniciar a thread de gravação"""
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name=f"event-writer-{self.name}", daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+
+    def stop(self, timeout: float = 10.0):
+        """Parar a thread e gravar os eventos restantes"""
+        self._stopping.set()
+        thread = self._thread
+        if thread and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout)
+        self._thread = None
+        self.flush()
+
+    def stats(self) -> dict:
+        """Estatísticas da fila"""
+        return {
+            "name": self.name,
+            "queued": self._queue.qsize(),
+            "max_queue": self._queue.maxsize,
+            "written": self.written,
+            "spilled": self.spilled,
+            "dropped": self.dropped,
+            "invalid": self.invalid,
+            "failed_batches": self.failed_batches,
+            "overflow": self.overflow
+        }
+
+    def _ensure_started(self):
+        if self._thread is None and not self._stopping.is_set():
+            self.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._take(self.batch_size, timeout=self.flush_interval)
+            if batch:
+                self._write(batch)
+            self._maybe_replay_spill()
+
+    def _take(self, limit: int, timeout: float) -> list:
+        """Retirar até `limit` eventos, esperando o primeiro por até `timeout` segundos"""
+        batch = []
+        try:
+            if timeout:
+                batch.append(self._queue.get(timeout=timeout))
+            else:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            return batch
+
+        # Acumular por até flush_interval para formar lotes maiores
+        deadline = time.monotonic() + (self.flush_interval if timeout else 0)
+        while len(batch) < limit:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: list) -> int:
+        with self._flush_lock:
+            try:
+                _insert_events(batch)
+                self.written += len(batch)
+                return len(batch)
+            except Exception as e:
+                if isinstance(e, OperationalError) or getattr(e, "connection_invalidated", False):
+                    # Banco indisponível: preservar o lote em disco para reprocessar depois
+                    self.failed_batches += 1
+                    logger.error(f"Erro ao gravar {len(batch)} eventos ({self.name}), transbordando para disco: {e}")
+                    self._spill(batch)
+                    return 0
+                logger.error(f"Erro ao gravar lote de eventos ({self.name}): {e}")
+                return self._write_individually(batch)
+
+    def _write_individually(self, batch: list) -> int:
+        # Isolar eventos inválidos (ex.: violação de chave estrangeira) sem perder os demais
+        written = 0
+        for event in batch:
+            try:
+                _insert_events([event])
+                written += 1
+            except OperationalError as e:
+                logger.error(f"Erro ao gravar evento ({self.name}), transbordando para disco: {e}")
+                self._spill([event])
+            except Exception as e:
+                self.invalid += 1
+                logger.error(f"Evento {event[0]} descartado por ser inválido: {e}")
+        self.written += written
+        return written
+
+    def _spill(self, events: list):
+        lines = "".join(
+            json.dumps({"kind": kind, "row": row}, default=_json_default, ensure_ascii=False) + "\n"
+            for kind, row in events
+        )
+        try:
+            with self._spill_lock:
+                with open(f"{self.spill_path}.{os.getpid()}", "a", encoding="utf-8") as spill:
+                    spill.write(lines)
+            self.spilled += len(events)
+        except OSError as e:
+            self.dropped += len(events)
+            logger.error(f"Erro ao transbordar {len(events)} eventos ({self.name}), descartados: {e}")
+
+    def _maybe_replay_spill(self):
+        """Reprocessar arquivos de transbordo (deste processo e de processos que já terminaram)"""
+        now = time.monotonic()
+        if now - self._last_replay < max(self.flush_interval * 10, 5.0):
+            return
+        self._last_replay = now
+
+        for path in glob.glob(f"{glob.escape(self.spill_path)}.*"):
+            if path.endswith(CORRUPT_SUFFIX):
+                continue
+            if ".replaying-" in path:
+                # Reserva de um worker que morreu no meio do reprocessamento
+                if not _is_abandoned_claim(path):
+                    continue
+                source = path.rsplit(".replaying-", 1)[0]
+            else:
+                # Arquivo ativo: o dono ainda vivo pode estar acrescentando
+                # eventos, então só ele (sob _spill_lock) ou, depois que ele
+                # morrer, outro worker pode reservá-lo
+                try:
+                    pid = int(path.rsplit(".", 1)[1])
+                except ValueError:
+                    continue
+                if pid != os.getpid() and not _is_dead(pid):
+                    continue
+                source = path
+            claimed = f"{source}.replaying-{os.getpid()}"
+            try:
+                # rename é atômico: apenas um worker reprocessa cada arquivo
+                with self._spill_lock:
+                    os.rename(path, claimed)
+                # mtime marca o início da reserva (ver _is_abandoned_claim)
+                os.utime(claimed)
+            except OSError:
+                continue
+            self._replay_file(claimed)
+
+    def _replay_file(self, path: str):
+        # Linhas ilegíveis (ex.: última linha cortada por um worker morto no
+        # meio de _spill) vão para quarentena; as demais são gravadas
+        quarantine = f"{path.rsplit('.replaying-', 1)[0]}{CORRUPT_SUFFIX}"
+        events = []
+        corrupt = []
+        try:
+            with open(path, encoding="utf-8", errors="replace") as spill:
+                for line in spill:
+                    if not line.strip():
+                        continue
+                    try:
+                        data = json.loads(line)
+                        events.append((data["kind"], _restore_row(data["row"])))
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        corrupt.append(line if line.endswith("\n") else line + "\n")
+        except OSError as e:
+            logger.error(f"Erro ao ler transbordo {path}, movido para {quarantine}: {e}")
+            try:
+                os.rename(path, quarantine)
+            except OSError:
+                pass
+            return
+
+        if corrupt:
+            self.invalid += len(corrupt)
+            try:
+                with open(quarantine, "a", encoding="utf-8") as spill:
+                    spill.writelines(corrupt)
+            except OSError as e:
+                logger.error(f"Erro ao gravar quarentena {quarantine}: {e}")
+            logger.error(f"Transbordo {path}: {len(corrupt)} linha(s) ilegível(is) movida(s) para {quarantine}")
+
+        for start in range(0, len(events), self.batch_size):
+            self._write(events[start:start + self.batch_size])
+        os.remove(path)
+        logger.info(f"Transbordo {path} reprocessado: {len(events)} eventos")
+
+def _is_abandoned_claim(path: str) -> bool:
+    """Arquivo em reprocessamento cujo dono morreu ou que está reservado há mais de REPLAY_CLAIM_TIMEOUT"""
+    try:
+        pid = int(path.rsplit(".replaying-", 1)[1])
+        claimed_at = os.path.getmtime(path)
+    except (ValueError, OSError):
+        return False
+
+    if time.time() - claimed_at > REPLAY_CLAIM_TIMEOUT:
+        return True
+    if pid == os.getpid():
+        # O reprocessamento deste processo é síncrono: uma reserva com o nosso
+        # PID que ainda existe é de um processo anterior (PID reutilizado)
+        return True
+    return _is_dead(pid)
+
+def _is_dead(pid: int) -> bool:
+    """Nenhum processo com este PID neste host"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        # Processo existe, mas pertence a outro usuário
+        return False
+    return False
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def _restore_row(row: dict) -> dict:
+    for field in _DATETIME_FIELDS:
+        if isinstance(row.get(field), str):
+            row[field] = datetime.fromisoformat(row[field])
+    return row
+
+def _insert_events(events: list):
+    """INSERT em lote por tabela em uma única transação (e rollup dos downloads)"""
+    from database import engine
+
+    rows_by_kind = {}
+    for kind, row in events:
+        rows_by_kind.setdefault(kind, []).append(row)
+
+    with engine.begin() as conn:
+        for kind, rows in rows_by_kind.items():
+            conn.execute(insert(EVENT_MODELS[kind].__table__), rows)
+            if kind == "download":
+                record_downloads(conn, rows)
+
+event_writer = EventWriter(
+    "events",
+    max_queue=config.EVENT_QUEUE_MAX_SIZE,
+    batch_size=config.EVENT_BATCH_SIZE,
+    flush_interval=config.EVENT_FLUSH_SECONDS,
+    overflow=config.EVENT_OVERFLOW_POLICY,
+    spill_path=config.EVENT_SPILL_PATH
+)
+
+def record_download(user_id: int, product_id: int, license_id: Optional[int],
+                    ip_address: Optional[str] = None, user_agent: Optional[str] = None) -> bool:
+    """Enfileirar registro de download (gravado em lote pela thread de eventos)"""
+    return event_writer.enqueue("download", {
+        "user_id": user_id,
+        "product_id": product_id,
+        "license_id": license_id,
+        "ip_address": ip_address,
+        "user_agent": (user_agent or "")[:500] or None,
+        "downloaded_at": datetime.utcnow()
+    })
+
+def record_security_event(event_type: str, user_id: Optional[int] = None, ip_address: Optional[str] = None,
+                          user_agent: Optional[str] = None, details: Optional[dict] = None) -> bool:
+    """Enfileirar log de segurança (gravado em lote pela thread de eventos)"""
+    return event_writer.enqueue("security_log", {
+        "event_type": event_type,
+        "user_id": user_id,
+        "ip_address": ip_address,
+        "user_agent": (user_agent or "")[:500] or None,
+        "details": details,
+        "created_at": datetime.utcnow()
+    })
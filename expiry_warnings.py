@@ -0,0 +1,114 @@
+"""
+Avisos de expiração de licença (por padrão 7, 3 e 1 dia antes)
+
+A cada execução (pelo agendador), uma única consulta por intervalo em
+(status, expires_at) encontra as licenças ativas dentro da maior janela,
+calcula a menor janela aplicável de cada uma e descarta, na própria
+consulta, as que já receberam esse aviso para a data de expiração atual.
+Cada lote grava os emails na outbox (mail_queue) e os registros em
+license_notifications na mesma transação: o aviso é enviado em segundo plano
+e nunca é enfileirado duas vezes.
+"""
+import math
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import and_, case, insert, literal, select
+from sqlalchemy.orm import Session
+
+from config import get_config
+from models import License, LicenseNotification, Product, User
+
+logger = logging.getLogger(__name__)
+
+config = get_config()
+
+def warning_windows() -> List[int]:
+    """Janelas configuradas (dias), da menor para a maior"""
+    windows = set()
+    for item in config.EXPIRY_WARNING_DAYS.split(","):
+        try:
+            days = int(item)
+        except ValueError:
+            continue
+        if days > 0:
+            windows.add(days)
+    return sorted(windows)
+
+def warning_kind(days: int) -> str:
+    return f"expiry_{days}d"
+
+def due_warnings_query(now: datetime, windows: List[int]):
+    """Licenças que devem receber aviso agora, com o tipo de aviso aplicável"""
+    # A menor janela que contém a expiração (quem entra com 2 dias recebe só o de 3)
+    kind = case(*[
+        (License.expires_at <= now + timedelta(days=days), literal(warning_kind(days)))
+        for days in windows
+    ])
+    return select(
+        License.id,
+        License.license_key,
+        License.product_id,
+        License.expires_at,
+        User.email,
+        Product.name,
+        kind.label("kind")
+    ).join(
+        User, User.id == License.user_id
+    ).join(
+        Product, Product.id == License.product_id
+    ).outerjoin(
+        LicenseNotification, and_(
+            LicenseNotification.license_id == License.id,
+            LicenseNotification.license_expires_at == License.expires_at,
+            LicenseNotification.kind == kind
+        )
+    ).where(
+        License.status == "active",
+        License.expires_at > now,
+        License.expires_at <= now + timedelta(days=windows[-1]),
+        LicenseNotification.id.is_(None)
+    ).order_by(License.expires_at, License.id)
+
+def send_expiry_warnings(db: Session, now: Optional[datetime] = None, batch_size: Optional[int] = None) -> dict:
+    """Enfileirar os avisos devidos; retorna contagem de enfileirados e falhas"""
+    from email_utils import EXPIRY_WARNING_SUBJECT, render_license_expiry_warning
+    from mail_queue import enqueue_emails
+
+    now = now or datetime.utcnow()
+    batch_size = batch_size or config.EXPIRY_WARNING_BATCH_SIZE
+    windows = warning_windows()
+    if not windows:
+        return {"sent": 0, "failed": 0}
+
+    rows = db.execute(due_warnings_query(now, windows)).all()
+    sent = failed = 0
+
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        messages = []
+        for row in batch:
+            days_remaining = math.ceil((row.expires_at - now).total_seconds() / 86400)
+            html_content, text_content = render_license_expiry_warning(
+                row.license_key, row.name, row.product_id, row.expires_at, days_remaining
+            )
+            messages.append((row.email, EXPIRY_WARNING_SUBJECT, html_content, text_content))
+
+        try:
+            db.execute(insert(LicenseNotification), [
+                {"license_id": row.id, "kind": row.kind, "license_expires_at": row.expires_at, "sent_at": now}
+                for row in batch
+            ])
+            if not enqueue_emails(messages, db=db):
+                raise RuntimeError("falha ao gravar na outbox")
+            db.commit()
+            sent += len(batch)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Erro ao enfileirar avisos de expiração: {e}")
+            failed += len(batch)
+
+    if sent or failed:
+        logger.info(f"Avisos de expiração: {sent} enfileirados, {failed} falhas")
+    return {"sent": sent, "failed": failed}
@@ -0,0 +1,170 @@
+"""
+Exportação em streaming (CSV/NDJSON) dos dados administrativos
+"""
+import csv
+import io
+import json
+import zlib
+import logging
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Iterator, Optional
+
+from sqlalchemy import select
+
+from models import User, License, Transaction, Download, SecurityLog
+
+logger = logging.getLogger(__name__)
+
+# Linhas buscadas por vez no cursor do servidor e gravadas por bloco na resposta
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson"
+}
+
+@dataclass(frozen=True)
+class ExportSpec:
+    """Colunas exportadas de uma tabela e as colunas usadas nos filtros"""
+    model: type
+    columns: tuple
+    date_column: str
+    status_column: Optional[str] = None
+
+# Somente colunas não sensíveis (sem hashes de senha, HWIDs ou respostas do gateway)
+EXPORTS = {
+    "users": ExportSpec(
+        User,
+        ("id", "email", "username", "is_admin", "status_licenca", "created_at", "ultimo_login"),
+        date_column="created_at",
+        status_column="status_licenca"
+    ),
+    "licenses": ExportSpec(
+        License,
+        ("id", "license_key", "user_id", "product_id", "status", "created_at", "expires_at",
+         "last_verified", "payment_amount", "payment_currency"),
+        date_column="created_at",
+        status_column="status"
+    ),
+    "transactions": ExportSpec(
+        Transaction,
+        ("id", "user_id", "product_id", "amount", "payment_id", "payment_method", "status",
+         "created_at", "updated_at"),
+        date_column="created_at",
+        status_column="status"
+    ),
+    "downloads": ExportSpec(
+        Download,
+        ("id", "user_id", "product_id", "license_id", "ip_address", "user_agent", "downloaded_at"),
+        date_column="downloaded_at"
+    ),
+    "security_logs": ExportSpec(
+        SecurityLog,
+        ("id", "event_type", "user_id", "ip_address", "user_agent", "details", "created_at"),
+        date_column="created_at",
+        status_column="event_type"
+    )
+}
+
+def build_export_query(spec: ExportSpec, date_from: Optional[date] = None, date_to: Optional[date] = None,
+                       status: Optional[str] = None):
+    """SELECT das colunas exportadas com filtros de período (inclusivo) e status"""
+    model = spec.model
+    query = select(*[getattr(model, column) for column in spec.columns]).order_by(model.id)
+
+    date_column = getattr(model, spec.date_column)
+    if date_from:
+        query = query.where(date_column >= datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        query = query.where(date_column < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    if status:
+        if not spec.status_column:
+            raise ValueError("Filtro de status não disponível para esta exportação")
+        query = query.where(getattr(model, spec.status_column) == status)
+    return query
+
+def _value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def _csv_chunks(columns: tuple, batches) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in batches:
+        for row in rows:
+            writer.writerow([
+                "" if value is None else json.dumps(value) if isinstance(value, (dict, list)) else _value(value)
+                for value in row
+            ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def _ndjson_chunks(columns: tuple, batches) -> Iterator[str]:
+    for rows in batches:
+        yield "".join(
+            json.dumps({column: _value(value) for column, value in zip(columns, row)},
+                       ensure_ascii=False, default=str) + "\n"
+            for row in rows
+        )
+
+def _gzip(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: formato gzip
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def stream_export(dataset: str, export_format: str = "csv", date_from: Optional[date] = None,
+                  date_to: Optional[date] = None, status: Optional[str] = None,
+                  gzip: bool = False) -> Iterator[bytes]:
+    """Gerador de bytes da exportação, para uso com StreamingResponse
+
+    Parâmetros são validados antes de retornar (ValueError), de modo que
+    erros viram 400 em vez de interromper uma resposta já iniciada. O
+    gerador abre sua própria sessão, pois a resposta continua sendo enviada
+    depois que a sessão da requisição é fechada, e lê as linhas em lotes de
+    EXPORT_BATCH_SIZE por cursor no servidor (memória constante).
+    """
+    spec = EXPORTS.get(dataset)
+    if spec is None:
+        raise ValueError("Exportação desconhecida")
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError("Formato inválido")
+    query = build_export_query(spec, date_from, date_to, status)
+
+    def generate() -> Iterator[bytes]:
+        from database import SessionLocal
+
+        db = SessionLocal()
+        exported = 0
+        try:
+            result = db.execute(query, execution_options={"yield_per": EXPORT_BATCH_SIZE})
+
+            def batches():
+                nonlocal exported
+                for rows in result.partitions():
+                    exported += len(rows)
+                    yield rows
+
+            chunks = (_csv_chunks if export_format == "csv" else _ndjson_chunks)(spec.columns, batches())
+            encoded = (chunk.encode("utf-8") for chunk in chunks)
+            yield from (_gzip(encoded) if gzip else encoded)
+            logger.info(f"Exportação {dataset} ({export_format}) concluída: {exported} linhas")
+        except Exception as e:
+            logger.error(f"Erro na exportação {dataset}: {e}")
+            raise
+        finally:
+            db.close()
+
+    return generate()
+
+def export_filename(dataset: str, export_format: str) -> str:
+    """Nome do arquivo sugerido no Content-Disposition"""
+    return f"{dataset}-{datetime.utcnow():%Y%m%d-%H%M%S}.{export_format}"
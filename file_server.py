@@ -0,0 +1,303 @@
+"""
+Entrega de arquivos dos produtos com Range/If-Range, ETag forte e envio zero-copy
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import logging
+from dataclasses import dataclass
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Iterable, Optional
+
+from fastapi import Request
+from starlette.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
+
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+config = get_config()
+
+# Bloco de leitura (fallback sem sendfile) e do cálculo do hash
+CHUNK_SIZE = 1024 * 1024
+
+_RANGE_START = re.compile(r"^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)", re.IGNORECASE)
+
+@dataclass(frozen=True)
+class FileInfo:
+    """Metadados do arquivo usados nos cabeçalhos e validações condicionais"""
+    path: str
+    size: int
+    mtime: float
+    mtime_ns: int
+    sha256: Optional[str]
+
+    @property
+    def etag(self) -> Optional[str]:
+        # ETag forte a partir do conteúdo; sem ETag até o hash ficar pronto, para
+        # que o validador de um mesmo conteúdo nunca mude entre workers ou requisições
+        if self.sha256:
+            return f'"{self.sha256[:32]}"'
+        return None
+
+    @property
+    def size_mtime_tag(self) -> str:
+        # Forma anterior do ETag (tamanho + mtime), ainda aceita nas validações
+        return f'"{self.size:x}-{self.mtime_ns:x}"'
+
+    def matches_etag(self, tag: str) -> bool:
+        return tag in (self.etag, self.size_mtime_tag)
+
+    def matches_if_range(self, value: str) -> bool:
+        return self.matches_etag(value) or value == self.last_modified
+
+    @property
+    def validator_headers(self) -> dict:
+        headers = {"last-modified": self.last_modified}
+        if self.etag:
+            headers["etag"] = self.etag
+        return headers
+
+    @property
+    def last_modified(self) -> str:
+        return formatdate(self.mtime, usegmt=True)
+
+class FileHashStore:
+    """Hashes SHA-256 dos arquivos, calculados uma vez em segundo plano
+
+    O resultado fica em memória e em um arquivo em FILE_HASH_CACHE_DIR
+    (tamanho, mtime e hash; nomeado pelo hash do caminho, fora de static/,
+    que é público), reaproveitado por outros workers e após reinícios. O
+    hash é recalculado quando o tamanho ou o mtime do arquivo mudam.
+    """
+
+    def __init__(self):
+        self._hashes = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def get(self, path: str, size: int, mtime_ns: int) -> Optional[str]:
+        key = (path, size, mtime_ns)
+        digest = self._hashes.get(key)
+        if digest:
+            return digest
+
+        digest = self._read_sidecar(path, size, mtime_ns)
+        if digest:
+            self._hashes[key] = digest
+            return digest
+
+        self.schedule(path)
+        return None
+
+    def schedule(self, path: str):
+        """Calcular o hash em uma thread, se ainda não estiver em andamento"""
+        with self._lock:
+            if path in self._pending:
+                return
+            self._pending.add(path)
+        threading.Thread(target=self._compute, args=(path,), name="file-hash", daemon=True).start()
+
+    def _compute(self, path: str):
+        try:
+            stat_result = os.stat(path)
+            if self._read_sidecar(path, stat_result.st_size, stat_result.st_mtime_ns):
+                return
+            digest = hashlib.sha256()
+            with open(path, "rb") as file:
+                for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+
+            after = os.stat(path)
+            if (after.st_size, after.st_mtime_ns) != (stat_result.st_size, stat_result.st_mtime_ns):
+                logger.warning(f"Arquivo alterado durante o cálculo do hash: {path}")
+                return
+
+            value = digest.hexdigest()
+            self._hashes[(path, after.st_size, after.st_mtime_ns)] = value
+            try:
+                sidecar_path = self._sidecar_path(path)
+                os.makedirs(os.path.dirname(sidecar_path), exist_ok=True)
+                partial = f"{sidecar_path}.{os.getpid()}.partial"
+                with open(partial, "w") as sidecar:
+                    json.dump({"path": os.path.abspath(path), "size": after.st_size, "mtime_ns": after.st_mtime_ns, "sha256": value}, sidecar)
+                os.replace(partial, sidecar_path)
+            except OSError as e:
+                logger.warning(f"Não foi possível gravar hash de {path}: {e}")
+            logger.info(f"Hash calculado para {path}")
+        except Exception as e:
+            logger.error(f"Erro ao calcular hash de {path}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(path)
+
+    @staticmethod
+    def _sidecar_path(path: str) -> str:
+        name = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()
+        return os.path.join(config.FILE_HASH_CACHE_DIR, f"{name}.json")
+
+    def _read_sidecar(self, path: str, size: int, mtime_ns: int) -> Optional[str]:
+        try:
+            with open(self._sidecar_path(path)) as sidecar:
+                data = json.load(sidecar)
+        except (OSError, ValueError):
+            return None
+        if data.get("path") == os.path.abspath(path) and data.get("size") == size and data.get("mtime_ns") == mtime_ns:
+            return data.get("sha256")
+        return None
+
+file_hashes = FileHashStore()
+
+def resolve_download_path(download_url: str) -> Optional[str]:
+    """Caminho local do arquivo a partir de download_url (ex.: /static/downloads/x.iso)
+
+    Retorna None para URLs externas ou caminhos fora do diretório da aplicação.
+    """
+    if not download_url or "://" in download_url:
+        return None
+    base = os.path.abspath(".")
+    path = os.path.abspath(os.path.join(base, download_url.lstrip("/")))
+    if os.path.commonpath([base, path]) != base:
+        return None
+    return path
+
+def get_file_info(path: str) -> Optional[FileInfo]:
+    """Metadados do arquivo (None se não existir ou não for arquivo regular)"""
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    if not os.path.isfile(path):
+        return None
+    return FileInfo(
+        path=path,
+        size=stat_result.st_size,
+        mtime=stat_result.st_mtime,
+        mtime_ns=stat_result.st_mtime_ns,
+        sha256=file_hashes.get(path, stat_result.st_size, stat_result.st_mtime_ns)
+    )
+
+def warm_file_hashes(download_urls: Iterable[str]):
+    """Agendar o cálculo dos hashes ainda não conhecidos (ex.: na inicialização)"""
+    for download_url in download_urls:
+        path = resolve_download_path(download_url)
+        if path:
+            get_file_info(path)
+
+def download_filename(product_name: str, path: str) -> str:
+    """Nome sugerido para o arquivo, mantendo a extensão original"""
+    extension = os.path.splitext(path)[1] or ".exe"
+    return f"FovDark_{product_name.replace(' ', '_')}{extension}"
+
+def is_not_modified(request: Request, info: FileInfo) -> bool:
+    """Validação condicional (If-None-Match / If-Modified-Since)"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in candidates or any(info.matches_etag(tag.removeprefix("W/")) for tag in candidates)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(info.mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def should_record_download(request: Request, info: FileInfo) -> bool:
+    """Indica se a requisição inicia um download lógico (contabilizado uma única vez)
+
+    Requisições HEAD, respostas 304 e continuações (Range que não começa no
+    byte 0) não contam; um If-Range que não confere reinicia o download.
+    """
+    if request.method != "GET" or is_not_modified(request, info):
+        return False
+
+    http_range = request.headers.get("range")
+    if not http_range:
+        return True
+
+    if_range = request.headers.get("if-range")
+    if if_range is not None and not info.matches_if_range(if_range):
+        return True
+
+    match = _RANGE_START.match(http_range)
+    if not match:
+        return True
+    start, end = match.groups()
+    if start:
+        return int(start) == 0
+    # Sufixo (bytes=-N) cobre o arquivo inteiro apenas se N >= tamanho
+    return bool(end) and int(end) >= info.size
+
+class SecureFileResponse(FileResponse):
+    """FileResponse com ETag do conteúdo, 304 e envio zero-copy
+
+    Range, If-Range e múltiplos intervalos ficam a cargo do FileResponse do
+    Starlette. Quando o servidor ASGI oferece a extensão
+    `http.response.zerocopysend`, o corpo é enviado com sendfile; caso
+    contrário, em blocos de CHUNK_SIZE lidos em thread.
+    """
+
+    chunk_size = CHUNK_SIZE
+
+    def __init__(self, info: FileInfo, filename: str, media_type: str = "application/octet-stream"):
+        super().__init__(
+            info.path,
+            filename=filename,
+            media_type=media_type,
+            headers={**info.validator_headers, "cache-control": "private, no-cache"},
+            stat_result=os.stat_result((0, 0, 0, 0, 0, 0, info.size, 0, int(info.mtime), 0))
+        )
+        if not info.etag:
+            # O Starlette preenche um ETag de tamanho + mtime quando não há um
+            del self.headers["etag"]
+        self.info = info
+        self._zerocopy = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["method"].upper() in ("GET", "HEAD") and is_not_modified(
+            Request(scope, receive), self.info
+        ):
+            response = Response(status_code=304, headers={
+                **self.info.validator_headers,
+                "cache-control": self.headers["cache-control"]
+            })
+            return await response(scope, receive, send)
+
+        self._zerocopy = "http.response.zerocopysend" in scope.get("extensions", {})
+        await super().__call__(scope, receive, send)
+
+    def _should_use_range(self, http_if_range: str) -> bool:
+        return self.info.matches_if_range(http_if_range)
+
+    async def _handle_simple(self, send: Send, send_header_only: bool) -> None:
+        if not self._zerocopy or send_header_only:
+            return await super()._handle_simple(send, send_header_only)
+
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        await self._send_zerocopy(send, 0, self.info.size)
+
+    async def _handle_single_range(
+        self, send: Send, start: int, end: int, file_size: int, send_header_only: bool
+    ) -> None:
+        if not self._zerocopy or send_header_only:
+            return await super()._handle_single_range(send, start, end, file_size, send_header_only)
+
+        self.headers["content-range"] = f"bytes {start}-{end - 1}/{file_size}"
+        self.headers["content-length"] = str(end - start)
+        await send({"type": "http.response.start", "status": 206, "headers": self.raw_headers})
+        await self._send_zerocopy(send, start, end - start)
+
+    async def _send_zerocopy(self, send: Send, offset: int, count: int):
+        with open(self.path, "rb") as file:
+            await send({
+                "type": "http.response.zerocopysend",
+                "file": file,
+                "offset": offset,
+                "count": count,
+                "more_body": False
+            })
@@ -2,13 +2,81 @@ import hashlib
 import platform
 import subprocess
 import uuid
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
+from typing import Optional
+from sqlalchemy import select, update, func, and_
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import License, Product, User
+from cache import TTLCache
+from config import get_config
+from write_behind import WriteBehindBuffer
 import logging
 
 logger = logging.getLogger(__name__)
 
+config = get_config()
+
+# Cache de verificações por (license_key, hwid) - resultados positivos e negativos
+license_cache = TTLCache(
+    max_size=config.LICENSE_CACHE_MAX_SIZE,
+    ttl=config.LICENSE_CACHE_TTL_SECONDS
+)
+
+def _flush_last_verified(batch: dict):
+    """Gravar last_verified de várias licenças em um único UPDATE em lote"""
+    from database import SessionLocal
+    
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(License),
+            [{"id": license_id, "last_verified": verified_at} for license_id, verified_at in batch.items()]
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+# Heartbeats de verificação coalescidos por licença (mantém o horário mais recente)
+last_verified_buffer = WriteBehindBuffer(
+    "last_verified",
+    _flush_last_verified,
+    merge=max,
+    interval=config.LAST_VERIFIED_FLUSH_SECONDS,
+    max_entries=config.LAST_VERIFIED_FLUSH_MAX_ENTRIES
+)
+
+@dataclass(frozen=True)
+class LicenseSnapshot:
+    """Dados imutáveis de uma licença verificada, seguros para cache"""
+    id: int
+    license_key: str
+    product_id: int
+    product_name: Optional[str]
+    status: str
+    expires_at: datetime
+    hwid: Optional[str]
+    
+    @classmethod
+    def from_license(cls, license_obj: License) -> "LicenseSnapshot":
+        return cls(
+            id=license_obj.id,
+            license_key=license_obj.license_key,
+            product_id=license_obj.product_id,
+            product_name=license_obj.product.name if license_obj.product else None,
+            status=license_obj.status,
+            expires_at=license_obj.expires_at,
+            hwid=license_obj.hwid
+        )
+    
+    @property
+    def is_expired(self) -> bool:
+        return datetime.utcnow() > self.expires_at
+
 def get_hwid() -> str:
     """Obter Hardware ID do sistema"""
     try:
@@ -113,49 +181,211 @@ def create_license(db: Session, user_id: int, product_id: int, duration_days: in
         db.rollback()
         raise
 
+def _evaluate_license(license_obj: License, license_key: str, hwid: str = None) -> tuple[bool, bool]:
+    """Aplicar as regras de validação a uma licença carregada
+    
+    Retorna (válida, alterada) - `alterada` indica que o objeto precisa de commit.
+    """
+    if not license_obj:
+        logger.warning(f"Licença não encontrada: {license_key}")
+        return False, False
+    
+    # Verificar se está expirada (o status é atualizado pelo agendador, não na leitura)
+    if license_obj.is_expired:
+        logger.warning(f"Licença expirada: {license_key}")
+        return False, False
+    
+    # Verificar status
+    if license_obj.status != "active":
+        logger.warning(f"Licença não ativa: {license_key} - Status: {license_obj.status}")
+        return False, False
+    
+    # Verificar HWID se fornecido
+    changed = False
+    if hwid:
+        if license_obj.hwid is None:
+            # Primeira verificação - associar HWID
+            license_obj.hwid = hwid
+            changed = True
+            logger.info(f"HWID associado à licença: {license_key}")
+        elif license_obj.hwid != hwid:
+            logger.warning(f"HWID não corresponde para licença: {license_key}")
+            return False, False
+    
+    # Atualizar última verificação (gravação adiada em lote)
+    last_verified_buffer.add(license_obj.id, datetime.utcnow())
+    
+    logger.info(f"Licença verificada com sucesso: {license_key}")
+    return True, changed
+
+def _check_license(db: Session, license_key: str, hwid: str = None) -> tuple[bool, License]:
+    """Buscar e validar licença (propaga erros de banco)"""
+    license_obj = db.query(License).filter(License.license_key == license_key).first()
+    
+    is_valid, changed = _evaluate_license(license_obj, license_key, hwid)
+    if changed:
+        db.commit()
+    
+    return is_valid, license_obj
+
 def verify_license(db: Session, license_key: str, hwid: str = None) -> tuple[bool, License]:
     """Verificar validade da licença"""
     try:
-        # Buscar licença
-        license_obj = db.query(License).filter(License.license_key == license_key).first()
-        
-        if not license_obj:
-            logger.warning(f"Licença não encontrada: {license_key}")
-            return False, None
+        return _check_license(db, license_key, hwid)
         
-        # Verificar se está expirada
-        if license_obj.is_expired:
-            logger.warning(f"Licença expirada: {license_key}")
-            license_obj.status = "expired"
-            db.commit()
-            return False, license_obj
-        
-        # Verificar status
-        if license_obj.status != "active":
-            logger.warning(f"Licença não ativa: {license_key} - Status: {license_obj.status}")
-            return False, license_obj
-        
-        # Verificar HWID se fornecido
-        if hwid:
-            if license_obj.hwid is None:
-                # Primeira verificação - associar HWID
-                license_obj.hwid = hwid
-                logger.info(f"HWID associado à licença: {license_key}")
-            elif license_obj.hwid != hwid:
-                logger.warning(f"HWID não corresponde para licença: {license_key}")
-                return False, license_obj
-        
-        # Atualizar última verificação
-        license_obj.last_verified = datetime.utcnow()
-        db.commit()
+    except Exception as e:
+        logger.error(f"Erro ao verificar licença {license_key}: {e}")
+        return False, None
+
+def _get_cached_result(cache_key: tuple):
+    """Obter resultado do cache, descartando positivos que já expiraram"""
+    cached = license_cache.get(cache_key)
+    if cached is None:
+        return None
+    
+    is_valid, snapshot = cached
+    # Uma licença válida no cache pode ter expirado desde então
+    if is_valid and snapshot.is_expired:
+        license_cache.delete(cache_key)
+        return None
+    return cached
+
+def _store_result(cache_key: tuple, is_valid: bool, license_obj: Optional[License]) -> Optional[LicenseSnapshot]:
+    """Armazenar resultado da verificação no cache e retornar o snapshot"""
+    snapshot = LicenseSnapshot.from_license(license_obj) if license_obj else None
+    
+    if is_valid:
+        # Não manter no cache além da expiração da licença
+        seconds_left = (snapshot.expires_at - datetime.utcnow()).total_seconds()
+        ttl = min(config.LICENSE_CACHE_TTL_SECONDS, max(seconds_left, 0))
+    else:
+        ttl = config.LICENSE_CACHE_NEGATIVE_TTL_SECONDS
+    
+    if ttl > 0:
+        license_cache.set(cache_key, (is_valid, snapshot), ttl=ttl)
+    
+    return snapshot
+
+def verify_license_cached(db: Session, license_key: str, hwid: str = None) -> tuple[bool, Optional[LicenseSnapshot]]:
+    """Verificar licença usando o cache em memória antes do banco
+    
+    Retorna um LicenseSnapshot no lugar do objeto ORM. Erros de banco não
+    são armazenados no cache.
+    """
+    cache_key = (license_key, hwid or None)
+    cached = _get_cached_result(cache_key)
+    if cached is not None:
+        return cached
+    
+    try:
+        is_valid, license_obj = _check_license(db, license_key, hwid)
+        return is_valid, _store_result(cache_key, is_valid, license_obj)
+    except Exception as e:
+        logger.error(f"Erro ao verificar licença {license_key}: {e}")
+        db.rollback()
+        return False, None
+
+async def verify_license_cached_async(db: AsyncSession, license_key: str, hwid: str = None) -> tuple[bool, Optional[LicenseSnapshot]]:
+    """Versão assíncrona de verify_license_cached"""
+    cache_key = (license_key, hwid or None)
+    cached = _get_cached_result(cache_key)
+    if cached is not None:
+        return cached
+    
+    try:
+        result = await db.execute(
+            select(License).options(joinedload(License.product)).where(License.license_key == license_key)
+        )
+        license_obj = result.scalars().first()
         
-        logger.info(f"Licença verificada com sucesso: {license_key}")
-        return True, license_obj
+        is_valid, changed = _evaluate_license(license_obj, license_key, hwid)
+        if changed:
+            await db.commit()
         
+        return is_valid, _store_result(cache_key, is_valid, license_obj)
     except Exception as e:
         logger.error(f"Erro ao verificar licença {license_key}: {e}")
+        await db.rollback()
         return False, None
 
+def verify_licenses_batch(db: Session, items: list[tuple[str, Optional[str]]]) -> list[tuple[bool, Optional[LicenseSnapshot]]]:
+    """Verificar várias licenças de uma vez
+    
+    Itens fora do cache são resolvidos com uma única consulta IN (...) com
+    JOIN em Product, e eventuais alterações (HWID, expiração) com um único
+    commit. O resultado segue a ordem de `items`.
+    """
+    results: list = [None] * len(items)
+    pending = []
+    
+    for index, (license_key, hwid) in enumerate(items):
+        cached = _get_cached_result((license_key, hwid or None))
+        if cached is not None:
+            results[index] = cached
+        else:
+            pending.append(index)
+    
+    if not pending:
+        return results
+    
+    try:
+        keys = {items[index][0] for index in pending}
+        licenses = db.query(License).options(
+            joinedload(License.product)
+        ).filter(License.license_key.in_(keys)).all()
+        by_key = {license_obj.license_key: license_obj for license_obj in licenses}
+        
+        evaluated = []
+        needs_commit = False
+        for index in pending:
+            license_key, hwid = items[index]
+            license_obj = by_key.get(license_key)
+            is_valid, changed = _evaluate_license(license_obj, license_key, hwid)
+            needs_commit = needs_commit or changed
+            evaluated.append((index, is_valid, license_obj))
+        
+        if needs_commit:
+            db.commit()
+        
+        for index, is_valid, license_obj in evaluated:
+            license_key, hwid = items[index]
+            results[index] = (is_valid, _store_result((license_key, hwid or None), is_valid, license_obj))
+        
+    except Exception as e:
+        logger.error(f"Erro na verificação em lote de licenças: {e}")
+        db.rollback()
+        for index in pending:
+            results[index] = (False, None)
+    
+    return results
+
+def parse_verification_batch(body: dict, max_items: int) -> list[tuple[str, Optional[str]]]:
+    """Validar corpo JSON {"licenses": [{"license_key": ..., "hwid": ...}]} do lote"""
+    entries = body.get("licenses") if isinstance(body, dict) else None
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("Informe a lista 'licenses' com license_key e hwid")
+    
+    if len(entries) > max_items:
+        raise ValueError(f"Máximo de {max_items} licenças por requisição")
+    
+    items = []
+    for entry in entries:
+        license_key = entry.get("license_key") if isinstance(entry, dict) else None
+        hwid = entry.get("hwid") if isinstance(entry, dict) else None
+        if not isinstance(license_key, str) or not license_key.strip():
+            raise ValueError("Cada item precisa de um license_key válido")
+        if hwid is not None and not isinstance(hwid, str):
+            raise ValueError("hwid deve ser texto")
+        items.append((license_key.strip(), hwid or None))
+    
+    return items
+
+def invalidate_license_cache(license_key: str) -> int:
+    """Remover do cache todas as verificações de uma licença (qualquer HWID)"""
+    if not license_key:
+        return 0
+    return license_cache.delete_where(lambda key: key[0] == license_key)
+
 def extend_license(db: Session, license_key: str, additional_days: int) -> bool:
     """Estender duração da licença"""
     try:
@@ -172,6 +402,7 @@ def extend_license(db: Session, license_key: str, additional_days: int) -> bool:
             license_obj.status = "active"
         
         db.commit()
+        invalidate_license_cache(license_key)
         
         logger.info(f"Licença estendida: {license_key} por {additional_days} dias")
         return True
@@ -191,6 +422,7 @@ def revoke_license(db: Session, license_key: str, reason: str = None) -> bool:
         
         license_obj.status = "revoked"
         db.commit()
+        invalidate_license_cache(license_key)
         
         logger.info(f"Licença revogada: {license_key} - Motivo: {reason}")
         return True
@@ -241,63 +473,72 @@ def check_license_for_product(db: Session, user_id: int, product_id: int) -> Lic
         logger.error(f"Erro ao verificar licença do produto {product_id} para usuário {user_id}: {e}")
         return None
 
-def cleanup_expired_licenses(db: Session) -> int:
-    """Limpar licenças expiradas (atualizar status)"""
+def cleanup_expired_licenses(db: Session, batch_size: int = None) -> int:
+    """Marcar como expiradas as licenças ativas vencidas
+    
+    UPDATE baseado em conjunto, em lotes de `batch_size` (uma transação curta
+    por lote), sem carregar as licenças na sessão. Executado pelo agendador.
+    """
+    batch_size = batch_size or config.LICENSE_SWEEP_BATCH_SIZE
+    total = 0
     try:
-        expired_licenses = db.query(License).filter(
-            License.expires_at <= datetime.utcnow(),
-            License.status == "active"
-        ).all()
-        
-        count = 0
-        for license_obj in expired_licenses:
-            license_obj.status = "expired"
-            count += 1
-        
-        db.commit()
+        now = datetime.utcnow()
+        while True:
+            expired_ids = select(License.id).where(
+                License.status == "active",
+                License.expires_at <= now
+            ).limit(batch_size)
+            
+            result = db.execute(
+                update(License).where(License.id.in_(expired_ids)).values(status="expired"),
+                execution_options={"synchronize_session": False}
+            )
+            db.commit()
+            total += result.rowcount
+            if result.rowcount < batch_size:
+                break
         
-        if count > 0:
-            logger.info(f"Limpeza realizada: {count} licenças expiradas atualizadas")
+        if total > 0:
+            logger.info(f"Limpeza realizada: {total} licenças expiradas atualizadas")
         
-        return count
+        return total
         
     except Exception as e:
         logger.error(f"Erro na limpeza de licenças expiradas: {e}")
         db.rollback()
-        return 0
+        return total
 
 def generate_license_report(db: Session, user_id: int = None) -> dict:
-    """Gerar relatório de licenças"""
+    """Gerar relatório de licenças (uma consulta agrupada por produto)"""
     try:
-        query = db.query(License)
+        now = datetime.utcnow()
+        active = and_(License.status == "active", License.expires_at > now)
+        query = db.query(
+            Product.name,
+            func.count(License.id),
+            func.count(License.id).filter(active),
+            func.count(License.id).filter(License.expires_at <= now),
+            func.count(License.id).filter(License.status == "revoked"),
+            func.count(License.id).filter(License.status == "suspended")
+        ).join(Product, License.product_id == Product.id)
         if user_id:
             query = query.filter(License.user_id == user_id)
-        
-        all_licenses = query.all()
-        
-        active_count = len([l for l in all_licenses if l.status == "active" and not l.is_expired])
-        expired_count = len([l for l in all_licenses if l.is_expired])
-        revoked_count = len([l for l in all_licenses if l.status == "revoked"])
-        suspended_count = len([l for l in all_licenses if l.status == "suspended"])
-        
-        # Licenças por produto
-        product_stats = {}
-        for license_obj in all_licenses:
-            product_name = license_obj.product.name
-            if product_name not in product_stats:
-                product_stats[product_name] = {"total": 0, "active": 0}
-            product_stats[product_name]["total"] += 1
-            if license_obj.status == "active" and not license_obj.is_expired:
-                product_stats[product_name]["active"] += 1
-        
-        return {
-            "total": len(all_licenses),
-            "active": active_count,
-            "expired": expired_count,
-            "revoked": revoked_count,
-            "suspended": suspended_count,
-            "by_product": product_stats
-        }
+        rows = query.group_by(Product.id, Product.name).all()
+        
+        report = {"total": 0, "active": 0, "expired": 0, "revoked": 0, "suspended": 0, "by_product": {}}
+        for product_name, total, active_count, expired_count, revoked_count, suspended_count in rows:
+            report["total"] += total
+            report["active"] += active_count
+            report["expired"] += expired_count
+            report["revoked"] += revoked_count
+            report["suspended"] += suspended_count
+            
+            # Produtos homônimos são somados, como no relatório anterior
+            product_stats = report["by_product"].setdefault(product_name, {"total": 0, "active": 0})
+            product_stats["total"] += total
+            product_stats["active"] += active_count
+        
+        return report
         
     except Exception as e:
         logger.error(f"Erro ao gerar relatório de licenças: {e}")
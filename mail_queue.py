@@ -0,0 +1,307 @@
+"""
+Fila persistente de emails (outbox) e envio em segundo plano
+
+Os handlers apenas gravam a mensagem em email_outbox (enqueue_email) e
+respondem; um único worker, eleito pelo mesmo mecanismo de liderança do
+agendador (com um lease próprio), reserva as mensagens devidas em lotes e
+as envia por uma conexão SMTP mantida aberta entre os lotes. Falhas temporárias são reagendadas com espera exponencial; recusas
+definitivas (5xx) e mensagens que esgotam MAIL_MAX_ATTEMPTS ficam como
+"failed". O envio respeita MAIL_RATE_PER_MINUTE. Reservas de um worker que
+morreu expiram após MAIL_LEASE_SECONDS e as mensagens voltam à fila.
+
+Teste local (pip install aiosmtpd): python -m aiosmtpd -n -l 127.0.0.1:8025 com
+SMTP_SERVER=127.0.0.1, SMTP_PORT=8025, SMTP_USE_TLS=false e SMTP_USERNAME vazio.
+"""
+import smtplib
+import threading
+import time
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import and_, delete, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+from config import get_config
+from models import EmailOutbox
+from scheduler import LeaderLock
+
+logger = logging.getLogger(__name__)
+
+config = get_config()
+
+MAIL_LEASE_SECONDS = 300
+MAX_RETRY_SECONDS = 6 * 3600
+
+def _outbox_row(to_email: str, subject: str, html_content: str, text_content: Optional[str], now: datetime) -> dict:
+    return {
+        "to_email": to_email,
+        "subject": subject,
+        "html_body": html_content,
+        "text_body": text_content,
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": now,
+        "created_at": now
+    }
+
+def enqueue_emails(messages: list, db: Optional[Session] = None) -> bool:
+    """Gravar vários emails (tuplas destinatário, assunto, html, texto) na outbox
+
+    Com `db`, as linhas entram na transação do chamador e só são enviadas
+    depois do commit dele; sem `db`, são gravadas em uma transação própria.
+    """
+    if not messages:
+        return True
+
+    from database import engine
+
+    now = datetime.utcnow()
+    rows = [_outbox_row(to_email, subject, html, text, now) for to_email, subject, html, text in messages]
+    try:
+        if db is not None:
+            db.execute(insert(EmailOutbox), rows)
+        else:
+            with engine.begin() as conn:
+                conn.execute(insert(EmailOutbox), rows)
+    except Exception as e:
+        logger.error(f"Erro ao enfileirar {len(rows)} email(s): {e}")
+        return False
+
+    mail_sender.wake()
+    return True
+
+def enqueue_email(to_email: str, subject: str, html_content: str, text_content: str = None,
+                  db: Optional[Session] = None) -> bool:
+    """Gravar um email na outbox para envio em segundo plano"""
+    queued = enqueue_emails([(to_email, subject, html_content, text_content)], db=db)
+    if queued:
+        logger.info(f"Email enfileirado para: {to_email}")
+    return queued
+
+def retry_delay(attempts: int) -> int:
+    """Espera antes da próxima tentativa (exponencial, com teto)"""
+    return min(config.MAIL_RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), MAX_RETRY_SECONDS)
+
+def is_permanent_failure(error: Exception) -> bool:
+    """Recusa definitiva do servidor para esta mensagem (não adianta tentar de novo)"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, (smtplib.SMTPDataError, smtplib.SMTPSenderRefused)):
+        return error.smtp_code >= 500
+    return False
+
+def purge_finished_emails(db: Session, days: Optional[int] = None) -> int:
+    """Remover mensagens enviadas ou descartadas há mais de `days` dias
+
+    As descartadas ("failed") também saem: o corpo guarda links de
+    redefinição de senha e chaves de licença em texto puro.
+    """
+    days = days or config.MAIL_OUTBOX_RETENTION_DAYS
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    result = db.execute(delete(EmailOutbox).where(or_(
+        and_(EmailOutbox.status == "sent", EmailOutbox.sent_at < cutoff),
+        and_(EmailOutbox.status == "failed", EmailOutbox.created_at < cutoff)
+    )))
+    db.commit()
+    return result.rowcount
+
+class MailSender:
+    """Envia a outbox em uma thread, somente no worker líder"""
+
+    def __init__(self, lock: LeaderLock, poll_interval: float, batch_size: int, rate_per_minute: int,
+                 max_attempts: int, idle_timeout: float):
+        from email_utils import SMTPConnection
+
+        self.lock = lock
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.rate_per_minute = rate_per_minute
+        self.max_attempts = max_attempts
+        self.idle_timeout = idle_timeout
+        self.connection = SMTPConnection()
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self._send_times = deque()
+        self._last_activity = time.monotonic()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Iniciar a thread de envio"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="mail-sender", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Parar a thread, fechar a conexão SMTP e liberar a liderança"""
+        self._stopping.set()
+        self._wake.set()
+        thread = self._thread
+        if thread and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout)
+        self._thread = None
+        self.connection.close()
+        self.lock.release()
+
+    def wake(self):
+        """Avisar que há mensagens novas (evita esperar o próximo ciclo)"""
+        self._wake.set()
+
+    def stats(self) -> dict:
+        return {
+            "leader": self.lock.held,
+            "running": bool(self._thread and self._thread.is_alive()),
+            "smtp_connected": self.connection.is_open,
+            "smtp_connects": self.connection.connects,
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed
+        }
+
+    def process_batch(self) -> int:
+        """Reservar e enviar um lote de mensagens devidas; retorna quantas foram reservadas"""
+        rows = self._claim()
+        if not rows:
+            return 0
+
+        try:
+            self.connection.open()
+        except Exception as e:
+            # Servidor indisponível ou credenciais inválidas: não conta como tentativa da mensagem
+            logger.error(f"Erro ao conectar ao servidor SMTP: {e}")
+            self._release([row.id for row in rows], datetime.utcnow() + timedelta(seconds=config.MAIL_RETRY_BASE_SECONDS))
+            return 0
+
+        from email_utils import build_message
+
+        for index, row in enumerate(rows):
+            if not self._throttle():
+                # Parando: devolver o restante do lote à fila
+                self._release([pending.id for pending in rows[index:]], datetime.utcnow())
+                break
+            try:
+                self.connection.send(build_message(row.to_email, row.subject, row.html_body, row.text_body))
+            except Exception as e:
+                self._record_failure(row, e)
+            else:
+                # Marcada logo após o envio: se o worker morrer no meio do lote,
+                # só a mensagem em andamento pode ser reenviada quando a reserva expirar
+                self._mark_sent([row.id])
+            self._last_activity = time.monotonic()
+        return len(rows)
+
+    def _claim(self) -> list:
+        from database import engine
+
+        now = datetime.utcnow()
+        due = or_(
+            and_(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= now),
+            # Reserva de um worker que morreu no meio do envio
+            and_(EmailOutbox.status == "sending", EmailOutbox.locked_until < now)
+        )
+        ids = select(EmailOutbox.id).where(due).order_by(EmailOutbox.next_attempt_at, EmailOutbox.id).limit(self.batch_size)
+        if engine.dialect.name == "postgresql":
+            ids = ids.with_for_update(skip_locked=True)
+
+        stmt = update(EmailOutbox).where(EmailOutbox.id.in_(ids.scalar_subquery())).values(
+            status="sending",
+            locked_until=now + timedelta(seconds=MAIL_LEASE_SECONDS)
+        ).returning(
+            EmailOutbox.id, EmailOutbox.to_email, EmailOutbox.subject,
+            EmailOutbox.html_body, EmailOutbox.text_body, EmailOutbox.attempts
+        )
+        with engine.begin() as conn:
+            rows = conn.execute(stmt).all()
+        return sorted(rows, key=lambda row: row.id)
+
+    def _release(self, ids: List[int], next_attempt_at: datetime):
+        from database import engine
+
+        with engine.begin() as conn:
+            conn.execute(update(EmailOutbox).where(EmailOutbox.id.in_(ids)).values(
+                status="pending", locked_until=None, next_attempt_at=next_attempt_at
+            ))
+
+    def _mark_sent(self, ids: List[int]):
+        from database import engine
+
+        with engine.begin() as conn:
+            conn.execute(update(EmailOutbox).where(EmailOutbox.id.in_(ids)).values(
+                status="sent",
+                attempts=EmailOutbox.attempts + 1,
+                sent_at=datetime.utcnow(),
+                locked_until=None,
+                last_error=None
+            ))
+        self.sent += len(ids)
+
+    def _record_failure(self, row, error: Exception):
+        from database import engine
+
+        attempts = row.attempts + 1
+        values = {"attempts": attempts, "locked_until": None, "last_error": str(error)[:1000]}
+        if is_permanent_failure(error) or attempts >= self.max_attempts:
+            values["status"] = "failed"
+            self.failed += 1
+            logger.error(f"Email {row.id} para {row.to_email} descartado após {attempts} tentativa(s): {error}")
+        else:
+            delay = retry_delay(attempts)
+            values["status"] = "pending"
+            values["next_attempt_at"] = datetime.utcnow() + timedelta(seconds=delay)
+            self.retried += 1
+            logger.warning(f"Falha ao enviar email {row.id} para {row.to_email}, nova tentativa em {delay}s: {error}")
+
+        with engine.begin() as conn:
+            conn.execute(update(EmailOutbox).where(EmailOutbox.id == row.id).values(**values))
+
+    def _throttle(self) -> bool:
+        """Aguardar vaga no limite por minuto; False se o worker estiver parando"""
+        if self.rate_per_minute > 0:
+            while True:
+                now = time.monotonic()
+                while self._send_times and now - self._send_times[0] >= 60:
+                    self._send_times.popleft()
+                if len(self._send_times) < self.rate_per_minute:
+                    break
+                if self._stopping.wait(60 - (now - self._send_times[0])):
+                    return False
+            self._send_times.append(time.monotonic())
+        return not self._stopping.is_set()
+
+    def _close_idle(self):
+        if self.connection.is_open and time.monotonic() - self._last_activity >= self.idle_timeout:
+            self.connection.close()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            processed = 0
+            try:
+                if self.lock.acquire():
+                    processed = self.process_batch()
+            except Exception as e:
+                logger.error(f"Erro no envio de emails: {e}")
+            self._close_idle()
+            if processed < self.batch_size:
+                # Fila vazia (ou só mensagens aguardando nova tentativa): esperar
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+mail_sender = MailSender(
+    LeaderLock("mail_sender"),
+    poll_interval=config.MAIL_POLL_SECONDS,
+    batch_size=config.MAIL_BATCH_SIZE,
+    rate_per_minute=config.MAIL_RATE_PER_MINUTE,
+    max_attempts=config.MAIL_MAX_ATTEMPTS,
+    idle_timeout=config.MAIL_SMTP_IDLE_SECONDS
+)
+
+def start_mail_sender():
+    """Iniciar o envio de emails (na inicialização de cada worker)"""
+    if config.MAIL_SENDER_ENABLED:
+        mail_sender.start()
@@ -22,22 +22,31 @@ from typing import Optional, List
 import shutil
 
 from database import get_db, create_tables
+from config import get_config
 from models import User, Product, License, Transaction, Category, Download
-from auth import authenticate_user, create_access_token, get_current_user, hash_password, verify_password
+from auth import authenticate_user_async, create_access_token, get_current_user, hash_password_async, create_license_token, get_license_token_public_key
 from admin import get_admin_stats, create_product, update_product, delete_product
-from license import verify_license, create_license, get_hwid
-from email_utils import send_password_reset_email, send_license_email
+from license import verify_license, verify_license_cached, verify_licenses_batch, parse_verification_batch, create_license, get_hwid, last_verified_buffer
+from counters import download_counter, record_product_download
+from event_writer import event_writer, record_download
+from scheduler import scheduler, start_scheduler
+from mail_queue import mail_sender, start_mail_sender
+from stripe_webhooks import webhook_processor, start_webhook_processor
+from email_utils import send_password_reset_email, send_license_email, precompile_email_templates
 from password_recovery import create_reset_token, verify_reset_token
 from infinite_pay_simple import create_payment_link
 from security import add_security_headers, validate_input, log_security_event
+import rate_limit_store  # registra o esquema sqlite:// usado pelo Limiter
 from stripe_integration import create_checkout_session, handle_successful_payment, verify_webhook_signature, process_webhook_event
 
 # Configuração de logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+config = get_config()
+
 # Rate limiting
-limiter = Limiter(key_func=get_remote_address)
+limiter = Limiter(key_func=get_remote_address, storage_uri=config.RATELIMIT_STORAGE_URL)
 app = FastAPI(title="FovDark - Sistema de Licenças Digitais", version="1.0.0")
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
@@ -77,8 +86,22 @@ async def security_headers(request: Request, call_next):
 @app.on_event("startup")
 async def startup_event():
     await create_tables()
+    start_scheduler()
+    precompile_email_templates()
+    start_mail_sender()
+    start_webhook_processor()
     logger.info("FovDark iniciado com sucesso!")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Gravar buffers pendentes antes de encerrar o worker"""
+    scheduler.stop()
+    mail_sender.stop()
+    webhook_processor.stop()
+    last_verified_buffer.stop()
+    download_counter.stop()
+    event_writer.stop()
+
 # Rotas principais
 @app.get("/", response_class=HTMLResponse)
 @limiter.limit("30/minute")
@@ -119,7 +142,7 @@ async def login(request: Request, username: str = Form(...), password: str = For
         password = validate_input(password, "password")
         
         # Autenticar usuário
-        user = authenticate_user(db, username, password)
+        user = await authenticate_user_async(db, username, password)
         if not user:
             log_security_event("failed_login", {"username": username, "ip": get_remote_address(request)})
             return templates.TemplateResponse("login.html", {
@@ -194,7 +217,7 @@ async def register(
             })
         
         # Criar novo usuário
-        hashed_password = hash_password(password)
+        hashed_password = await hash_password_async(password)
         new_user = User(
             username=username,
             email=email,
@@ -285,6 +308,15 @@ async def admin_panel(request: Request, current_user: User = Depends(get_current
             "error": "Erro ao carregar dados administrativos"
         })
 
+@app.get("/admin/api/stats")
+@limiter.limit("30/minute")
+async def api_admin_stats(request: Request, current_user: User = Depends(get_current_user), db=Depends(get_db)):
+    """API com as estatísticas do painel (admin apenas)"""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    return {"success": True, "stats": get_admin_stats(db)}
+
 @app.get("/products/{product_id}", response_class=HTMLResponse)
 @limiter.limit("30/minute")
 async def product_detail(request: Request, product_id: int, db=Depends(get_db)):
@@ -508,7 +540,7 @@ async def stripe_webhook(request: Request, db=Depends(get_db)):
         payload = await request.body()
         sig_header = request.headers.get('stripe-signature', '')
         
-        # Processar evento
+        # Verificar e registrar o evento (processado em segundo plano por stripe_webhooks)
         result = process_stripe_webhook_event(payload, sig_header, db)
         
         if result["success"]:
@@ -644,6 +676,23 @@ async def payment_pending(request: Request, ref: str = None):
         "reference": ref
     })
 
+def _license_verification_payload(is_valid: bool, license_obj) -> dict:
+    """Resposta padrão de verificação de licença"""
+    if is_valid:
+        return {
+            "valid": True,
+            "license": {
+                "id": license_obj.id,
+                "status": license_obj.status,
+                "expires_at": license_obj.expires_at.isoformat(),
+                "product_name": license_obj.product_name
+            }
+        }
+    return {
+        "valid": False,
+        "message": "Licença inválida ou expirada"
+    }
+
 @app.get("/api/verify-license/{license_key}")
 @limiter.limit("60/minute")
 async def api_verify_license(request: Request, license_key: str, hwid: str = None, db=Depends(get_db)):
@@ -653,24 +702,10 @@ async def api_verify_license(request: Request, license_key: str, hwid: str = Non
         if not hwid:
             hwid = get_hwid()
         
-        # Verificar licença
-        is_valid, license_obj = verify_license(db, license_key, hwid)
+        # Verificar licença (cache em memória antes do banco)
+        is_valid, license_obj = verify_license_cached(db, license_key, hwid)
         
-        if is_valid:
-            return JSONResponse({
-                "valid": True,
-                "license": {
-                    "id": license_obj.id,
-                    "status": license_obj.status,
-                    "expires_at": license_obj.expires_at.isoformat(),
-                    "product_name": license_obj.product.name
-                }
-            })
-        else:
-            return JSONResponse({
-                "valid": False,
-                "message": "Licença inválida ou expirada"
-            })
+        return JSONResponse(_license_verification_payload(is_valid, license_obj))
             
     except Exception as e:
         logger.error(f"Erro na verificação de licença: {e}")
@@ -679,6 +714,76 @@ async def api_verify_license(request: Request, license_key: str, hwid: str = Non
             "message": "Erro interno do servidor"
         }, status_code=500)
 
+@app.post("/api/verify-licenses")
+@limiter.limit("60/minute")
+async def api_verify_licenses(request: Request, db=Depends(get_db)):
+    """API para verificar várias licenças de uma vez (conta como uma requisição no rate limit)"""
+    try:
+        try:
+            body = await request.json()
+            items = parse_verification_batch(body, config.LICENSE_BATCH_MAX_ITEMS)
+        except ValueError as e:
+            return JSONResponse({
+                "valid": False,
+                "message": str(e)
+            }, status_code=400)
+        
+        results = verify_licenses_batch(db, items)
+        
+        return JSONResponse({
+            "results": [
+                {"license_key": license_key, **_license_verification_payload(is_valid, license_obj)}
+                for (license_key, _), (is_valid, license_obj) in zip(items, results)
+            ]
+        })
+        
+    except Exception as e:
+        logger.error(f"Erro na verificação de licenças em lote: {e}")
+        return JSONResponse({
+            "valid": False,
+            "message": "Erro interno do servidor"
+        }, status_code=500)
+
+@app.post("/api/license-token")
+@limiter.limit("30/minute")
+async def api_license_token(request: Request, license_key: str = Form(...), hwid: str = Form(None), db=Depends(get_db)):
+    """API para emitir/renovar token de licença assinado (validação offline no cliente)"""
+    try:
+        # Renovação sempre consulta o banco: revogações valem no próximo refresh
+        is_valid, license_obj = verify_license(db, license_key, hwid)
+        if not is_valid:
+            return JSONResponse(_license_verification_payload(False, None))
+        
+        token_data = create_license_token(license_obj, hwid)
+        
+        return JSONResponse({
+            "valid": True,
+            "token": token_data["token"],
+            "algorithm": token_data["algorithm"],
+            "token_expires_at": token_data["expires_at"].isoformat(),
+            "license": {
+                "id": license_obj.id,
+                "status": license_obj.status,
+                "expires_at": license_obj.expires_at.isoformat(),
+                "product_name": license_obj.product.name
+            }
+        })
+        
+    except Exception as e:
+        logger.error(f"Erro ao emitir token de licença: {e}")
+        return JSONResponse({
+            "valid": False,
+            "message": "Erro interno do servidor"
+        }, status_code=500)
+
+@app.get("/api/license-token/public-key")
+async def api_license_token_public_key():
+    """Chave pública para validar tokens de licença EdDSA"""
+    public_key = get_license_token_public_key()
+    if not public_key:
+        return JSONResponse({"error": "Tokens de licença não usam chave pública neste servidor"}, status_code=404)
+    return JSONResponse({"algorithm": "EdDSA", "public_key": public_key})
+
 @app.get("/api/download/{product_id}")
 @limiter.limit("10/minute")
 async def api_download_product(
@@ -700,20 +805,15 @@ async def api_download_product(
         # Se produto é gratuito, apenas verificar login
         if product.is_free:
             # Registrar download gratuito
-            download_record = Download(
-                user_id=current_user.id,
-                product_id=product_id,
-                license_id=None,  # Produtos gratuitos não precisam de licença
+            record_download(
+                current_user.id, product_id,
+                None,  # Produtos gratuitos não precisam de licença
                 ip_address=request.client.host if request.client else "unknown",
                 user_agent=request.headers.get("user-agent", "")
             )
-            db.add(download_record)
             
-            # Incrementar contador de downloads
-            db.query(Product).filter(Product.id == product_id).update({
-                'download_count': Product.download_count + 1
-            })
-            db.commit()
+            # Incrementar contador de downloads (agregado e gravado em lote)
+            record_product_download(product_id)
             
             return JSONResponse({
                 "success": True,
@@ -745,15 +845,11 @@ async def api_download_product(
         
         if license_obj:
             # Registrar download licenciado
-            download_record = Download(
-                user_id=current_user.id,
-                product_id=product_id,
-                license_id=license_obj.id,
+            record_download(
+                current_user.id, product_id, license_obj.id,
                 ip_address=request.client.host if request.client else "unknown",
                 user_agent=request.headers.get("user-agent", "")
             )
-            db.add(download_record)
-            db.commit()
         
         # Retornar informações do download
         return JSONResponse({
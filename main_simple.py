@@ -3,24 +3,40 @@ Versão simplificada do main.py para resolver problemas de importação
 """
 import os
 import logging
-from datetime import datetime
-from fastapi import FastAPI, Request, Depends, Form, HTTPException, status
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from datetime import date, datetime
+from typing import Optional
+from fastapi import FastAPI, Request, Depends, Form, HTTPException, Query, status
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Importações locais
-from database import get_db, init_db
+from database import get_db, get_async_db, init_db
 from models import User, Product, Category, License
 from config import get_config
-from auth import hash_password, verify_password, create_access_token, verify_token
+from security import check_rate_limit, get_client_ip
+from page_cache import page_cache
+from catalog import get_catalog, invalidate_catalog
+from file_server import resolve_download_path, get_file_info, should_record_download, download_filename, warm_file_hashes
+from download_urls import download_app, signed_download_url, DOWNLOAD_PATH_PREFIX
+from counters import download_counter, record_product_download
+from event_writer import event_writer, record_download
+from scheduler import scheduler, start_scheduler
+from mail_queue import mail_sender, start_mail_sender
+from email_utils import precompile_email_templates
+from stripe_webhooks import webhook_processor, start_webhook_processor
+from auth import hash_password_async, verify_password_async, verify_and_update_password_async, create_access_token, verify_token, get_password_pool_stats, get_principal, get_principal_async, invalidate_principal, UserSnapshot
 
 # Obter configurações
 config = get_config()
@@ -49,24 +65,55 @@ app.add_middleware(
 
 # Configurar arquivos estáticos e templates
 app.mount("/static", StaticFiles(directory="static"), name="static")
+# Links de download assinados (validados sem consulta ao banco)
+app.mount(DOWNLOAD_PATH_PREFIX, download_app, name="downloads")
 templates = Jinja2Templates(directory="templates")
 
 # Função para obter usuário atual
 def get_current_user_simple(request: Request, db: Session = Depends(get_db)):
-    """Obter usuário atual de forma simplificada"""
+    """Obter usuário atual de forma simplificada
+    
+    O resultado fica em request.state para chamadas repetidas na mesma requisição.
+    """
+    if hasattr(request.state, "current_user"):
+        return request.state.current_user
+    
+    request.state.current_user = _resolve_current_user(request, db)
+    return request.state.current_user
+
+async def get_current_user_async(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Versão de get_current_user_simple para rotas com sessão assíncrona"""
+    if hasattr(request.state, "current_user"):
+        return request.state.current_user
+    
+    user = None
+    try:
+        subject = _token_subject(request)
+        if subject:
+            user = await get_principal_async(db, subject)
+    except Exception as e:
+        logger.error(f"Erro na autenticação: {e}")
+    
+    request.state.current_user = user if user and user.is_active else None
+    return request.state.current_user
+
+def _token_subject(request: Request):
+    """Extrair o 'sub' (email) do token no cookie de acesso"""
+    auth_cookie = request.cookies.get("access_token")
+    if auth_cookie and auth_cookie.startswith("Bearer "):
+        payload = verify_token(auth_cookie[7:])
+        if payload:
+            return payload.get("sub")
+    return None
+
+def _resolve_current_user(request: Request, db: Session):
     try:
-        # Tentar obter token do cookie
-        auth_cookie = request.cookies.get("access_token")
-        if auth_cookie and auth_cookie.startswith("Bearer "):
-            token = auth_cookie[7:]
-            payload = verify_token(token)
-            if payload:
-                # O token contém email no campo 'sub'
-                email = payload.get("sub")
-                if email:
-                    user = db.query(User).filter(User.email == email).first()
-                    if user and user.is_active:
-                        return user
+        # O token contém email no campo 'sub'; snapshot vem do cache
+        subject = _token_subject(request)
+        if subject:
+            user = get_principal(db, subject)
+            if user and user.is_active:
+                return user
     except Exception as e:
         logger.error(f"Erro na autenticação: {e}")
     return None
@@ -78,29 +125,53 @@ async def startup_event():
         logger.info("Iniciando aplicação FovDark...")
         init_db()
         logger.info("Banco de dados inicializado com sucesso")
+        catalog = get_catalog()
+        # Pré-calcular (em segundo plano) os hashes usados como ETag dos arquivos
+        warm_file_hashes(product.download_url for product in catalog.products if product.download_url)
+        # Tarefas periódicas (executadas apenas pelo worker líder)
+        start_scheduler()
+        # Templates de email compilados antes da primeira mensagem
+        precompile_email_templates()
+        # Envio da outbox de emails (apenas um worker envia)
+        start_mail_sender()
+        # Processamento dos webhooks do Stripe registrados (apenas um worker processa)
+        start_webhook_processor()
     except Exception as e:
         logger.error(f"Erro ao inicializar aplicação: {e}")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Finalizar aplicação gravando buffers pendentes"""
+    from license import last_verified_buffer
+    from database import async_engine
+    scheduler.stop()
+    mail_sender.stop()
+    webhook_processor.stop()
+    last_verified_buffer.stop()
+    download_counter.stop()
+    event_writer.stop()
+    await async_engine.dispose()
+
 @app.get("/", response_class=HTMLResponse)
-async def index(request: Request, db: Session = Depends(get_db)):
+async def index(request: Request, db: AsyncSession = Depends(get_async_db)):
     """Página inicial"""
-    current_user = get_current_user_simple(request, db)
-    
-    # Buscar produtos em destaque
-    featured_products = db.query(Product).filter(
-        Product.is_active == True,
-        Product.is_featured == True
-    ).limit(6).all()
+    current_user = await get_current_user_async(request, db)
+    cached = page_cache.lookup(request, current_user)
+    if cached:
+        return cached
     
-    # Buscar categorias
-    categories = db.query(Category).filter(Category.is_active == True).all()
+    # Produtos em destaque e categorias do snapshot do catálogo
+    catalog = get_catalog()
+    featured_products = catalog.featured[:6]
+    categories = catalog.categories
     
-    return templates.TemplateResponse("index.html", {
+    response = templates.TemplateResponse("index.html", {
         "request": request,
-        "current_user": current_user,
+        "current_user": page_cache.template_user(current_user),
         "featured_products": featured_products,
         "categories": categories
     })
+    return page_cache.store(request, current_user, response)
 
 @app.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request):
@@ -112,15 +183,27 @@ async def login(
     request: Request,
     username: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Processar login"""
     try:
+        # Limite compartilhado entre os workers (5 tentativas falhas por minuto por IP)
+        client_ip = get_client_ip(request)
+        if not check_rate_limit(client_ip, "login", limit=5, window=60, consume=False):
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Muitas tentativas de login. Tente novamente em instantes"
+            )
+        
         # Buscar usuário por email ou username
-        user = db.query(User).filter(
-            (User.email == username) | (User.username == username)
-        ).first()
-        if not user or not verify_password(password, user.password_hash):
+        user = (await db.execute(
+            select(User).where((User.email == username) | (User.username == username))
+        )).scalars().first()
+        valid, new_hash = (False, None)
+        if user:
+            valid, new_hash = await verify_and_update_password_async(password, user.password_hash)
+        if not valid:
+            check_rate_limit(client_ip, "login", limit=5, window=60)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Usuário ou senha incorretos"
@@ -132,9 +215,11 @@ async def login(
                 detail="Conta desativada"
             )
         
-        # Atualizar último login
+        # Atualizar último login (e o hash, se o custo do bcrypt mudou)
+        if new_hash:
+            user.password_hash = new_hash
         user.ultimo_login = datetime.utcnow()
-        db.commit()
+        await db.commit()
         
         # Criar token de acesso
         access_token = create_access_token(data={"sub": user.email})
@@ -204,7 +289,7 @@ async def register(
         new_user = User(
             username=username,
             email=email,
-            password_hash=hash_password(password),
+            password_hash=await hash_password_async(password),
             is_active=True,
             is_admin=False
         )
@@ -257,20 +342,19 @@ async def admin_panel(request: Request, db: Session = Depends(get_db)):
     if not current_user or not current_user.is_admin:
         return RedirectResponse(url="/login", status_code=302)
     
-    # Buscar estatísticas
-    total_users = db.query(User).count()
-    total_products = db.query(Product).count()
-    active_licenses = db.query(License).filter(License.status == "active").count()
+    # Buscar estatísticas (agregadas e em cache)
+    from admin import get_admin_stats
+    admin_stats = get_admin_stats(db)
     
     # Buscar produtos para exibição
     products = db.query(Product).all()
     categories = db.query(Category).all()
     
     stats = {
-        'total_users': total_users,
-        'total_products': total_products,
-        'total_sales': 0.0,
-        'active_licenses': active_licenses
+        'total_users': admin_stats.get('users', {}).get('total', 0),
+        'total_products': admin_stats.get('products', {}).get('total', 0),
+        'total_sales': admin_stats.get('revenue', {}).get('total', 0.0),
+        'active_licenses': admin_stats.get('licenses', {}).get('active', 0)
     }
     
     return templates.TemplateResponse("admin_new.html", {
@@ -297,40 +381,120 @@ async def contact_page(request: Request, db: Session = Depends(get_db)):
         "current_user": current_user
     })
 
+def _license_verification_payload(is_valid: bool, license_obj) -> dict:
+    """Resposta padrão de verificação de licença"""
+    if is_valid and license_obj:
+        return {
+            "success": True,
+            "valid": True,
+            "license": {
+                "id": license_obj.id,
+                "product_id": license_obj.product_id,
+                "expires_at": license_obj.expires_at.isoformat() if license_obj.expires_at else None,
+                "status": license_obj.status
+            }
+        }
+    return {
+        "success": True,
+        "valid": False,
+        "message": "Licença inválida ou expirada"
+    }
+
 @app.post("/api/verify-license")
-async def api_verify_license(request: Request, license_key: str = Form(...), hwid: str = Form(None), db: Session = Depends(get_db)):
+async def api_verify_license(request: Request, license_key: str = Form(...), hwid: str = Form(None), db: AsyncSession = Depends(get_async_db)):
     """API para verificar licença"""
+    try:
+        from license import verify_license_cached_async
+        is_valid, license_obj = await verify_license_cached_async(db, license_key, hwid)
+        
+        return JSONResponse(_license_verification_payload(is_valid, license_obj))
+    except Exception as e:
+        logger.error(f"Erro ao verificar licença: {e}")
+        return JSONResponse({
+            "success": False,
+            "valid": False,
+            "message": "Erro interno do servidor"
+        }, status_code=500)
+
+@app.post("/api/verify-licenses")
+async def api_verify_licenses(request: Request, db: Session = Depends(get_db)):
+    """API para verificar várias licenças em uma requisição (launchers)"""
+    try:
+        from license import parse_verification_batch, verify_licenses_batch
+        
+        try:
+            body = await request.json()
+            items = parse_verification_batch(body, config.LICENSE_BATCH_MAX_ITEMS)
+        except ValueError as e:
+            return JSONResponse({
+                "success": False,
+                "message": str(e)
+            }, status_code=400)
+        
+        results = verify_licenses_batch(db, items)
+        
+        return JSONResponse({
+            "success": True,
+            "results": [
+                {"license_key": license_key, **_license_verification_payload(is_valid, license_obj)}
+                for (license_key, _), (is_valid, license_obj) in zip(items, results)
+            ]
+        })
+    except Exception as e:
+        logger.error(f"Erro ao verificar licenças em lote: {e}")
+        return JSONResponse({
+            "success": False,
+            "message": "Erro interno do servidor"
+        }, status_code=500)
+
+@app.post("/api/license-token")
+async def api_license_token(request: Request, license_key: str = Form(...), hwid: str = Form(None), db: Session = Depends(get_db)):
+    """API para emitir/renovar token de licença assinado (validação offline no cliente)"""
     try:
         from license import verify_license
+        from auth import create_license_token
+        
+        # Renovação sempre consulta o banco: revogações valem no próximo refresh
         is_valid, license_obj = verify_license(db, license_key, hwid)
+        payload = _license_verification_payload(is_valid, license_obj)
         
         if is_valid and license_obj:
-            return JSONResponse({
-                "success": True,
-                "valid": True,
-                "license": {
-                    "id": license_obj.id,
-                    "product_id": license_obj.product_id,
-                    "expires_at": license_obj.expires_at.isoformat() if license_obj.expires_at else None,
-                    "status": license_obj.status
-                }
-            })
-        else:
-            return JSONResponse({
-                "success": True,
-                "valid": False,
-                "message": "Licença inválida ou expirada"
+            token_data = create_license_token(license_obj, hwid)
+            payload.update({
+                "token": token_data["token"],
+                "algorithm": token_data["algorithm"],
+                "token_expires_at": token_data["expires_at"].isoformat()
             })
+        
+        return JSONResponse(payload)
     except Exception as e:
-        logger.error(f"Erro ao verificar licença: {e}")
+        logger.error(f"Erro ao emitir token de licença: {e}")
         return JSONResponse({
             "success": False,
             "valid": False,
             "message": "Erro interno do servidor"
         }, status_code=500)
 
+@app.get("/api/license-token/public-key")
+async def api_license_token_public_key():
+    """Chave pública para validar tokens de licença EdDSA"""
+    from auth import get_license_token_public_key
+    
+    public_key = get_license_token_public_key()
+    if not public_key:
+        return JSONResponse({
+            "success": False,
+            "message": "Tokens de licença não usam chave pública neste servidor"
+        }, status_code=404)
+    
+    return JSONResponse({
+        "success": True,
+        "algorithm": "EdDSA",
+        "public_key": public_key
+    })
+
 @app.get("/api/download/{product_id}")
-async def api_download_product(request: Request, product_id: int, current_user: User = Depends(get_current_user_simple), db: Session = Depends(get_db)):
+async def api_download_product(request: Request, product_id: int, current_user: UserSnapshot = Depends(get_current_user_async), db: AsyncSession = Depends(get_async_db)):
     """API para fazer download de produto"""
     try:
         if not current_user:
@@ -340,11 +504,13 @@ async def api_download_product(request: Request, product_id: int, current_user:
             }, status_code=401)
         
         # Verificar se usuário tem licença ativa para o produto
-        license_obj = db.query(License).filter(
-            License.user_id == current_user.id,
-            License.product_id == product_id,
-            License.status == "active"
-        ).first()
+        license_obj = (await db.execute(
+            select(License).where(
+                License.user_id == current_user.id,
+                License.product_id == product_id,
+                License.status == "active"
+            )
+        )).scalars().first()
         
         if not license_obj or license_obj.is_expired:
             return JSONResponse({
@@ -352,20 +518,27 @@ async def api_download_product(request: Request, product_id: int, current_user:
                 "message": "Você não possui licença ativa para este produto"
             }, status_code=403)
         
-        product = db.query(Product).filter(Product.id == product_id).first()
+        product = await db.get(Product, product_id)
         if not product or not product.download_url:
             return JSONResponse({
                 "success": False,
                 "message": "Download não disponível"
             }, status_code=404)
         
-        # Incrementar contador de downloads
-        product.download_count += 1
-        db.commit()
+        # Arquivos locais recebem um link assinado e temporário; URLs externas seguem como estão
+        download_url = product.download_url
+        if resolve_download_path(product.download_url):
+            download_url = signed_download_url(
+                current_user.id, license_obj.id, product.id, product.download_url,
+                download_filename(product.name, product.download_url)
+            )
+        
+        # Incrementar contador de downloads (agregado e gravado em lote)
+        record_product_download(product.id)
         
         return JSONResponse({
             "success": True,
-            "download_url": product.download_url,
+            "download_url": download_url,
             "product_name": product.name,
             "license_key": license_obj.license_key,
             "expires_at": license_obj.expires_at.isoformat()
@@ -378,9 +551,9 @@ async def api_download_product(request: Request, product_id: int, current_user:
             "message": "Erro interno do servidor"
         }, status_code=500)
 
-@app.get("/download/file/{product_id}")
-async def secure_download_file(request: Request, product_id: int, current_user: User = Depends(get_current_user_simple), db: Session = Depends(get_db)):
-    """Download seguro de arquivo do produto"""
+@app.api_route("/download/file/{product_id}", methods=["GET", "HEAD"])
+async def secure_download_file(request: Request, product_id: int, current_user: UserSnapshot = Depends(get_current_user_async), db: AsyncSession = Depends(get_async_db)):
+    """Download seguro de arquivo do produto (redireciona para um link assinado)"""
     try:
         if not current_user:
             return JSONResponse({
@@ -389,11 +562,13 @@ async def secure_download_file(request: Request, product_id: int, current_user:
             }, status_code=401)
         
         # Verificar licença ativa
-        license_obj = db.query(License).filter(
-            License.user_id == current_user.id,
-            License.product_id == product_id,
-            License.status == "active"
-        ).first()
+        license_obj = (await db.execute(
+            select(License).where(
+                License.user_id == current_user.id,
+                License.product_id == product_id,
+                License.status == "active"
+            )
+        )).scalars().first()
         
         if not license_obj or license_obj.is_expired:
             return JSONResponse({
@@ -401,7 +576,7 @@ async def secure_download_file(request: Request, product_id: int, current_user:
                 "message": "Licença expirada ou inválida"
             }, status_code=403)
         
-        product = db.query(Product).filter(Product.id == product_id).first()
+        product = await db.get(Product, product_id)
         if not product or not product.download_url:
             return JSONResponse({
                 "success": False,
@@ -409,41 +584,35 @@ async def secure_download_file(request: Request, product_id: int, current_user:
             }, status_code=404)
         
         # Construir caminho do arquivo
-        file_path = f".{product.download_url}"
-        
-        from fastapi.responses import FileResponse
-        import os
-        
-        if not os.path.exists(file_path):
+        file_path = resolve_download_path(product.download_url)
+        file_info = await run_in_threadpool(get_file_info, file_path) if file_path else None
+        if not file_info:
             return JSONResponse({
                 "success": False,
                 "message": "Arquivo não encontrado no servidor"
             }, status_code=404)
         
-        # Registrar download
-        from models import Download
-        download_record = Download(
-            user_id=current_user.id,
-            license_id=license_obj.id,
-            product_id=product_id,
-            ip_address=request.client.host,
-            downloaded_at=datetime.utcnow()
-        )
-        db.add(download_record)
-        
-        # Incrementar contador
-        product.download_count += 1
-        db.commit()
-        
-        # Determinar nome do arquivo para download
-        filename = f"FovDark_{product.name.replace(' ', '_')}.exe"
+        # Registrar download uma vez por download lógico (não a cada trecho retomado)
+        if should_record_download(request, file_info):
+            # Registro enfileirado e gravado em lote pela thread de eventos
+            record_download(
+                current_user.id, product_id, license_obj.id,
+                ip_address=request.client.host,
+                user_agent=request.headers.get("user-agent")
+            )
+            
+            # Incrementar contador (agregado e gravado em lote)
+            record_product_download(product.id)
         
-        return FileResponse(
-            path=file_path,
-            filename=filename,
-            media_type="application/octet-stream"
+        download_url = signed_download_url(
+            current_user.id, license_obj.id, product.id, product.download_url,
+            download_filename(product.name, file_info.path)
         )
         
+        # Os bytes são enviados pelo /dl (nginx via X-Accel-Redirect ou o próprio app),
+        # sem consulta ao banco; 307 preserva método e cabeçalhos Range/If-Range
+        return RedirectResponse(url=download_url, status_code=307, headers={"Cache-Control": "no-store"})
+        
     except Exception as e:
         logger.error(f"Erro no download seguro: {e}")
         return JSONResponse({
@@ -452,7 +621,7 @@ async def secure_download_file(request: Request, product_id: int, current_user:
         }, status_code=500)
 
 @app.get("/api/license/{license_id}/status")
-async def api_license_status(request: Request, license_id: int, current_user: User = Depends(get_current_user_simple), db: Session = Depends(get_db)):
+async def api_license_status(request: Request, license_id: int, current_user: UserSnapshot = Depends(get_current_user_simple), db: Session = Depends(get_db)):
     """API para obter status da licença em tempo real"""
     try:
         if not current_user:
@@ -473,10 +642,8 @@ async def api_license_status(request: Request, license_id: int, current_user: Us
                 "message": "Licença não encontrada"
             }, status_code=404)
         
-        # Verificar se expirou e atualizar status
-        if license_obj.is_expired and license_obj.status == "active":
-            license_obj.status = "expired"
-            db.commit()
+        # Licenças vencidas são marcadas pelo agendador; até lá, informar o status efetivo
+        status = "expired" if license_obj.is_expired and license_obj.status == "active" else license_obj.status
         
         # Retornar dados da licença
         return JSONResponse({
@@ -484,7 +651,7 @@ async def api_license_status(request: Request, license_id: int, current_user: Us
             "license": {
                 "id": license_obj.id,
                 "license_key": license_obj.license_key,
-                "status": license_obj.status,
+                "status": status,
                 "is_expired": license_obj.is_expired,
                 "time_remaining": license_obj.time_remaining,
                 "formatted_time": license_obj.formatted_time_remaining,
@@ -554,7 +721,7 @@ async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
         payload = await request.body()
         sig_header = request.headers.get('stripe-signature', '')
         
-        # Processar evento
+        # Verificar e registrar o evento (processado em segundo plano por stripe_webhooks)
         result = process_stripe_webhook_event(payload, sig_header, db)
         
         if result["success"]:
@@ -607,17 +774,22 @@ async def products_page(request: Request, db: Session = Depends(get_db)):
     """Página de produtos"""
     try:
         current_user = get_current_user_simple(request, db)
+        cached = page_cache.lookup(request, current_user)
+        if cached:
+            return cached
         
-        # Buscar produtos com categorias
-        products = db.query(Product).join(Category).filter(Product.is_active == True).all()
-        categories = db.query(Category).filter(Category.is_active == True).all()
+        # Produtos com categorias do snapshot do catálogo
+        catalog = get_catalog()
+        products = catalog.products
+        categories = catalog.categories
         
-        return templates.TemplateResponse("products.html", {
+        response = templates.TemplateResponse("products.html", {
             "request": request,
-            "current_user": current_user,
+            "current_user": page_cache.template_user(current_user),
             "products": products,
             "categories": categories
         })
+        return page_cache.store(request, current_user, response)
     except Exception as e:
         logger.error(f"Erro ao carregar produtos: {e}")
         return templates.TemplateResponse("error.html", {
@@ -630,13 +802,18 @@ async def categories_page(request: Request, db: Session = Depends(get_db)):
     """Página de categorias"""
     try:
         current_user = get_current_user_simple(request, db)
-        categories = db.query(Category).filter(Category.is_active == True).all()
+        cached = page_cache.lookup(request, current_user)
+        if cached:
+            return cached
         
-        return templates.TemplateResponse("categories.html", {
+        categories = get_catalog().categories
+        
+        response = templates.TemplateResponse("categories.html", {
             "request": request,
-            "current_user": current_user,
+            "current_user": page_cache.template_user(current_user),
             "categories": categories
         })
+        return page_cache.store(request, current_user, response)
     except Exception as e:
         logger.error(f"Erro ao carregar categorias: {e}")
         return templates.TemplateResponse("error.html", {
@@ -649,34 +826,30 @@ async def category_products(request: Request, category_name: str, db: Session =
     """Página de produtos por categoria"""
     try:
         current_user = get_current_user_simple(request, db)
+        cached = page_cache.lookup(request, current_user)
+        if cached:
+            return cached
         
-        # Buscar categoria por nome (case insensitive)
-        category = db.query(Category).filter(
-            Category.name.ilike(f"%{category_name}%"),
-            Category.is_active == True
-        ).first()
+        # Buscar categoria pelo slug (ou parte do nome)
+        catalog = get_catalog()
+        category = catalog.find_category(category_name)
         
         if not category:
             # Se não encontrar categoria exata, redirecionar para produtos
             return RedirectResponse(url="/products", status_code=302)
         
-        # Buscar produtos da categoria
-        products = db.query(Product).filter(
-            Product.category_id == category.id,
-            Product.is_active == True
-        ).all()
+        products = catalog.products_in_category(category.id)
+        categories = catalog.categories
         
-        # Buscar todas as categorias para o menu
-        categories = db.query(Category).filter(Category.is_active == True).all()
-        
-        return templates.TemplateResponse("products.html", {
+        response = templates.TemplateResponse("products.html", {
             "request": request,
-            "current_user": current_user,
+            "current_user": page_cache.template_user(current_user),
             "products": products,
             "categories": categories,
             "selected_category": category,
             "page_title": f"Produtos - {category.name}"
         })
+        return page_cache.store(request, current_user, response)
     except Exception as e:
         logger.error(f"Erro ao carregar produtos da categoria: {e}")
         return RedirectResponse(url="/products", status_code=302)
@@ -709,14 +882,21 @@ async def downloads_page(request: Request, db: Session = Depends(get_db)):
 
 @app.get("/products/{product_id}")
 @app.get("/product/{product_id}")
-async def product_detail(request: Request, product_id: int, db: Session = Depends(get_db)):
+async def product_detail(request: Request, product_id: int, db: AsyncSession = Depends(get_async_db)):
     """Página de detalhes do produto"""
+    current_user = None
     try:
-        current_user = get_current_user_simple(request, db)
-        
-        # Buscar produto com categoria
-        product = db.query(Product).join(Category).filter(Product.id == product_id).first()
-        if not product or not product.is_active:
+        current_user = await get_current_user_async(request, db)
+        # Para usuários logados a página depende das licenças deles: sem cache
+        if current_user is None:
+            cached = page_cache.lookup(request, None)
+            if cached:
+                return cached
+        
+        # Produto com categoria do snapshot do catálogo (apenas ativos)
+        catalog = get_catalog()
+        product = catalog.get_product(product_id)
+        if not product:
             return templates.TemplateResponse("error.html", {
                 "request": request,
                 "current_user": current_user,
@@ -727,19 +907,17 @@ async def product_detail(request: Request, product_id: int, db: Session = Depend
         user_license = None
         can_download = False
         if current_user:
-            user_license = db.query(License).filter(
-                License.user_id == current_user.id,
-                License.product_id == product_id,
-                License.status == "active"
-            ).first()
+            user_license = (await db.execute(
+                select(License).where(
+                    License.user_id == current_user.id,
+                    License.product_id == product_id,
+                    License.status == "active"
+                )
+            )).scalars().first()
             can_download = user_license is not None
         
-        # Buscar produtos relacionados da mesma categoria
-        related_products = db.query(Product).filter(
-            Product.category_id == product.category_id,
-            Product.id != product_id,
-            Product.is_active == True
-        ).limit(4).all()
+        # Produtos relacionados da mesma categoria (índice do catálogo)
+        related_products = catalog.related(product, limit=4)
         
         # Formatar preço
         formatted_price = f"R$ {product.price:.2f}".replace(".", ",")
@@ -749,7 +927,7 @@ async def product_detail(request: Request, product_id: int, db: Session = Depend
         if product.tags:
             tags_list = [tag.strip() for tag in product.tags.split(",")]
         
-        return templates.TemplateResponse("product_detail.html", {
+        response = templates.TemplateResponse("product_detail.html", {
             "request": request,
             "current_user": current_user,
             "product": product,
@@ -760,6 +938,9 @@ async def product_detail(request: Request, product_id: int, db: Session = Depend
             "tags_list": tags_list,
             "page_title": f"{product.name} - FovDark Gaming"
         })
+        if current_user is None:
+            return page_cache.store(request, None, response)
+        return response
     except Exception as e:
         logger.error(f"Erro ao carregar produto {product_id}: {e}")
         return templates.TemplateResponse("error.html", {
@@ -954,6 +1135,7 @@ async def api_create_product(
         
         db.add(new_product)
         db.commit()
+        invalidate_catalog()
         db.refresh(new_product)
         
         # Sincronizar automaticamente com Stripe se for produto pago
@@ -1007,6 +1189,7 @@ async def api_sync_stripe_products(
         
         # Sincronizar todos os produtos
         result = manager.sync_all_products(db)
+        invalidate_catalog()
         
         if result['success']:
             return JSONResponse(content={
@@ -1084,6 +1267,7 @@ async def api_update_product(
         product.updated_at = datetime.utcnow()
         
         db.commit()
+        invalidate_catalog()
         db.refresh(product)
         
         # Sincronizar automaticamente com Stripe se for produto pago
@@ -1150,6 +1334,7 @@ async def api_create_category(
         
         db.add(new_category)
         db.commit()
+        invalidate_catalog()
         
         return JSONResponse(content={
             "success": True,
@@ -1165,8 +1350,23 @@ async def api_create_category(
         )
 
 @app.get("/api/admin/users")
-async def api_get_users(request: Request, db: Session = Depends(get_db)):
-    """API para obter lista de usuários (admin apenas)"""
+async def api_get_users(
+    request: Request,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    email: Optional[str] = None,
+    created_from: Optional[date] = None,
+    created_to: Optional[date] = None,
+    sort: str = "id",
+    order: str = "desc",
+    db: Session = Depends(get_db)
+):
+    """API para obter lista paginada de usuários (admin apenas)
+    
+    Paginação por cursor (next_cursor), com filtros por status, prefixo do
+    e-mail e data de cadastro; ordenação por id, created_at ou email.
+    """
     try:
         current_user = get_current_user_simple(request, db)
         if not current_user or not current_user.is_admin:
@@ -1175,17 +1375,20 @@ async def api_get_users(request: Request, db: Session = Depends(get_db)):
                 content={"success": False, "message": "Acesso negado"}
             )
         
-        # Buscar usuários com contagem de licenças
-        users = db.query(User).all()
-        users_data = []
+        from admin import list_users_page
+        try:
+            rows, next_cursor = list_users_page(
+                db, limit=limit, cursor=cursor, status=status, email_prefix=email,
+                created_from=created_from, created_to=created_to, sort=sort, order=order
+            )
+        except ValueError as e:
+            return JSONResponse(
+                status_code=400,
+                content={"success": False, "message": str(e)}
+            )
         
-        for user in users:
-            license_count = db.query(License).filter(
-                License.user_id == user.id,
-                License.status == "active"
-            ).count()
-            
-            users_data.append({
+        users_data = [
+            {
                 "id": user.id,
                 "username": user.username,
                 "email": user.email,
@@ -1193,11 +1396,15 @@ async def api_get_users(request: Request, db: Session = Depends(get_db)):
                 "is_admin": user.is_admin,
                 "license_count": license_count,
                 "created_at": user.created_at.strftime("%d/%m/%Y") if user.created_at else None
-            })
+            }
+            for user, license_count in rows
+        ]
         
         return JSONResponse(content={
             "success": True,
-            "users": users_data
+            "users": users_data,
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None
         })
         
     except Exception as e:
@@ -1207,9 +1414,50 @@ async def api_get_users(request: Request, db: Session = Depends(get_db)):
             content={"success": False, "message": "Erro interno do servidor"}
         )
 
+@app.get("/api/admin/stats")
+async def api_get_admin_stats(request: Request, db: Session = Depends(get_db)):
+    """API com as estatísticas do painel (admin apenas)"""
+    try:
+        current_user = get_current_user_simple(request, db)
+        if not current_user or not current_user.is_admin:
+            return JSONResponse(
+                status_code=403,
+                content={"success": False, "message": "Acesso negado"}
+            )
+        
+        from admin import get_admin_stats
+        return JSONResponse(content={
+            "success": True,
+            "stats": jsonable_encoder(get_admin_stats(db))
+        })
+        
+    except Exception as e:
+        logger.error(f"Erro ao buscar estatísticas: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"success": False, "message": "Erro interno do servidor"}
+        )
+
 @app.get("/api/admin/licenses")
-async def api_get_licenses(request: Request, db: Session = Depends(get_db)):
-    """API para obter lista de licenças (admin apenas)"""
+async def api_get_licenses(
+    request: Request,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    product_id: Optional[int] = None,
+    email: Optional[str] = None,
+    created_from: Optional[date] = None,
+    created_to: Optional[date] = None,
+    sort: str = "id",
+    order: str = "desc",
+    db: Session = Depends(get_db)
+):
+    """API para obter lista paginada de licenças (admin apenas)
+    
+    Paginação por cursor (next_cursor), com filtros por status, produto,
+    prefixo do e-mail do usuário e data de criação; ordenação por id,
+    created_at ou expires_at.
+    """
     try:
         current_user = get_current_user_simple(request, db)
         if not current_user or not current_user.is_admin:
@@ -1218,23 +1466,38 @@ async def api_get_licenses(request: Request, db: Session = Depends(get_db)):
                 content={"success": False, "message": "Acesso negado"}
             )
         
-        # Buscar licenças com dados do usuário e produto
-        licenses = db.query(License).join(User).join(Product).all()
-        licenses_data = []
+        from admin import list_licenses_page
+        try:
+            licenses, next_cursor = list_licenses_page(
+                db, limit=limit, cursor=cursor, status=status, product_id=product_id, email_prefix=email,
+                created_from=created_from, created_to=created_to, sort=sort, order=order
+            )
+        except ValueError as e:
+            return JSONResponse(
+                status_code=400,
+                content={"success": False, "message": str(e)}
+            )
         
-        for license_obj in licenses:
-            licenses_data.append({
+        licenses_data = [
+            {
                 "license_key": license_obj.license_key,
                 "user_username": license_obj.user.username,
+                "user_email": license_obj.user.email,
+                "product_id": license_obj.product_id,
                 "product_name": license_obj.product.name,
+                "status": license_obj.status,
                 "is_active": license_obj.status == "active",
                 "expires_at": license_obj.expires_at.strftime("%d/%m/%Y") if license_obj.expires_at else None,
                 "created_at": license_obj.created_at.strftime("%d/%m/%Y") if license_obj.created_at else None
-            })
+            }
+            for license_obj in licenses
+        ]
         
         return JSONResponse(content={
             "success": True,
-            "licenses": licenses_data
+            "licenses": licenses_data,
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None
         })
         
     except Exception as e:
@@ -1244,6 +1507,56 @@ async def api_get_licenses(request: Request, db: Session = Depends(get_db)):
             content={"success": False, "message": "Erro interno do servidor"}
         )
 
+@app.get("/api/admin/export/{dataset}")
+async def api_admin_export(
+    request: Request,
+    dataset: str,
+    format: str = "csv",
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    status: Optional[str] = None,
+    gzip: bool = False,
+    db: Session = Depends(get_db)
+):
+    """Exportação em streaming (admin apenas)
+    
+    dataset: users, licenses, transactions, downloads ou security_logs;
+    format: csv ou ndjson; gzip=true comprime a transferência.
+    """
+    try:
+        current_user = get_current_user_simple(request, db)
+        if not current_user or not current_user.is_admin:
+            return JSONResponse(
+                status_code=403,
+                content={"success": False, "message": "Acesso negado"}
+            )
+        
+        from exports import stream_export, export_filename, EXPORT_FORMATS
+        try:
+            body = stream_export(dataset, format, date_from=date_from, date_to=date_to, status=status, gzip=gzip)
+        except ValueError as e:
+            return JSONResponse(
+                status_code=400,
+                content={"success": False, "message": str(e)}
+            )
+        
+        headers = {
+            "Content-Disposition": f'attachment; filename="{export_filename(dataset, format)}"',
+            "Cache-Control": "no-store"
+        }
+        if gzip:
+            headers["Content-Encoding"] = "gzip"
+        
+        logger.info(f"Exportação {dataset} ({format}) iniciada por {current_user.email}")
+        return StreamingResponse(body, media_type=EXPORT_FORMATS[format], headers=headers)
+        
+    except Exception as e:
+        logger.error(f"Erro ao exportar dados: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"success": False, "message": "Erro interno do servidor"}
+        )
+
 @app.get("/contact")
 async def contact_page(request: Request, db: Session = Depends(get_db)):
     """Página de contato"""
@@ -1397,6 +1710,7 @@ async def api_create_product(
         new_product = Product(**product_data)
         db.add(new_product)
         db.commit()
+        invalidate_catalog()
         db.refresh(new_product)
         
         return JSONResponse(content={
@@ -1445,6 +1759,7 @@ async def api_delete_product(
             # Desativar ao invés de deletar se há licenças ativas
             product.is_active = False
             db.commit()
+            invalidate_catalog()
             return JSONResponse(content={
                 "success": True, 
                 "message": "Produto desativado (há licenças ativas)"
@@ -1453,6 +1768,7 @@ async def api_delete_product(
             # Deletar produto
             db.delete(product)
             db.commit()
+            invalidate_catalog()
             return JSONResponse(content={
                 "success": True, 
                 "message": "Produto excluído com sucesso"
@@ -1488,8 +1804,10 @@ async def api_change_password(request: Request, db: Session = Depends(get_db)):
                 content={"success": False, "message": "Senha atual e nova senha são obrigatórias"}
             )
         
+        user = db.query(User).filter(User.id == current_user.id).first()
+        
         # Verificar senha atual
-        if not verify_password(current_password, current_user.senha_hash):
+        if not await verify_password_async(current_password, user.password_hash):
             return JSONResponse(
                 status_code=400,
                 content={"success": False, "message": "Senha atual incorreta"}
@@ -1503,8 +1821,9 @@ async def api_change_password(request: Request, db: Session = Depends(get_db)):
             )
         
         # Atualizar senha
-        current_user.senha_hash = hash_password(new_password)
+        user.password_hash = await hash_password_async(new_password)
         db.commit()
+        invalidate_principal(user)
         
         return JSONResponse(content={
             "success": True,
@@ -1522,7 +1841,15 @@ async def api_change_password(request: Request, db: Session = Depends(get_db)):
 @app.get("/health")
 async def health_check():
     """Health check da aplicação"""
-    return {"status": "ok", "message": "FovDark está funcionando"}
+    return {
+        "status": "ok",
+        "message": "FovDark está funcionando",
+        "password_pool": get_password_pool_stats(),
+        "event_queue": event_writer.stats(),
+        "scheduler": scheduler.stats(),
+        "mail_queue": mail_sender.stats(),
+        "stripe_webhooks": webhook_processor.stats()
+    }
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,36 @@
+-- Índices compostos dos predicados mais usados (declarados em models.py)
+-- Execute com psql, um comando por vez: CREATE INDEX CONCURRENTLY não roda dentro de transação.
+-- No editor SQL do Supabase, remova CONCURRENTLY (a tabela fica bloqueada para escrita durante a criação).
+-- A aplicação cria os que faltarem na inicialização (database.ensure_indexes).
+
+-- 1. Usuários: ordenação paginada da listagem administrativa
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_created_at_id ON public.users USING btree (created_at, id);
+
+-- 2. Licenças
+-- Verificação de licença do usuário para um produto (download, compra, validação)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_licenses_user_product_status_expires ON public.licenses USING btree (user_id, product_id, status, expires_at);
+-- Licenças ativas de um produto (exclusão de produto, filtros administrativos)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_licenses_product_status_expires ON public.licenses USING btree (product_id, status, expires_at);
+-- Varredura de expiração e avisos de vencimento
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_licenses_status_expires ON public.licenses USING btree (status, expires_at);
+-- Ordenações paginadas da listagem administrativa
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_licenses_created_at_id ON public.licenses USING btree (created_at, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_licenses_expires_at_id ON public.licenses USING btree (expires_at, id);
+
+-- 3. Transações: relatórios por status e período
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_transactions_status_created_at ON public.transactions USING btree (status, created_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_transactions_user_created_at ON public.transactions USING btree (user_id, created_at);
+
+-- 4. Downloads e logs de segurança: consultas por período
+-- (em tabelas já particionadas por retention.py, remova CONCURRENTLY)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_downloads_downloaded_at ON public.downloads USING btree (downloaded_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_downloads_user_downloaded_at ON public.downloads USING btree (user_id, downloaded_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_security_logs_created_at ON public.security_logs USING btree (created_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_security_logs_event_type_created_at ON public.security_logs USING btree (event_type, created_at);
+
+-- 5. Atualizar estatísticas do planejador
+ANALYZE public.users;
+ANALYZE public.licenses;
+ANALYZE public.transactions;
+ANALYZE public.downloads;
+ANALYZE public.security_logs;
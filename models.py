@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Boolean, Text, ForeignKey, JSON, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime, timedelta
@@ -9,6 +9,10 @@ Base = declarative_base()
 class User(Base):
     """Modelo de usuário compatível com Supabase"""
     __tablename__ = "users"
+    __table_args__ = (
+        # Ordenação paginada da listagem administrativa
+        Index("ix_users_created_at_id", "created_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(50), unique=True, index=True, nullable=True)
@@ -113,6 +117,17 @@ class Product(Base):
 class License(Base):
     """Modelo de licença"""
     __tablename__ = "licenses"
+    __table_args__ = (
+        # Verificação de licença do usuário para um produto (download, compra, validação)
+        Index("ix_licenses_user_product_status_expires", "user_id", "product_id", "status", "expires_at"),
+        # Licenças ativas de um produto (exclusão de produto, filtros administrativos)
+        Index("ix_licenses_product_status_expires", "product_id", "status", "expires_at"),
+        # Varredura de expiração e avisos de vencimento
+        Index("ix_licenses_status_expires", "status", "expires_at"),
+        # Ordenações paginadas da listagem administrativa
+        Index("ix_licenses_created_at_id", "created_at", "id"),
+        Index("ix_licenses_expires_at_id", "expires_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     license_key = Column(String(255), unique=True, nullable=False, index=True)
@@ -191,9 +206,31 @@ class License(Base):
         else:
             return f"{time_data['minutes']}m {time_data['seconds']}s"
 
+class LicenseNotification(Base):
+    """Aviso enviado sobre uma licença (evita reenvio do mesmo aviso)"""
+    __tablename__ = "license_notifications"
+    __table_args__ = (
+        # Um aviso por janela e por data de expiração (renovar a licença libera novos avisos)
+        UniqueConstraint("license_id", "kind", "license_expires_at", name="uq_license_notifications_license_kind_expires"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    license_id = Column(Integer, ForeignKey("licenses.id", ondelete="CASCADE"), nullable=False)
+    kind = Column(String(30), nullable=False)  # expiry_7d, expiry_3d, expiry_1d
+    license_expires_at = Column(DateTime, nullable=False)
+    sent_at = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<LicenseNotification(license_id={self.license_id}, kind='{self.kind}')>"
+
 class Transaction(Base):
     """Modelo de transação"""
     __tablename__ = "transactions"
+    __table_args__ = (
+        # Relatórios e recálculo de rollups por status e período
+        Index("ix_transactions_status_created_at", "status", "created_at"),
+        Index("ix_transactions_user_created_at", "user_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -213,9 +250,40 @@ class Transaction(Base):
     def __repr__(self):
         return f"<Transaction(id={self.id}, amount={self.amount}, status='{self.status}')>"
 
+class StripeWebhookEvent(Base):
+    """Evento de webhook do Stripe recebido (registro de idempotência e fila de processamento)"""
+    __tablename__ = "stripe_webhook_events"
+    __table_args__ = (
+        # Busca dos eventos devidos e ordem por objeto (sessão de checkout)
+        Index("ix_stripe_webhook_events_status_next_attempt", "status", "next_attempt_at"),
+        Index("ix_stripe_webhook_events_object_created", "object_id", "stripe_created_at"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    event_id = Column(String(255), unique=True, nullable=False)  # evt_... do Stripe
+    event_type = Column(String(100), nullable=False)
+    object_id = Column(String(255))  # ID do objeto do evento (ex.: cs_... da sessão)
+    stripe_created_at = Column(DateTime, nullable=False)
+    payload = Column(Text, nullable=False)  # corpo bruto recebido
+    status = Column(String(20), nullable=False, default="pending")  # pending, processing, processed, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = Column(DateTime)
+    last_error = Column(Text)
+    received_at = Column(DateTime, default=datetime.utcnow)
+    processed_at = Column(DateTime)
+    
+    def __repr__(self):
+        return f"<StripeWebhookEvent(event_id='{self.event_id}', type='{self.event_type}', status='{self.status}')>"
+
 class Download(Base):
     """Modelo de download"""
     __tablename__ = "downloads"
+    __table_args__ = (
+        # Consultas por período (rollups, retenção) e histórico do usuário
+        Index("ix_downloads_downloaded_at", "downloaded_at"),
+        Index("ix_downloads_user_downloaded_at", "user_id", "downloaded_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -233,9 +301,48 @@ class Download(Base):
     def __repr__(self):
         return f"<Download(user_id={self.user_id}, product_id={self.product_id})>"
 
+class DailyProductDownloads(Base):
+    """Rollup diário de downloads por produto"""
+    __tablename__ = "daily_product_downloads"
+    
+    day = Column(Date, primary_key=True)
+    product_id = Column(Integer, primary_key=True)
+    downloads = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<DailyProductDownloads(day={self.day}, product_id={self.product_id}, downloads={self.downloads})>"
+
+class DailyRevenue(Base):
+    """Rollup diário de transações por status e forma de pagamento"""
+    __tablename__ = "daily_revenue"
+    
+    day = Column(Date, primary_key=True)
+    status = Column(String(20), primary_key=True)
+    payment_method = Column(String(50), primary_key=True, default="")  # "" quando não informado
+    transactions = Column(Integer, nullable=False, default=0)
+    amount = Column(Float, nullable=False, default=0.0)
+    
+    def __repr__(self):
+        return f"<DailyRevenue(day={self.day}, status='{self.status}', amount={self.amount})>"
+
+class DailySignups(Base):
+    """Rollup diário de cadastros de usuários"""
+    __tablename__ = "daily_signups"
+    
+    day = Column(Date, primary_key=True)
+    signups = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<DailySignups(day={self.day}, signups={self.signups})>"
+
 class SecurityLog(Base):
     """Modelo de log de segurança"""
     __tablename__ = "security_logs"
+    __table_args__ = (
+        # Logs recentes e retenção por tipo de evento
+        Index("ix_security_logs_created_at", "created_at"),
+        Index("ix_security_logs_event_type_created_at", "event_type", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     event_type = Column(String(50), nullable=False)  # login, failed_login, etc.
@@ -248,6 +355,41 @@ class SecurityLog(Base):
     def __repr__(self):
         return f"<SecurityLog(event='{self.event_type}', user_id={self.user_id})>"
 
+class LeaderLease(Base):
+    """Liderança entre workers (agendador, envio de emails, webhooks): um lease por papel"""
+    __tablename__ = "leader_leases"
+    
+    name = Column(String(100), primary_key=True)
+    holder = Column(String(255), nullable=False)  # host:pid:id do worker líder
+    expires_at = Column(DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f"<LeaderLease(name='{self.name}', holder='{self.holder}')>"
+
+class EmailOutbox(Base):
+    """Email aguardando envio (processado em segundo plano por mail_queue)"""
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        # Busca das mensagens devidas pelo remetente
+        Index("ix_email_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    to_email = Column(String(255), nullable=False)
+    subject = Column(String(255), nullable=False)
+    html_body = Column(Text, nullable=False)
+    text_body = Column(Text)
+    status = Column(String(20), nullable=False, default="pending")  # pending, sending, sent, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = Column(DateTime)  # fim da reserva de uma mensagem em envio
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime)
+    
+    def __repr__(self):
+        return f"<EmailOutbox(id={self.id}, to='{self.to_email}', status='{self.status}')>"
+
 class PasswordReset(Base):
     """Modelo de reset de senha"""
     __tablename__ = "password_resets"
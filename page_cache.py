@@ -0,0 +1,141 @@
+"""
+Cache de páginas HTML do catálogo com ETag/Last-Modified e respostas 304
+"""
+import hashlib
+import html
+import threading
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from cache import TTLCache
+from config import get_config
+
+config = get_config()
+
+# Marcador do nome do usuário na variante renderizada para usuários logados
+USERNAME_PLACEHOLDER = "__fovdark_current_username__"
+
+@dataclass(frozen=True)
+class CachedPage:
+    """Página renderizada e seus validadores"""
+    body: str
+    etag: str
+    last_modified: datetime
+    media_type: str
+
+class PageCache:
+    """Cache de páginas por (caminho, query, público).
+
+    As páginas do catálogo variam apenas pelo público (anônimo, usuário ou
+    admin) e pelo nome do usuário no cabeçalho. Cada público tem uma
+    variante cacheada; para usuários logados a variante é renderizada com
+    USERNAME_PLACEHOLDER e o nome é inserido a cada resposta (composição
+    do fragmento personalizado). Alterações no catálogo chamam
+    `invalidate()`; nos demais workers o TTL limita a defasagem.
+    """
+
+    def __init__(self, max_size: int = 500, ttl: float = 60.0):
+        self._pages = TTLCache(max_size=max_size, ttl=ttl)
+        self._lock = threading.Lock()
+        self.version = 0
+        self.last_modified = _now()
+
+    def invalidate(self):
+        """Descartar todas as páginas após alteração no catálogo"""
+        with self._lock:
+            self.version += 1
+            self.last_modified = _now()
+            self._pages.clear()
+
+    def template_user(self, current_user):
+        """Usuário a ser passado ao template ao renderizar uma variante"""
+        if current_user is None:
+            return None
+        return replace(current_user, username=USERNAME_PLACEHOLDER, email="")
+
+    def lookup(self, request: Request, current_user) -> Optional[Response]:
+        """Resposta a partir do cache (200 ou 304) ou None em caso de falta"""
+        request.state.page_cache_version = self.version
+        page = self._pages.get(self._key(request, current_user))
+        if page is None:
+            return None
+        return self._respond(request, page, current_user, "HIT")
+
+    def store(self, request: Request, current_user, response: Response) -> Response:
+        """Guardar a página recém-renderizada e devolver a resposta final"""
+        if response.status_code != 200:
+            return response
+
+        body = response.body.decode(response.charset)
+        page = CachedPage(
+            body=body,
+            etag=hashlib.sha1(body.encode()).hexdigest()[:20],
+            last_modified=self.last_modified,
+            media_type=response.media_type or "text/html"
+        )
+        # Não guardar páginas cujos dados foram lidos antes de uma invalidação
+        if getattr(request.state, "page_cache_version", None) == self.version:
+            self._pages.set(self._key(request, current_user), page)
+        return self._respond(request, page, current_user, "MISS")
+
+    def stats(self) -> dict:
+        """Estatísticas do cache de páginas"""
+        return {"version": self.version, **self._pages.stats()}
+
+    def _key(self, request: Request, current_user) -> tuple:
+        return (request.url.path, request.url.query, _audience(current_user))
+
+    def _respond(self, request: Request, page: CachedPage, current_user, cache_status: str) -> Response:
+        body, etag = page.body, page.etag
+        if current_user is not None:
+            username = html.escape(current_user.username or current_user.email)
+            body = body.replace(USERNAME_PLACEHOLDER, username)
+            etag = hashlib.sha1(f"{etag}:{username}".encode()).hexdigest()[:20]
+
+        headers = {
+            "ETag": f'"{etag}"',
+            "Last-Modified": format_datetime(page.last_modified, usegmt=True),
+            "Cache-Control": ("private" if current_user else "public") + ", max-age=0, must-revalidate",
+            "Vary": "Cookie",
+            "X-Cache": cache_status
+        }
+
+        if _not_modified(request, headers["ETag"], page.last_modified):
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type=page.media_type, headers=headers)
+
+def _audience(current_user) -> str:
+    if current_user is None:
+        return "anon"
+    return "admin" if current_user.is_admin else "user"
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(microsecond=0)
+
+def _not_modified(request: Request, etag: str, last_modified: datetime) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in candidates or etag in candidates
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return last_modified <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+page_cache = PageCache(
+    max_size=config.PAGE_CACHE_MAX_SIZE,
+    ttl=config.PAGE_CACHE_TTL_SECONDS
+)
+
+def invalidate_catalog_pages():
+    """Invalidar páginas do catálogo (produtos/categorias alterados)"""
+    page_cache.invalidate()
@@ -105,17 +105,12 @@ def use_reset_token(db: Session, token: str, new_password: str) -> bool:
         return False
 
 def cleanup_expired_tokens(db: Session) -> int:
-    """Limpar tokens expirados"""
+    """Invalidar tokens expirados (UPDATE único, executado pelo agendador)"""
     try:
-        expired_tokens = db.query(PasswordReset).filter(
+        count = db.query(PasswordReset).filter(
             PasswordReset.expires_at <= datetime.utcnow(),
             PasswordReset.is_used == False
-        ).all()
-        
-        count = 0
-        for token_record in expired_tokens:
-            token_record.is_used = True
-            count += 1
+        ).update({"is_used": True}, synchronize_session=False)
         
         db.commit()
         
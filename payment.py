@@ -5,9 +5,10 @@ import hashlib
 import hmac
 from datetime import datetime
 from typing import Dict, Optional
-from sqlalchemy.orm import Session
-from models import Transaction, License, User, Product
+from sqlalchemy.orm import Session, joinedload
+from models import Transaction, License, User, Product, DailyRevenue
 from license import create_license
+from rollups import PAID_STATUSES
 from email_utils import send_license_email
 import logging
 
@@ -314,30 +315,72 @@ def cancel_payment(payment_id: str) -> Dict:
         logging.error(f"Cancel payment error: {e}")
         return {"success": False, "error": str(e)}
 
-def get_transaction_report(db: Session, start_date: datetime, end_date: datetime) -> Dict:
-    """Gerar relatório de transações"""
+def get_transaction_report(db: Session, start_date: datetime, end_date: datetime,
+                           include_transactions: bool = False) -> Dict:
+    """Gerar relatório de transações
+    
+    Os totais vêm do rollup diário (um registro por dia, status e forma de
+    pagamento), com granularidade de dia. A lista de transações individuais
+    só é carregada com include_transactions=True.
+    """
     try:
-        transactions = db.query(Transaction).filter(
-            Transaction.created_at >= start_date,
-            Transaction.created_at <= end_date
-        ).all()
-        
-        total_transactions = len(transactions)
-        completed_transactions = [t for t in transactions if t.status == "completed"]
-        total_revenue = sum(t.amount for t in completed_transactions)
-        
-        return {
+        rows = db.query(
+            DailyRevenue.day,
+            DailyRevenue.status,
+            DailyRevenue.payment_method,
+            DailyRevenue.transactions,
+            DailyRevenue.amount
+        ).filter(
+            DailyRevenue.day >= start_date.date(),
+            DailyRevenue.day <= end_date.date()
+        ).order_by(DailyRevenue.day).all()
+        
+        total_transactions = 0
+        completed_count = 0
+        total_revenue = 0.0
+        by_day = {}
+        by_status = {}
+        by_payment_method = {}
+        
+        for day, status, payment_method, count, amount in rows:
+            total_transactions += count
+            by_status[status] = by_status.get(status, 0) + count
+            
+            day_stats = by_day.setdefault(day.isoformat(), {"transactions": 0, "completed": 0, "revenue": 0.0})
+            day_stats["transactions"] += count
+            
+            if status in PAID_STATUSES:
+                completed_count += count
+                total_revenue += amount
+                day_stats["completed"] += count
+                day_stats["revenue"] = round(day_stats["revenue"] + amount, 2)
+                
+                method_stats = by_payment_method.setdefault(payment_method or "N/A", {"transactions": 0, "revenue": 0.0})
+                method_stats["transactions"] += count
+                method_stats["revenue"] = round(method_stats["revenue"] + amount, 2)
+        
+        report = {
             "period": {
                 "start": start_date.isoformat(),
                 "end": end_date.isoformat()
             },
             "summary": {
                 "total_transactions": total_transactions,
-                "completed_transactions": len(completed_transactions),
+                "completed_transactions": completed_count,
                 "total_revenue": round(total_revenue, 2),
-                "average_ticket": round(total_revenue / len(completed_transactions), 2) if completed_transactions else 0
+                "average_ticket": round(total_revenue / completed_count, 2) if completed_count else 0
             },
-            "transactions": [
+            "by_day": by_day,
+            "by_status": by_status,
+            "by_payment_method": by_payment_method
+        }
+        
+        if include_transactions:
+            transactions = db.query(Transaction).options(joinedload(Transaction.product)).filter(
+                Transaction.created_at >= start_date,
+                Transaction.created_at <= end_date
+            ).order_by(Transaction.created_at).all()
+            report["transactions"] = [
                 {
                     "id": t.id,
                     "user_id": t.user_id,
@@ -345,11 +388,12 @@ def get_transaction_report(db: Session, start_date: datetime, end_date: datetime
                     "amount": t.amount,
                     "status": t.status,
                     "created_at": t.created_at.isoformat(),
-                    "completed_at": t.completed_at.isoformat() if t.completed_at else None
+                    "updated_at": t.updated_at.isoformat() if t.updated_at else None
                 }
                 for t in transactions
             ]
-        }
+        
+        return report
         
     except Exception as e:
         logging.error(f"Transaction report error: {e}")
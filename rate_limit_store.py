@@ -0,0 +1,155 @@
+"""
+Armazenamento de rate limit compartilhado entre workers (SQLite em modo WAL)
+"""
+import os
+import sqlite3
+import threading
+import time
+import logging
+from urllib.parse import urlparse
+
+from limits.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+# Intervalo mínimo (segundos) entre limpezas de contadores expirados
+PURGE_INTERVAL = 60
+
+class SQLiteRateLimitStore:
+    """Contadores de janela fixa em um arquivo SQLite compartilhado.
+
+    Todos os workers do gunicorn abrem o mesmo arquivo; cada incremento é
+    um único UPSERT (atômico no SQLite), então o limite configurado vale
+    para o conjunto dos workers e sobrevive a reinícios. O modo WAL permite
+    leituras concorrentes com a escrita, e cada thread usa sua conexão.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._last_purge = 0.0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limits ("
+                "key TEXT PRIMARY KEY, "
+                "count INTEGER NOT NULL, "
+                "expires_at REAL NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            self._local.conn = conn
+        return conn
+
+    def incr(self, key: str, expiry: float, amount: int = 1) -> int:
+        """Incrementar contador (reiniciando a janela se expirada) e retornar o valor"""
+        now = time.time()
+        row = self._connection().execute(
+            "INSERT INTO rate_limits (key, count, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET "
+            "count = CASE WHEN rate_limits.expires_at <= ? THEN excluded.count "
+            "ELSE rate_limits.count + excluded.count END, "
+            "expires_at = CASE WHEN rate_limits.expires_at <= ? THEN excluded.expires_at "
+            "ELSE rate_limits.expires_at END "
+            "RETURNING count",
+            (key, amount, now + expiry, now, now)
+        ).fetchone()
+        self._maybe_purge(now)
+        return row[0]
+
+    def get(self, key: str) -> int:
+        """Valor atual do contador (0 se ausente ou expirado)"""
+        row = self._connection().execute(
+            "SELECT count FROM rate_limits WHERE key = ? AND expires_at > ?",
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key: str) -> float:
+        """Momento (epoch) em que a janela do contador termina"""
+        now = time.time()
+        row = self._connection().execute(
+            "SELECT expires_at FROM rate_limits WHERE key = ? AND expires_at > ?",
+            (key, now)
+        ).fetchone()
+        return row[0] if row else now
+
+    def hit(self, key: str, limit: int, window: float) -> bool:
+        """Registrar uma requisição e indicar se ainda está dentro do limite"""
+        return self.incr(key, window) <= limit
+
+    def clear(self, key: str):
+        """Remover contador específico"""
+        self._connection().execute("DELETE FROM rate_limits WHERE key = ?", (key,))
+
+    def reset(self) -> int:
+        """Remover todos os contadores"""
+        return self._connection().execute("DELETE FROM rate_limits").rowcount
+
+    def check(self) -> bool:
+        """Verificar se o arquivo está acessível"""
+        try:
+            self._connection().execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _maybe_purge(self, now: float):
+        # Limpeza ocasional para o arquivo não crescer com chaves antigas
+        if now - self._last_purge < PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        try:
+            self._connection().execute("DELETE FROM rate_limits WHERE expires_at <= ?", (now,))
+        except sqlite3.Error as e:
+            logger.warning(f"Erro ao limpar contadores de rate limit: {e}")
+
+def path_from_uri(uri: str) -> str:
+    """Caminho do arquivo a partir de uma URI sqlite:///caminho"""
+    parsed = urlparse(uri)
+    path = parsed.netloc + parsed.path
+    # sqlite:///ratelimits.db -> relativo; sqlite:////tmp/x.db -> absoluto
+    if path.startswith("/"):
+        path = path[1:]
+    return path or "ratelimits.db"
+
+class SQLiteStorage(Storage):
+    """Backend `sqlite://` para a biblioteca limits (usada pelo slowapi)
+
+    Ex.: RATELIMIT_STORAGE_URL=sqlite:///ratelimits.db
+    """
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri: str = None, wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.store = SQLiteRateLimitStore(path_from_uri(uri or "sqlite:///ratelimits.db"))
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def incr(self, key: str, expiry: int, amount: int = 1) -> int:
+        return self.store.incr(key, expiry, amount)
+
+    def get(self, key: str) -> int:
+        return self.store.get(key)
+
+    def get_expiry(self, key: str) -> float:
+        return self.store.get_expiry(key)
+
+    def check(self) -> bool:
+        return self.store.check()
+
+    def reset(self) -> int:
+        return self.store.reset()
+
+    def clear(self, key: str) -> None:
+        self.store.clear(key)
@@ -0,0 +1,388 @@
+"""
+Retenção e compactação de security_logs e downloads
+
+As tabelas são divididas por mês:
+
+- PostgreSQL: partições nativas por intervalo (`<tabela>_pAAAAMM`, mais
+  `<tabela>_default`). `partition_table` converte uma tabela existente
+  (uma vez, em janela de manutenção) e `ensure_partitions` cria os meses
+  seguintes a cada execução.
+- SQLite: sem divisão; as linhas continuam na tabela principal (a única
+  lida pela aplicação) até saírem da retenção.
+
+Meses inteiros além da retenção da tabela são arquivados em NDJSON
+compactado (RETENTION_ARCHIVE_DIR) e removidos de uma vez (DROP da
+partição). No SQLite, e para tipos de evento com retenção menor, as linhas
+vencidas são arquivadas e removidas em lotes; nenhuma linha dentro da
+retenção é movida ou removida. Os rollups diários guardam os totais dos períodos removidos; não os
+recalcule (rebuild_rollups) para datas além da retenção.
+
+Uso: python retention.py              (arquivamento e remoção)
+     python retention.py --partition  (PostgreSQL: converter as tabelas)
+"""
+import gzip
+import json
+import os
+import re
+import sys
+import logging
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import and_, column, delete, inspect, select, table, text, true
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.expression import TableClause
+
+from config import get_config
+from models import Download, SecurityLog
+
+logger = logging.getLogger(__name__)
+
+config = get_config()
+
+# Meses consultados nos logs recentes
+HOT_MONTHS = 2
+
+# Partições criadas à frente do mês atual (PostgreSQL)
+MONTHS_AHEAD = 2
+
+_PARTITION_SUFFIX = re.compile(r"_p(\d{4})(\d{2})$")
+
+@dataclass(frozen=True)
+class RetentionSpec:
+    """Tabela sujeita à retenção: coluna de tempo e retenção (em dias) por tipo de evento"""
+    model: type
+    time_column: str
+    default_days: int
+    type_column: Optional[str] = None
+    days_by_type: Tuple[Tuple[str, int], ...] = ()
+
+    @property
+    def name(self) -> str:
+        return self.model.__tablename__
+
+    @property
+    def max_days(self) -> int:
+        return max([self.default_days] + [days for _, days in self.days_by_type])
+
+def parse_retention_by_type(value: str) -> Tuple[Tuple[str, int], ...]:
+    """Interpretar "tipo:dias,tipo:dias" (entradas inválidas são ignoradas)"""
+    result = []
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        event_type, _, days = item.partition(":")
+        try:
+            result.append((event_type.strip(), int(days)))
+        except ValueError:
+            logger.warning(f"Retenção inválida ignorada: {item}")
+    return tuple(result)
+
+def retention_specs() -> List[RetentionSpec]:
+    """Tabelas e retenções configuradas"""
+    return [
+        RetentionSpec(
+            SecurityLog, "created_at", config.SECURITY_LOG_RETENTION_DAYS,
+            type_column="event_type",
+            days_by_type=parse_retention_by_type(config.SECURITY_LOG_RETENTION_BY_TYPE)
+        ),
+        RetentionSpec(Download, "downloaded_at", config.DOWNLOAD_RETENTION_DAYS)
+    ]
+
+# Meses
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def _as_datetime(day: date) -> datetime:
+    return datetime.combine(day, datetime.min.time())
+
+def months_since(value, now: Optional[datetime] = None) -> int:
+    """Quantidade de meses do mês de `value` até o atual, inclusive"""
+    current = month_start(now or datetime.utcnow())
+    first = month_start(value)
+    return max((current.year - first.year) * 12 + current.month - first.month + 1, 1)
+
+def recent_months(months: int = HOT_MONTHS, now: Optional[datetime] = None) -> Iterator[Tuple[datetime, datetime]]:
+    """Intervalos [início, fim) dos meses mais recentes, do atual para trás"""
+    current = month_start(now or datetime.utcnow())
+    for offset in range(months):
+        start = add_months(current, -offset)
+        yield _as_datetime(start), _as_datetime(add_months(start, 1))
+
+def partition_name(table_name: str, month: date) -> str:
+    return f"{table_name}_p{month:%Y%m}"
+
+def _relation(name: str, spec: RetentionSpec) -> TableClause:
+    # Tabela leve com os tipos do modelo (datas e JSON convertidos como no ORM)
+    return table(name, *(column(c.name, c.type) for c in spec.model.__table__.columns))
+
+def _is_postgres(engine: Engine) -> bool:
+    return engine.dialect.name == "postgresql"
+
+def _is_partitioned(conn, spec: RetentionSpec) -> bool:
+    return conn.execute(
+        text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:name)"),
+        {"name": spec.name}
+    ).first() is not None
+
+def _month_tables(conn, spec: RetentionSpec) -> Dict[date, str]:
+    """Partições (PostgreSQL) ou tabelas mensais deixadas por versões anteriores (SQLite), por mês"""
+    if conn.dialect.name == "postgresql":
+        names = conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:name)"
+        ), {"name": spec.name}).scalars().all()
+    else:
+        names = inspect(conn).get_table_names()
+
+    tables = {}
+    for name in names:
+        match = _PARTITION_SUFFIX.search(name)
+        if match:
+            month = date(int(match.group(1)), int(match.group(2)), 1)
+            if name == partition_name(spec.name, month):
+                tables[month] = name
+    return tables
+
+# Arquivamento
+
+def _archive_path(spec: RetentionSpec, label: str) -> str:
+    directory = os.path.join(config.RETENTION_ARCHIVE_DIR, spec.name)
+    os.makedirs(directory, exist_ok=True)
+    label = re.sub(r"[^\w.-]", "_", label)
+    return os.path.join(directory, f"{label}-{datetime.utcnow():%Y%m%d%H%M%S}.ndjson.gz")
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+def archive_rows(engine: Engine, relation: TableClause, where, path: str) -> Tuple[int, Optional[int]]:
+    """Gravar as linhas selecionadas em NDJSON.gz; retorna (linhas, maior id)
+
+    O arquivo só aparece com o nome final depois de completo.
+    """
+    partial = path + ".partial"
+    count = 0
+    max_id = None
+    with engine.connect() as conn:
+        result = conn.execution_options(yield_per=config.RETENTION_BATCH_SIZE).execute(
+            select(relation).where(where).order_by(relation.c.id)
+        )
+        with gzip.open(partial, "wt", encoding="utf-8") as archive:
+            for rows in result.partitions():
+                archive.write("".join(
+                    json.dumps(dict(row._mapping), default=_json_value, ensure_ascii=False) + "\n"
+                    for row in rows
+                ))
+                count += len(rows)
+                max_id = rows[-1].id
+
+    if count:
+        os.replace(partial, path)
+        logger.info(f"{count} linhas arquivadas em {path}")
+    else:
+        os.remove(partial)
+    return count, max_id
+
+def _delete_batches(engine: Engine, relation: TableClause, where, max_id: int) -> int:
+    # Apenas as linhas já arquivadas (id <= max_id), em transações curtas
+    deleted = 0
+    while True:
+        batch = select(relation.c.id).where(where, relation.c.id <= max_id).limit(config.RETENTION_BATCH_SIZE)
+        with engine.begin() as conn:
+            removed = conn.execute(delete(relation).where(relation.c.id.in_(batch))).rowcount
+        deleted += removed
+        if not removed:
+            return deleted
+
+# PostgreSQL: partições nativas
+
+def _create_partition(conn, spec: RetentionSpec, month: date):
+    start, end = month, add_months(month, 1)
+    conn.execute(text(
+        f'CREATE TABLE IF NOT EXISTS "{partition_name(spec.name, month)}" PARTITION OF "{spec.name}" '
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+
+def partition_table(engine: Engine, spec: RetentionSpec) -> bool:
+    """PostgreSQL: converter a tabela em particionada por mês (em janela de manutenção)
+
+    Tudo ocorre em uma transação: a tabela original é renomeada, os dados
+    são copiados para as partições e a chave primária passa a ser
+    (id, coluna de tempo), exigência do particionamento. Retorna False se a
+    tabela já estiver particionada.
+    """
+    if not _is_postgres(engine):
+        raise ValueError("Particionamento nativo disponível apenas no PostgreSQL")
+
+    source = spec.model.__table__
+    name = spec.name
+    legacy = f"{name}_unpartitioned"
+    time_column = spec.time_column
+
+    with engine.begin() as conn:
+        if _is_partitioned(conn, spec):
+            return False
+
+        conn.execute(text(f'LOCK TABLE "{name}" IN ACCESS EXCLUSIVE MODE'))
+        sequence = conn.execute(text("SELECT pg_get_serial_sequence(:name, 'id')"), {"name": name}).scalar()
+        first = conn.execute(text(f'SELECT min("{time_column}") FROM "{name}"')).scalar()
+
+        # A sequência do id passa para a nova tabela
+        if sequence:
+            conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY NONE"))
+        conn.execute(text(f'ALTER TABLE "{name}" RENAME TO "{legacy}"'))
+        conn.execute(text(
+            f'CREATE TABLE "{name}" (LIKE "{legacy}" INCLUDING DEFAULTS) PARTITION BY RANGE ("{time_column}")'
+        ))
+
+        current = month_start(datetime.utcnow())
+        month = month_start(first) if first else current
+        while month <= add_months(current, MONTHS_AHEAD):
+            _create_partition(conn, spec, month)
+            month = add_months(month, 1)
+        conn.execute(text(f'CREATE TABLE "{name}_default" PARTITION OF "{name}" DEFAULT'))
+
+        columns = ", ".join(f'"{c.name}"' for c in source.columns)
+        values = ", ".join(
+            f"coalesce(\"{c.name}\", now() at time zone 'utc')" if c.name == time_column else f'"{c.name}"'
+            for c in source.columns
+        )
+        conn.execute(text(f'INSERT INTO "{name}" ({columns}) SELECT {values} FROM "{legacy}"'))
+        conn.execute(text(f'DROP TABLE "{legacy}"'))
+
+        conn.execute(text(f'ALTER TABLE "{name}" ADD PRIMARY KEY ("id", "{time_column}")'))
+        for foreign_key in source.foreign_key_constraints:
+            local = ", ".join(f'"{c.name}"' for c in foreign_key.columns)
+            remote = ", ".join(f'"{element.column.name}"' for element in foreign_key.elements)
+            conn.execute(text(
+                f'ALTER TABLE "{name}" ADD FOREIGN KEY ({local}) '
+                f'REFERENCES "{foreign_key.referred_table.name}" ({remote})'
+            ))
+        for index in source.indexes:
+            index.create(conn, checkfirst=True)
+        if sequence:
+            conn.execute(text(f'ALTER SEQUENCE {sequence} OWNED BY "{name}"."id"'))
+
+    logger.info(f"Tabela {name} convertida em particionada por mês")
+    return True
+
+def ensure_partitions(engine: Engine, spec: RetentionSpec, months_ahead: int = MONTHS_AHEAD) -> int:
+    """PostgreSQL: criar as partições do mês atual e dos próximos meses"""
+    with engine.begin() as conn:
+        if not _is_partitioned(conn, spec):
+            return 0
+        existing = _month_tables(conn, spec)
+        current = month_start(datetime.utcnow())
+        created = 0
+        for offset in range(months_ahead + 1):
+            month = add_months(current, offset)
+            if month not in existing:
+                _create_partition(conn, spec, month)
+                created += 1
+        return created
+
+# Remoção
+
+def drop_expired_months(engine: Engine, spec: RetentionSpec) -> Tuple[int, int]:
+    """Arquivar e remover os meses inteiros além da retenção; retorna (meses, linhas)"""
+    cutoff = datetime.utcnow() - timedelta(days=spec.max_days)
+    with engine.connect() as conn:
+        tables = _month_tables(conn, spec)
+
+    dropped = archived = 0
+    for month, name in sorted(tables.items()):
+        if _as_datetime(add_months(month, 1)) > cutoff:
+            continue
+        count, _ = archive_rows(engine, _relation(name, spec), true(), _archive_path(spec, f"{month:%Y-%m}"))
+        with engine.begin() as conn:
+            if _is_postgres(engine):
+                conn.execute(text(f'ALTER TABLE "{spec.name}" DETACH PARTITION "{name}"'))
+            conn.execute(text(f'DROP TABLE "{name}"'))
+        dropped += 1
+        archived += count
+        logger.info(f"Mês {month:%Y-%m} de {spec.name} removido ({count} linhas arquivadas)")
+    return dropped, archived
+
+def _purge_rules(spec: RetentionSpec, row_level: bool) -> List[Tuple[Optional[str], int]]:
+    # (tipo de evento ou None para os demais, dias); a retenção máxima da tabela só é
+    # aplicada linha a linha quando não há meses inteiros para remover (row_level)
+    rules = [
+        (event_type, days) for event_type, days in spec.days_by_type
+        if row_level or days < spec.max_days
+    ]
+    if row_level or spec.default_days < spec.max_days:
+        rules.append((None, spec.default_days))
+    return rules
+
+def purge_expired_rows(engine: Engine, spec: RetentionSpec, relations: List[TableClause],
+                       row_level: bool = False) -> int:
+    """Arquivar e remover em lotes as linhas de tipos com retenção menor que a da tabela"""
+    overrides = [event_type for event_type, _ in spec.days_by_type]
+    rules = _purge_rules(spec, row_level)
+    now = datetime.utcnow()
+    purged = 0
+
+    for relation in relations:
+        for event_type, days in rules:
+            conditions = [relation.c[spec.time_column] < now - timedelta(days=days)]
+            if event_type is not None:
+                conditions.append(relation.c[spec.type_column] == event_type)
+            elif spec.type_column and overrides:
+                conditions.append(relation.c[spec.type_column].notin_(overrides))
+            where = and_(*conditions)
+
+            label = f"{relation.name}-{event_type or 'demais'}"
+            count, max_id = archive_rows(engine, relation, where, _archive_path(spec, label))
+            if count:
+                purged += _delete_batches(engine, relation, where, max_id)
+    return purged
+
+def run_retention(engine: Optional[Engine] = None) -> dict:
+    """Arquivamento e remoção dos dados vencidos de todas as tabelas configuradas"""
+    if engine is None:
+        from database import engine
+
+    summary = {}
+    for spec in retention_specs():
+        try:
+            result = {}
+            if _is_postgres(engine):
+                result["created_partitions"] = ensure_partitions(engine, spec)
+                with engine.connect() as conn:
+                    partitioned = _is_partitioned(conn, spec)
+            else:
+                # Sem partições: tudo que passou da retenção é removido linha a linha
+                partitioned = False
+
+            result["dropped_months"], result["archived"] = drop_expired_months(engine, spec)
+
+            relations = [_relation(spec.name, spec)]
+            if not _is_postgres(engine):
+                with engine.connect() as conn:
+                    relations += [_relation(name, spec) for name in _month_tables(conn, spec).values()]
+            result["purged"] = purge_expired_rows(engine, spec, relations, row_level=not partitioned)
+            summary[spec.name] = result
+        except Exception as e:
+            logger.error(f"Erro na retenção de {spec.name}: {e}")
+            summary[spec.name] = {"error": str(e)}
+
+    logger.info(f"Retenção executada: {summary}")
+    return summary
+
+if __name__ == "__main__":
+    from database import engine
+
+    logging.basicConfig(level=logging.INFO)
+    if "--partition" in sys.argv[1:]:
+        for spec in retention_specs():
+            print(spec.name, partition_table(engine, spec))
+    else:
+        print(run_retention(engine))
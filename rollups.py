@@ -0,0 +1,283 @@
+"""
+Tabelas de rollup diário (downloads por produto, receita e cadastros)
+
+Os rollups são mantidos de forma incremental: um listener de sessão aplica,
+na mesma transação do flush, os deltas de cada Download, Transaction e User
+inserido, alterado ou removido. Inserções em massa via Core (que não passam
+pela sessão) devem chamar `record_downloads`/`record_transactions`/
+`record_signups` com a mesma conexão. `rebuild_rollups` recalcula os dias
+a partir das tabelas brutas (compactação periódica e carga inicial).
+
+Uso: python rollups.py [dias]  (recalcula os últimos N dias; padrão 2)
+"""
+import sys
+import logging
+from collections import Counter, defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import event, func, delete, inspect, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from models import Download, Transaction, User, DailyProductDownloads, DailyRevenue, DailySignups
+
+logger = logging.getLogger(__name__)
+
+# Status de transação considerados pagos (main/stripe usam "approved", payment.py "completed")
+PAID_STATUSES = ("approved", "completed")
+
+# Campos de Transaction que mudam o bucket de receita
+_REVENUE_FIELDS = ("status", "payment_method", "amount", "created_at")
+
+def _as_date(value) -> date:
+    if value is None:
+        return datetime.utcnow().date()
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+class RollupDeltas:
+    """Deltas acumulados de um flush (ou lote) a aplicar nos rollups"""
+
+    def __init__(self):
+        self.downloads = Counter()
+        self.revenue = defaultdict(lambda: [0, 0.0])
+        self.signups = Counter()
+
+    def add_download(self, when, product_id: int, sign: int = 1):
+        if product_id is not None:
+            self.downloads[(_as_date(when), product_id)] += sign
+
+    def add_transaction(self, when, status: Optional[str], payment_method: Optional[str],
+                        amount: Optional[float], sign: int = 1):
+        bucket = self.revenue[(_as_date(when), status or "pending", payment_method or "")]
+        bucket[0] += sign
+        bucket[1] += sign * (amount or 0.0)
+
+    def add_signup(self, when, sign: int = 1):
+        self.signups[_as_date(when)] += sign
+
+    def __bool__(self) -> bool:
+        return bool(self.downloads or self.revenue or self.signups)
+
+    def apply(self, conn: Connection):
+        """Somar os deltas nas tabelas de rollup (UPSERT por chave)"""
+        _upsert_add(conn, DailyProductDownloads, ("day", "product_id"), ("downloads",), [
+            {"day": day, "product_id": product_id, "downloads": count}
+            for (day, product_id), count in sorted(self.downloads.items()) if count
+        ])
+        _upsert_add(conn, DailyRevenue, ("day", "status", "payment_method"), ("transactions", "amount"), [
+            {"day": day, "status": status, "payment_method": method, "transactions": count, "amount": amount}
+            for (day, status, method), (count, amount) in sorted(self.revenue.items()) if count or amount
+        ])
+        _upsert_add(conn, DailySignups, ("day",), ("signups",), [
+            {"day": day, "signups": count}
+            for day, count in sorted(self.signups.items()) if count
+        ])
+
+def _insert_for(conn: Connection):
+    return pg_insert if conn.dialect.name == "postgresql" else sqlite_insert
+
+def _upsert_add(conn: Connection, model, keys: tuple, values: tuple, rows: list):
+    # Linhas ordenadas pela chave para evitar deadlock entre transações concorrentes
+    if not rows:
+        return
+    table = model.__table__
+    stmt = _insert_for(conn)(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={column: table.c[column] + stmt.excluded[column] for column in values}
+    )
+    conn.execute(stmt, rows)
+
+def _upsert_replace(conn: Connection, model, keys: tuple, values: tuple, rows: list):
+    if not rows:
+        return
+    table = model.__table__
+    stmt = _insert_for(conn)(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={column: stmt.excluded[column] for column in values}
+    )
+    conn.execute(stmt, rows)
+
+# Inserções em massa (Core) que não passam pela sessão
+
+def record_downloads(conn: Connection, rows: Iterable[dict]):
+    """Atualizar rollup para downloads inseridos diretamente (dicts com product_id/downloaded_at)"""
+    deltas = RollupDeltas()
+    for row in rows:
+        deltas.add_download(row.get("downloaded_at"), row.get("product_id"))
+    deltas.apply(conn)
+
+def record_transactions(conn: Connection, rows: Iterable[dict]):
+    """Atualizar rollup para transações inseridas diretamente"""
+    deltas = RollupDeltas()
+    for row in rows:
+        deltas.add_transaction(row.get("created_at"), row.get("status"), row.get("payment_method"), row.get("amount"))
+    deltas.apply(conn)
+
+def record_signups(conn: Connection, rows: Iterable[dict]):
+    """Atualizar rollup para usuários inseridos diretamente"""
+    deltas = RollupDeltas()
+    for row in rows:
+        deltas.add_signup(row.get("created_at"))
+    deltas.apply(conn)
+
+# Manutenção incremental via eventos da sessão
+
+def _previous(obj, field: str):
+    """Valor do campo antes das alterações pendentes"""
+    history = inspect(obj).attrs[field].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(obj, field)
+
+@event.listens_for(Session, "before_flush")
+def _collect_changes(session, flush_context, instances):
+    # Alterações e remoções são lidas antes do flush, enquanto os valores antigos
+    # ainda estão disponíveis; inserções ficam para o after_flush (defaults já aplicados)
+    deltas = RollupDeltas()
+
+    for obj in session.deleted:
+        if isinstance(obj, Download):
+            deltas.add_download(obj.downloaded_at, obj.product_id, -1)
+        elif isinstance(obj, Transaction):
+            deltas.add_transaction(obj.created_at, obj.status, obj.payment_method, obj.amount, -1)
+        elif isinstance(obj, User):
+            deltas.add_signup(obj.created_at, -1)
+
+    for obj in session.dirty:
+        if isinstance(obj, Transaction) and obj not in session.deleted:
+            if not session.is_modified(obj, include_collections=False):
+                continue
+            old = {field: _previous(obj, field) for field in _REVENUE_FIELDS}
+            new = {field: getattr(obj, field) for field in _REVENUE_FIELDS}
+            if old == new:
+                continue
+            deltas.add_transaction(old["created_at"], old["status"], old["payment_method"], old["amount"], -1)
+            deltas.add_transaction(new["created_at"], new["status"], new["payment_method"], new["amount"])
+
+    session.info["rollup_deltas"] = deltas
+
+@event.listens_for(Session, "after_flush")
+def _apply_changes(session, flush_context):
+    deltas = session.info.pop("rollup_deltas", None) or RollupDeltas()
+
+    for obj in session.new:
+        if isinstance(obj, Download):
+            deltas.add_download(obj.downloaded_at, obj.product_id)
+        elif isinstance(obj, Transaction):
+            deltas.add_transaction(obj.created_at, obj.status, obj.payment_method, obj.amount)
+        elif isinstance(obj, User):
+            deltas.add_signup(obj.created_at)
+
+    if deltas:
+        deltas.apply(session.connection())
+
+def _track_previous_value(target, value, oldvalue, initiator):
+    pass
+
+# Carregar o valor anterior ao alterar campos de Transaction, mesmo com o objeto expirado,
+# para que o delta saia do bucket correto
+for _field in _REVENUE_FIELDS:
+    event.listen(getattr(Transaction, _field), "set", _track_previous_value, active_history=True)
+
+# Compactação / recálculo a partir das tabelas brutas
+
+def rebuild_rollups(db: Session, since: Optional[date] = None) -> dict:
+    """Recalcular os rollups a partir de `since` (ou de todo o histórico) e confirmar
+
+    Idempotente: os dias recalculados são substituídos, então execuções
+    concorrentes (vários workers) chegam ao mesmo resultado.
+    """
+    start = datetime.combine(since, time.min) if since else None
+    conn = db.connection()
+
+    for model in (DailyProductDownloads, DailyRevenue, DailySignups):
+        stmt = delete(model)
+        if since:
+            stmt = stmt.where(model.day >= since)
+        conn.execute(stmt)
+
+    download_day = func.date(Download.downloaded_at)
+    query = select(download_day, Download.product_id, func.count(Download.id)).group_by(
+        download_day, Download.product_id
+    )
+    if start:
+        query = query.where(Download.downloaded_at >= start)
+    downloads = [
+        {"day": _as_date(day), "product_id": product_id, "downloads": count}
+        for day, product_id, count in conn.execute(query)
+    ]
+
+    transaction_day = func.date(Transaction.created_at)
+    method = func.coalesce(Transaction.payment_method, "")
+    status = func.coalesce(Transaction.status, "pending")
+    query = select(
+        transaction_day, status, method, func.count(Transaction.id), func.coalesce(func.sum(Transaction.amount), 0)
+    ).group_by(transaction_day, status, method)
+    if start:
+        query = query.where(Transaction.created_at >= start)
+    revenue = [
+        {"day": _as_date(day), "status": status_, "payment_method": method_,
+         "transactions": count, "amount": float(amount)}
+        for day, status_, method_, count, amount in conn.execute(query)
+    ]
+
+    signup_day = func.date(User.created_at)
+    query = select(signup_day, func.count(User.id)).group_by(signup_day)
+    if start:
+        query = query.where(User.created_at >= start)
+    signups = [{"day": _as_date(day), "signups": count} for day, count in conn.execute(query)]
+
+    _upsert_replace(conn, DailyProductDownloads, ("day", "product_id"), ("downloads",), downloads)
+    _upsert_replace(conn, DailyRevenue, ("day", "status", "payment_method"), ("transactions", "amount"), revenue)
+    _upsert_replace(conn, DailySignups, ("day",), ("signups",), signups)
+    db.commit()
+
+    result = {"downloads": len(downloads), "revenue": len(revenue), "signups": len(signups)}
+    logger.info(f"Rollups recalculados desde {since or 'o início'}: {result}")
+    return result
+
+def compact_rollups(db: Session, days: int = 2) -> dict:
+    """Recalcular os últimos `days` dias (tarefa periódica de compactação)"""
+    return rebuild_rollups(db, since=datetime.utcnow().date() - timedelta(days=days - 1))
+
+def backfill_rollups(db: Session) -> bool:
+    """Carga inicial quando os rollups estão vazios mas já existem eventos"""
+    try:
+        empty = all(
+            db.query(model).first() is None
+            for model in (DailyProductDownloads, DailyRevenue, DailySignups)
+        )
+        if not empty:
+            return False
+        has_events = any(
+            db.query(model.id).first() is not None
+            for model in (Download, Transaction, User)
+        )
+        if not has_events:
+            return False
+        rebuild_rollups(db)
+        return True
+    except Exception as e:
+        logger.error(f"Erro ao popular rollups: {e}")
+        db.rollback()
+        return False
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    logging.basicConfig(level=logging.INFO)
+    db = SessionLocal()
+    try:
+        days = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+        print(compact_rollups(db, days=days))
+    finally:
+        db.close()
@@ -0,0 +1,289 @@
+"""
+Agendador de tarefas periódicas (expiração de licenças, avisos, tokens, rollups, outbox, webhooks, retenção)
+
+Cada worker do gunicorn inicia o agendador, mas apenas o líder executa as
+tarefas. A liderança é um lease em uma linha de leader_leases, tomado com um
+único UPDATE (só quando o lease atual venceu) e renovado pelo líder em uma
+thread própria, inclusive durante tarefas longas. Por usar apenas comandos
+avulsos, funciona no SQLite e no PostgreSQL direto ou atrás de poolers em
+modo transação (pgbouncer, porta 6543 do Supabase). Se o líder morrer, outro
+worker assume quando o lease vencer (LEADER_LEASE_SECONDS). As tarefas rodam
+em sequência, em uma thread própria.
+
+Uso: python scheduler.py [tarefa ...]  (executa as tarefas uma vez, sem eleição)
+"""
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import or_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+
+from config import get_config
+from models import LeaderLease
+
+logger = logging.getLogger(__name__)
+
+config = get_config()
+
+class LeaderLock:
+    """Liderança entre workers: lease com validade em leader_leases
+
+    Os workers comparam a validade com o próprio relógio (UTC); mantenha os
+    servidores sincronizados (NTP), com folga muito menor que o lease.
+    """
+
+    def __init__(self, name: str, ttl: Optional[float] = None):
+        self.name = name
+        self.ttl = ttl or config.LEADER_LEASE_SECONDS
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._valid_until: Optional[float] = None
+        self._stop_renewal = threading.Event()
+        self._renewer: Optional[threading.Thread] = None
+
+    @property
+    def held(self) -> bool:
+        return self._valid_until is not None and time.monotonic() < self._valid_until
+
+    def acquire(self) -> bool:
+        """Tentar obter (ou confirmar) a liderança sem bloquear"""
+        if self.held:
+            return True
+        if not self._claim():
+            return False
+        logger.info(f"Este worker assumiu a liderança de {self.name}")
+        if not (self._renewer and self._renewer.is_alive()):
+            self._stop_renewal.clear()
+            self._renewer = threading.Thread(target=self._renew, name=f"lease-{self.name}", daemon=True)
+            self._renewer.start()
+        return True
+
+    def release(self):
+        self._stop_renewal.set()
+        if self._valid_until is None:
+            return
+        self._valid_until = None
+        from database import engine
+        try:
+            with engine.begin() as conn:
+                conn.execute(update(LeaderLease).where(
+                    LeaderLease.name == self.name, LeaderLease.holder == self.holder
+                ).values(expires_at=datetime.utcnow()))
+        except Exception as e:
+            # O lease vence sozinho
+            logger.warning(f"Erro ao liberar a liderança de {self.name}: {e}")
+
+    def _claim(self) -> bool:
+        """Tomar ou renovar o lease: só quando é deste worker ou já venceu"""
+        from database import engine
+
+        started = time.monotonic()
+        now = datetime.utcnow()
+        values = {"holder": self.holder, "expires_at": now + timedelta(seconds=self.ttl)}
+        try:
+            with engine.begin() as conn:
+                taken = conn.execute(update(LeaderLease).where(
+                    LeaderLease.name == self.name,
+                    or_(LeaderLease.holder == self.holder, LeaderLease.expires_at < now)
+                ).values(**values)).rowcount
+                if not taken:
+                    taken = self._insert(conn, values)
+        except Exception as e:
+            logger.error(f"Erro ao obter liderança de {self.name}: {e}")
+            taken = 0
+
+        self._valid_until = started + self.ttl if taken else None
+        return bool(taken)
+
+    def _insert(self, conn, values: dict) -> int:
+        # Primeira eleição: cria a linha; se outro worker criou antes, não é líder
+        row = {"name": self.name, **values}
+        if conn.dialect.name in ("postgresql", "sqlite"):
+            insert = pg_insert if conn.dialect.name == "postgresql" else sqlite_insert
+            return conn.execute(insert(LeaderLease).values(row).on_conflict_do_nothing(index_elements=["name"])).rowcount
+        try:
+            with conn.begin_nested():
+                conn.execute(LeaderLease.__table__.insert().values(row))
+            return 1
+        except IntegrityError:
+            return 0
+
+    def _renew(self):
+        while not self._stop_renewal.wait(self.ttl / 3):
+            if not self._claim():
+                logger.warning(f"Liderança de {self.name} perdida")
+                return
+
+class Job:
+    """Tarefa periódica"""
+
+    def __init__(self, name: str, func: Callable, interval: float, initial_delay: float = 0.0):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.next_run = time.monotonic() + initial_delay
+        self.last_run: Optional[float] = None
+        self.last_result = None
+        self.last_error: Optional[str] = None
+        self.runs = 0
+
+    def due(self, now: float) -> bool:
+        return now >= self.next_run
+
+class Scheduler:
+    """Executa as tarefas devidas em uma thread, somente no worker líder"""
+
+    def __init__(self, lock: LeaderLock, tick: float = 1.0):
+        self.lock = lock
+        self.tick = tick
+        self.jobs: Dict[str, Job] = {}
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_job(self, name: str, func: Callable, interval: float, initial_delay: float = 0.0) -> Job:
+        job = Job(name, func, interval, initial_delay)
+        self.jobs[name] = job
+        return job
+
+    def start(self):
+        """Iniciar a thread do agendador"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Parar a thread e liberar a liderança"""
+        self._stopping.set()
+        thread = self._thread
+        if thread and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout)
+        self._thread = None
+        self.lock.release()
+
+    def run_pending(self) -> list:
+        """Executar as tarefas devidas, se este worker for o líder"""
+        now = time.monotonic()
+        due = [job for job in self.jobs.values() if job.due(now)]
+        if not due or not self.lock.acquire():
+            # Quem não é líder tenta de novo no próximo intervalo de cada tarefa
+            for job in due:
+                job.next_run = now + job.interval
+            return []
+
+        for job in due:
+            if self._stopping.is_set():
+                break
+            self.run_job(job)
+        return [job.name for job in due]
+
+    def run_job(self, job: Job):
+        start = time.monotonic()
+        try:
+            job.last_result = job.func()
+            job.last_error = None
+            logger.info(f"Tarefa {job.name} executada em {time.monotonic() - start:.2f}s: {job.last_result}")
+        except Exception as e:
+            job.last_error = str(e)
+            logger.error(f"Erro na tarefa {job.name}: {e}")
+        finally:
+            job.runs += 1
+            job.last_run = time.time()
+            job.next_run = time.monotonic() + job.interval
+
+    def stats(self) -> dict:
+        """Estado do agendador e das tarefas"""
+        return {
+            "leader": self.lock.held,
+            "jobs": {
+                job.name: {
+                    "interval": job.interval,
+                    "runs": job.runs,
+                    "last_run": job.last_run,
+                    "last_error": job.last_error
+                }
+                for job in self.jobs.values()
+            }
+        }
+
+    def _run(self):
+        while not self._stopping.wait(self.tick):
+            try:
+                self.run_pending()
+            except Exception as e:
+                logger.error(f"Erro no agendador: {e}")
+
+def _with_session(func: Callable) -> Callable:
+    """Executar a tarefa com uma sessão própria"""
+    def run():
+        from database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            return func(db)
+        finally:
+            db.close()
+    return run
+
+def _expire_licenses(db):
+    from license import cleanup_expired_licenses
+    return cleanup_expired_licenses(db)
+
+def _cleanup_reset_tokens(db):
+    from password_recovery import cleanup_expired_tokens
+    return cleanup_expired_tokens(db)
+
+def _compact_rollups(db):
+    from rollups import compact_rollups
+    return compact_rollups(db)
+
+def _send_expiry_warnings(db):
+    from expiry_warnings import send_expiry_warnings
+    return send_expiry_warnings(db)
+
+def _purge_finished_emails(db):
+    from mail_queue import purge_finished_emails
+    return purge_finished_emails(db)
+
+def _purge_stripe_events(db):
+    from stripe_webhooks import purge_processed_events
+    return purge_processed_events(db)
+
+def _run_retention():
+    from retention import run_retention
+    return run_retention()
+
+scheduler = Scheduler(LeaderLock("scheduler"))
+scheduler.add_job("expire_licenses", _with_session(_expire_licenses), config.LICENSE_SWEEP_SECONDS, initial_delay=5)
+scheduler.add_job("cleanup_reset_tokens", _with_session(_cleanup_reset_tokens), config.TOKEN_CLEANUP_SECONDS, initial_delay=30)
+scheduler.add_job("compact_rollups", _with_session(_compact_rollups), config.ROLLUP_COMPACT_SECONDS, initial_delay=60)
+scheduler.add_job("expiry_warnings", _with_session(_send_expiry_warnings), config.EXPIRY_WARNING_SECONDS, initial_delay=120)
+scheduler.add_job("purge_finished_emails", _with_session(_purge_finished_emails), config.TOKEN_CLEANUP_SECONDS, initial_delay=90)
+scheduler.add_job("purge_stripe_events", _with_session(_purge_stripe_events), config.TOKEN_CLEANUP_SECONDS, initial_delay=150)
+if config.RETENTION_ENABLED:
+    scheduler.add_job("retention", _run_retention, config.RETENTION_RUN_SECONDS, initial_delay=300)
+
+def start_scheduler():
+    """Iniciar o agendador (na inicialização de cada worker)"""
+    if config.SCHEDULER_ENABLED:
+        scheduler.start()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    names = sys.argv[1:] or list(scheduler.jobs)
+    for name in names:
+        job = scheduler.jobs.get(name)
+        if job is None:
+            print(f"Tarefa desconhecida: {name} (disponíveis: {', '.join(scheduler.jobs)})")
+            sys.exit(1)
+        scheduler.run_job(job)
+        print(name, job.last_error or job.last_result)
@@ -7,8 +7,13 @@ from datetime import datetime
 from fastapi import Request, Response
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
-from models import SecurityLog
+from event_writer import record_security_event
 from typing import Dict, Any
+from limits import RateLimitItemPerSecond
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter
+from config import get_config
+import rate_limit_store  # registra o esquema sqlite:// no limits
 import ipaddress
 import user_agents
 
@@ -207,20 +212,23 @@ def detect_xss_attempt(value: str) -> bool:
         return False
 
 def get_client_ip(request: Request) -> str:
-    """Obter IP real do cliente"""
+    """Obter IP real do cliente
+    
+    Cada proxy acrescenta ao X-Forwarded-For o endereço de quem o chamou, então
+    só as últimas TRUSTED_PROXY_HOPS entradas são confiáveis; as anteriores
+    vêm do próprio cliente e podem ser forjadas.
+    """
     try:
-        # Verificar headers de proxy
+        hops = get_config().TRUSTED_PROXY_HOPS
         forwarded_for = request.headers.get("X-Forwarded-For")
-        if forwarded_for:
-            # Pegar o primeiro IP da lista
-            ip = forwarded_for.split(",")[0].strip()
-            return ip
-        
-        real_ip = request.headers.get("X-Real-IP")
-        if real_ip:
-            return real_ip
+        if hops > 0 and forwarded_for:
+            hosts = [host.strip() for host in forwarded_for.split(",") if host.strip()]
+            if hosts:
+                return hosts[-min(hops, len(hosts))]
         
         # Fallback para IP direto
+        if request.client is None:
+            return "unknown"
         return str(request.client.host)
         
     except Exception as e:
@@ -279,43 +287,45 @@ def is_suspicious_ip(ip: str) -> bool:
         return False
 
 def log_security_event(event_type: str, details: Dict[str, Any], db: Session = None):
-    """Registrar evento de segurança"""
+    """Registrar evento de segurança
+    
+    O evento é enfileirado e gravado em lote pela thread de eventos; a
+    sessão `db` é aceita por compatibilidade, mas não é usada nem confirmada.
+    """
     try:
-        if not db:
-            # Se não há sessão DB, apenas logar
-            logger.warning(f"Evento de segurança: {event_type} - {details}")
-            return
-        
-        # Criar log no banco
-        security_log = SecurityLog(
-            event_type=event_type,
+        record_security_event(
+            event_type,
             user_id=details.get("user_id"),
             ip_address=details.get("ip"),
             user_agent=details.get("user_agent"),
             details=details
         )
         
-        db.add(security_log)
-        db.commit()
-        
         logger.info(f"Evento de segurança registrado: {event_type}")
         
     except Exception as e:
         logger.error(f"Erro ao registrar evento de segurança: {e}")
 
-def check_rate_limit(ip: str, endpoint: str, limit: int = 10, window: int = 60) -> bool:
-    """Verificar rate limiting (implementação básica em memória)"""
+_rate_limiter = None
+
+def _get_rate_limiter() -> FixedWindowRateLimiter:
+    """Limitador sobre RATELIMIT_STORAGE_URL (o mesmo armazenamento do slowapi)"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        storage = storage_from_string(get_config().RATELIMIT_STORAGE_URL)
+        _rate_limiter = FixedWindowRateLimiter(storage)
+    return _rate_limiter
+
+def check_rate_limit(ip: str, endpoint: str, limit: int = 10, window: int = 60, consume: bool = True) -> bool:
+    """Verificar rate limiting (`limit` requisições a cada `window` segundos por IP)
+    
+    Com `consume=False` apenas consulta se ainda há vaga, sem contar a requisição.
+    """
     try:
-        # Em produção, usar Redis ou banco de dados
-        # Esta é uma implementação simples para demonstração
-        
-        current_time = datetime.utcnow().timestamp()
-        key = f"{ip}:{endpoint}"
-        
-        # Simular verificação de rate limit
-        # Em implementação real, verificar no Redis/DB
-        
-        return True  # Permitir por padrão
+        item = RateLimitItemPerSecond(limit, window)
+        if not consume:
+            return _get_rate_limiter().test(item, endpoint, ip)
+        return _get_rate_limiter().hit(item, endpoint, ip)
         
     except Exception as e:
         logger.error(f"Erro na verificação de rate limit: {e}")
@@ -10,6 +10,8 @@ from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 from models import User, Product, License, Transaction
 from database import get_db
+from license import invalidate_license_cache
+from counters import record_product_download
 from config import Config
 
 # Configurar Stripe
@@ -106,33 +108,9 @@ class StripeManager:
             }
     
     def process_webhook(self, payload: bytes, signature: str, db: Session) -> dict:
-        """Processar webhook do Stripe"""
-        try:
-            # Verificar assinatura do webhook
-            endpoint_secret = os.environ.get('STRIPE_WEBHOOK_SECRET')
-            if endpoint_secret:
-                try:
-                    event = stripe.Webhook.construct_event(
-                        payload, signature, endpoint_secret
-                    )
-                except stripe.error.SignatureVerificationError:
-                    return {'success': False, 'error': 'Assinatura inválida'}
-            else:
-                # Em desenvolvimento, processar sem verificação
-                import json
-                event = json.loads(payload.decode('utf-8'))
-            
-            # Processar evento
-            if event['type'] == 'checkout.session.completed':
-                return self._handle_successful_payment(event['data']['object'], db)
-            elif event['type'] == 'checkout.session.expired':
-                return self._handle_expired_payment(event['data']['object'], db)
-            
-            return {'success': True, 'message': 'Evento processado'}
-            
-        except Exception as e:
-            print(f"Erro ao processar webhook: {e}")
-            return {'success': False, 'error': str(e)}
+        """Receber webhook do Stripe: verificar, registrar e confirmar (processado por stripe_webhooks)"""
+        from stripe_webhooks import accept_webhook
+        return accept_webhook(payload, signature, db)
     
     def _handle_successful_payment(self, session_data: dict, db: Session) -> dict:
         """Processar pagamento bem-sucedido"""
@@ -144,18 +122,33 @@ class StripeManager:
             product_id = int(metadata.get('product_id'))
             duration_days = int(metadata.get('duration_days', 30))
             
-            # Atualizar transação
+            # Atualizar transação (bloqueada até o commit para aplicar a sessão uma única vez)
             transaction = db.query(Transaction).filter(
                 Transaction.payment_id == session_id
-            ).first()
+            ).with_for_update().first()
             
-            if transaction:
-                transaction.status = 'approved'
-                transaction.updated_at = datetime.utcnow()
-                transaction.gateway_response = {
-                    **transaction.gateway_response,
-                    'payment_completed': session_data
-                }
+            if transaction and transaction.status == 'approved':
+                db.rollback()
+                return {'success': True, 'message': 'Pagamento já processado'}
+            
+            if not transaction:
+                # Sessão sem transação registrada: criar, para servir de marca de idempotência
+                transaction = Transaction(
+                    user_id=user_id,
+                    product_id=product_id,
+                    amount=(session_data.get('amount_total') or 0) / 100,
+                    payment_id=session_id,
+                    payment_method='stripe',
+                    status='pending'
+                )
+                db.add(transaction)
+            
+            transaction.status = 'approved'
+            transaction.updated_at = datetime.utcnow()
+            transaction.gateway_response = {
+                **(transaction.gateway_response or {}),
+                'payment_completed': session_data
+            }
             
             # Verificar se já existe licença ativa para este produto
             existing_license = db.query(License).filter(
@@ -183,12 +176,11 @@ class StripeManager:
                 )
                 db.add(license)
             
-            # Atualizar contador de downloads do produto
-            product = db.query(Product).filter(Product.id == product_id).first()
-            if product:
-                product.download_count += 1
-            
             db.commit()
+            invalidate_license_cache(license.license_key)
+            
+            # Atualizar contador de downloads do produto (agregado e gravado em lote)
+            record_product_download(product_id)
             
             return {
                 'success': True,
@@ -262,9 +254,7 @@ def verify_user_license(db: Session, user_id: int, product_id: int) -> dict:
             }
         
         if license.is_expired:
-            # Atualizar status da licença expirada
-            license.status = 'expired'
-            db.commit()
+            # O status é atualizado pelo agendador; a verificação apenas lê
             return {
                 'has_license': False,
                 'message': 'Licença expirada'
@@ -315,18 +305,8 @@ def get_user_licenses(db: Session, user_id: int) -> list:
 
 def cleanup_expired_licenses(db: Session) -> int:
     """Limpar licenças expiradas (task de background)"""
-    try:
-        expired_count = db.query(License).filter(
-            License.status == 'active',
-            License.expires_at < datetime.utcnow()
-        ).update({'status': 'expired'})
-        
-        db.commit()
-        return expired_count
-        
-    except Exception as e:
-        print(f"Erro ao limpar licenças: {e}")
-        return 0
+    from license import cleanup_expired_licenses as expire_licenses
+    return expire_licenses(db)
 
 def test_stripe_connection() -> bool:
     """Testar conexão com Stripe"""
@@ -6,6 +6,8 @@ import stripe
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 from models import User, Product, License, Transaction
+from license import invalidate_license_cache
+from counters import record_product_download
 
 # Configurar Stripe
 stripe.api_key = os.environ.get('STRIPE_SECRET_KEY')
@@ -83,27 +85,18 @@ def create_stripe_checkout_session(user_id: int, product_id: int, db: Session) -
         return {'success': False, 'error': str(e)}
 
 def process_stripe_webhook_event(payload: bytes, signature: str, db: Session) -> dict:
-    """Processar webhook do Stripe"""
-    try:
-        import json
-        
-        # Em desenvolvimento, processar sem verificação de assinatura
-        # Em produção, adicionar verificação com STRIPE_WEBHOOK_SECRET
-        event = json.loads(payload.decode('utf-8'))
-        
-        if event['type'] == 'checkout.session.completed':
-            return handle_payment_success(event['data']['object'], db)
-        elif event['type'] == 'checkout.session.expired':
-            return handle_payment_expired(event['data']['object'], db)
-        
-        return {'success': True, 'message': 'Evento processado'}
-        
-    except Exception as e:
-        print(f"Erro no webhook: {e}")
-        return {'success': False, 'error': str(e)}
+    """Receber webhook do Stripe: verificar, registrar e confirmar (processado por stripe_webhooks)"""
+    from stripe_webhooks import accept_webhook
+    return accept_webhook(payload, signature, db)
 
 def handle_payment_success(session_data: dict, db: Session) -> dict:
-    """Processar pagamento bem-sucedido"""
+    """Processar pagamento bem-sucedido
+    
+    Idempotente por sessão de checkout: a transação da sessão (criada aqui
+    se o checkout não a registrou) é aprovada na mesma transação da licença;
+    se já estiver aprovada, nada é alterado, então reentregas e eventos
+    duplicados não criam nem estendem licenças de novo.
+    """
     try:
         session_id = session_data['id']
         metadata = session_data.get('metadata', {})
@@ -112,19 +105,29 @@ def handle_payment_success(session_data: dict, db: Session) -> dict:
         product_id = int(metadata.get('product_id'))
         duration_days = int(metadata.get('duration_days', 30))
         
-        # Atualizar transação
+        # Bloquear a transação até o commit (PostgreSQL) para aplicar a sessão uma única vez
         transaction = db.query(Transaction).filter(
             Transaction.payment_id == session_id
-        ).first()
+        ).with_for_update().first()
         
-        if transaction:
-            # Usar update() para evitar problemas de tipo
-            db.query(Transaction).filter(
-                Transaction.payment_id == session_id
-            ).update({
-                'status': 'approved',
-                'updated_at': datetime.utcnow()
-            })
+        if transaction and transaction.status == 'approved':
+            db.rollback()
+            return {'success': True, 'message': 'Pagamento já processado'}
+        
+        if not transaction:
+            # Sessão sem transação registrada: criar, para servir de marca de idempotência
+            # (payment_id é único; uma inserção concorrente falha e o evento é reprocessado)
+            transaction = Transaction(
+                user_id=user_id,
+                product_id=product_id,
+                amount=(session_data.get('amount_total') or 0) / 100,
+                payment_id=session_id,
+                payment_method='stripe'
+            )
+            db.add(transaction)
+        
+        transaction.status = 'approved'
+        transaction.updated_at = datetime.utcnow()
         
         # Verificar licença existente
         existing_license = db.query(License).filter(
@@ -135,13 +138,8 @@ def handle_payment_success(session_data: dict, db: Session) -> dict:
         
         if existing_license:
             # Estender licença existente
-            new_expiry = existing_license.expires_at + timedelta(days=duration_days)
-            db.query(License).filter(
-                License.id == existing_license.id
-            ).update({
-                'expires_at': new_expiry,
-                'stripe_session_id': session_id
-            })
+            existing_license.expires_at = existing_license.expires_at + timedelta(days=duration_days)
+            existing_license.stripe_session_id = session_id
             license_key = existing_license.license_key
         else:
             # Criar nova licença
@@ -156,14 +154,11 @@ def handle_payment_success(session_data: dict, db: Session) -> dict:
             db.flush()  # Para obter o license_key gerado
             license_key = license.license_key
         
-        # Incrementar contador de downloads
-        db.query(Product).filter(
-            Product.id == product_id
-        ).update({
-            'download_count': Product.download_count + 1
-        })
-        
         db.commit()
+        invalidate_license_cache(license_key)
+        
+        # Incrementar contador de downloads (agregado e gravado em lote)
+        record_product_download(product_id)
         
         return {
             'success': True,
@@ -181,8 +176,10 @@ def handle_payment_expired(session_data: dict, db: Session) -> dict:
     try:
         session_id = session_data['id']
         
+        # Só transações pendentes expiram (o evento pode chegar depois da aprovação)
         db.query(Transaction).filter(
-            Transaction.payment_id == session_id
+            Transaction.payment_id == session_id,
+            Transaction.status == 'pending'
         ).update({
             'status': 'expired',
             'updated_at': datetime.utcnow()
@@ -193,6 +190,7 @@ def handle_payment_expired(session_data: dict, db: Session) -> dict:
         
     except Exception as e:
         print(f"Erro ao processar expiração: {e}")
+        db.rollback()
         return {'success': False, 'error': str(e)}
 
 def check_user_license(db: Session, user_id: int, product_id: int) -> dict:
@@ -0,0 +1,283 @@
+"""
+Webhooks do Stripe: registro idempotente e processamento assíncrono
+
+O endpoint apenas verifica a assinatura, grava o corpo bruto do evento em
+stripe_webhook_events (chave única pelo ID do evento, então reentregas do
+Stripe são descartadas na inserção) e responde 200 em milissegundos. Um
+único worker, eleito como o agendador (com um lease próprio), processa os eventos pendentes na ordem de criação no Stripe:
+um evento só é processado depois dos anteriores do mesmo objeto (sessão de
+checkout), mesmo que tenham chegado fora de ordem ou estejam aguardando nova
+tentativa. Falhas são reprocessadas com espera exponencial até
+STRIPE_WEBHOOK_MAX_ATTEMPTS; depois o evento fica como "failed".
+"""
+import json
+import threading
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+import stripe
+from sqlalchemy import and_, delete, exists, or_, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased
+
+from config import get_config
+from models import StripeWebhookEvent
+from scheduler import LeaderLock
+
+logger = logging.getLogger(__name__)
+
+config = get_config()
+
+WEBHOOK_LEASE_SECONDS = 300
+MAX_RETRY_SECONDS = 6 * 3600
+
+class WebhookSignatureError(ValueError):
+    """Assinatura do webhook ausente ou inválida"""
+
+def verify_event(payload: bytes, signature: str) -> dict:
+    """Verificar a assinatura e decodificar o evento"""
+    if config.STRIPE_WEBHOOK_SECRET:
+        try:
+            stripe.WebhookSignature.verify_header(payload.decode("utf-8"), signature, config.STRIPE_WEBHOOK_SECRET)
+        except stripe.SignatureVerificationError as e:
+            raise WebhookSignatureError(str(e))
+    elif config.is_production():
+        raise WebhookSignatureError("STRIPE_WEBHOOK_SECRET não configurado")
+
+    event = json.loads(payload.decode("utf-8"))
+    if not event.get("id") or not event.get("type"):
+        raise ValueError("Evento sem id ou tipo")
+    return event
+
+def record_event(db: Session, event: dict, payload: bytes) -> bool:
+    """Gravar o evento no registro; retorna False se já havia sido recebido"""
+    data_object = (event.get("data") or {}).get("object") or {}
+    row = {
+        "event_id": event["id"],
+        "event_type": event["type"],
+        "object_id": data_object.get("id"),
+        "stripe_created_at": datetime.utcfromtimestamp(event.get("created") or datetime.utcnow().timestamp()),
+        "payload": payload.decode("utf-8"),
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": datetime.utcnow(),
+        "received_at": datetime.utcnow()
+    }
+
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = pg_insert if dialect == "postgresql" else sqlite_insert
+        result = db.execute(insert(StripeWebhookEvent).values(row).on_conflict_do_nothing(index_elements=["event_id"]))
+        db.commit()
+        return result.rowcount > 0
+
+    try:
+        db.add(StripeWebhookEvent(**row))
+        db.commit()
+        return True
+    except IntegrityError:
+        db.rollback()
+        return False
+
+def accept_webhook(payload: bytes, signature: str, db: Session) -> dict:
+    """Verificar, registrar e confirmar o webhook (o processamento é feito em segundo plano)"""
+    try:
+        event = verify_event(payload, signature)
+    except WebhookSignatureError as e:
+        logger.warning(f"Webhook do Stripe com assinatura inválida: {e}")
+        return {"success": False, "error": "Assinatura inválida"}
+    except ValueError as e:
+        return {"success": False, "error": f"Evento inválido: {e}"}
+
+    try:
+        created = record_event(db, event, payload)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Erro ao registrar webhook do Stripe {event['id']}: {e}")
+        return {"success": False, "error": "Erro ao registrar evento"}
+
+    if not created:
+        return {"success": True, "message": "Evento já recebido"}
+    webhook_processor.wake()
+    return {"success": True, "message": "Evento recebido"}
+
+def dispatch_event(event: dict, db: Session) -> dict:
+    """Aplicar o evento (idempotente: reprocessar não duplica licenças)"""
+    from stripe_simple import handle_payment_success, handle_payment_expired
+
+    if event["type"] == "checkout.session.completed":
+        return handle_payment_success(event["data"]["object"], db)
+    if event["type"] == "checkout.session.expired":
+        return handle_payment_expired(event["data"]["object"], db)
+    return {"success": True, "message": "Evento ignorado"}
+
+def retry_delay(attempts: int) -> int:
+    """Espera antes da próxima tentativa (exponencial, com teto)"""
+    return min(config.STRIPE_WEBHOOK_RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), MAX_RETRY_SECONDS)
+
+def purge_processed_events(db: Session, days: Optional[int] = None) -> int:
+    """Remover eventos processados há mais de `days` dias (muito além das reentregas do Stripe)"""
+    days = days or config.STRIPE_WEBHOOK_RETENTION_DAYS
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    result = db.execute(delete(StripeWebhookEvent).where(
+        StripeWebhookEvent.status == "processed", StripeWebhookEvent.processed_at < cutoff
+    ))
+    db.commit()
+    return result.rowcount
+
+class WebhookProcessor:
+    """Processa os eventos registrados em uma thread, somente no worker líder"""
+
+    def __init__(self, lock: LeaderLock, poll_interval: float, batch_size: int, max_attempts: int):
+        self.lock = lock
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.processed = 0
+        self.retried = 0
+        self.failed = 0
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Iniciar a thread de processamento"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="stripe-webhooks", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Parar a thread e liberar a liderança"""
+        self._stopping.set()
+        self._wake.set()
+        thread = self._thread
+        if thread and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout)
+        self._thread = None
+        self.lock.release()
+
+    def wake(self):
+        """Avisar que há eventos novos (evita esperar o próximo ciclo)"""
+        self._wake.set()
+
+    def stats(self) -> dict:
+        return {
+            "leader": self.lock.held,
+            "running": bool(self._thread and self._thread.is_alive()),
+            "processed": self.processed,
+            "retried": self.retried,
+            "failed": self.failed
+        }
+
+    def process_pending(self) -> int:
+        """Reservar e processar um lote de eventos devidos; retorna quantos foram reservados"""
+        from database import SessionLocal
+
+        claimed = self._claim()
+        for event_row_id, payload, attempts in claimed:
+            if self._stopping.is_set():
+                self._release(event_row_id)
+                continue
+            db = SessionLocal()
+            try:
+                result = dispatch_event(json.loads(payload), db)
+                error = None if result.get("success") else result.get("error", "Falha no processamento")
+            except Exception as e:
+                db.rollback()
+                error = str(e)
+            finally:
+                db.close()
+            self._finish(event_row_id, attempts + 1, error)
+        return len(claimed)
+
+    def _claim(self) -> list:
+        from database import engine
+
+        now = datetime.utcnow()
+        earlier = aliased(StripeWebhookEvent)
+        # Evento anterior do mesmo objeto ainda não processado: esperar por ele
+        blocked = exists().where(
+            earlier.object_id == StripeWebhookEvent.object_id,
+            earlier.status.in_(("pending", "processing")),
+            tuple_(earlier.stripe_created_at, earlier.id) < tuple_(StripeWebhookEvent.stripe_created_at, StripeWebhookEvent.id)
+        )
+        due = or_(
+            and_(StripeWebhookEvent.status == "pending", StripeWebhookEvent.next_attempt_at <= now),
+            # Reserva de um worker que morreu no meio do processamento
+            and_(StripeWebhookEvent.status == "processing", StripeWebhookEvent.locked_until < now)
+        )
+        ids = select(StripeWebhookEvent.id).where(due, ~blocked).order_by(
+            StripeWebhookEvent.stripe_created_at, StripeWebhookEvent.id
+        ).limit(self.batch_size)
+        if engine.dialect.name == "postgresql":
+            ids = ids.with_for_update(skip_locked=True, of=StripeWebhookEvent)
+
+        stmt = update(StripeWebhookEvent).where(StripeWebhookEvent.id.in_(ids.scalar_subquery())).values(
+            status="processing",
+            locked_until=now + timedelta(seconds=WEBHOOK_LEASE_SECONDS)
+        ).returning(
+            StripeWebhookEvent.id, StripeWebhookEvent.payload, StripeWebhookEvent.attempts,
+            StripeWebhookEvent.stripe_created_at
+        )
+        with engine.begin() as conn:
+            rows = conn.execute(stmt).all()
+        rows.sort(key=lambda row: (row.stripe_created_at, row.id))
+        return [(row.id, row.payload, row.attempts) for row in rows]
+
+    def _release(self, event_row_id: int):
+        from database import engine
+
+        with engine.begin() as conn:
+            conn.execute(update(StripeWebhookEvent).where(StripeWebhookEvent.id == event_row_id).values(
+                status="pending", locked_until=None
+            ))
+
+    def _finish(self, event_row_id: int, attempts: int, error: Optional[str]):
+        from database import engine
+
+        values = {"attempts": attempts, "locked_until": None}
+        if error is None:
+            values.update(status="processed", processed_at=datetime.utcnow(), last_error=None)
+            self.processed += 1
+        elif attempts >= self.max_attempts:
+            values.update(status="failed", last_error=error[:1000])
+            self.failed += 1
+            logger.error(f"Webhook do Stripe {event_row_id} descartado após {attempts} tentativa(s): {error}")
+        else:
+            delay = retry_delay(attempts)
+            values.update(status="pending", last_error=error[:1000],
+                          next_attempt_at=datetime.utcnow() + timedelta(seconds=delay))
+            self.retried += 1
+            logger.warning(f"Falha ao processar webhook do Stripe {event_row_id}, nova tentativa em {delay}s: {error}")
+
+        with engine.begin() as conn:
+            conn.execute(update(StripeWebhookEvent).where(StripeWebhookEvent.id == event_row_id).values(**values))
+
+    def _run(self):
+        while not self._stopping.is_set():
+            processed = 0
+            try:
+                if self.lock.acquire():
+                    processed = self.process_pending()
+            except Exception as e:
+                logger.error(f"Erro no processamento de webhooks do Stripe: {e}")
+            if not processed:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+webhook_processor = WebhookProcessor(
+    LeaderLock("stripe_webhooks"),
+    poll_interval=config.STRIPE_WEBHOOK_POLL_SECONDS,
+    batch_size=config.STRIPE_WEBHOOK_BATCH_SIZE,
+    max_attempts=config.STRIPE_WEBHOOK_MAX_ATTEMPTS
+)
+
+def start_webhook_processor():
+    """Iniciar o processamento de webhooks (na inicialização de cada worker)"""
+    if config.STRIPE_WEBHOOK_WORKER_ENABLED:
+        webhook_processor.start()
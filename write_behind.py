@@ -0,0 +1,132 @@
+"""
+Buffer de escrita adiada (write-behind) com coalescência por chave
+"""
+import atexit
+import threading
+import logging
+from typing import Any, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+class WriteBehindBuffer:
+    """Acumula valores por chave em memória e grava em lote periodicamente.
+
+    Valores repetidos para a mesma chave são combinados com `merge` (por
+    padrão o último valor vence). O lote é gravado por `flush_func` a cada
+    `interval` segundos, ou antes disso quando o buffer atinge `max_entries`
+    chaves, em uma thread de fundo. `stop()` faz a gravação final e é
+    registrado no atexit para que nada se perca no desligamento do worker.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        flush_func: Callable[[Dict[Hashable, Any]], None],
+        merge: Optional[Callable[[Any, Any], Any]] = None,
+        interval: float = 10.0,
+        max_entries: int = 500
+    ):
+        self.name = name
+        self.flush_func = flush_func
+        self.merge = merge or (lambda old, new: new)
+        self.interval = interval
+        self.max_entries = max_entries
+        self._pending: Dict[Hashable, Any] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._atexit_registered = False
+        self.flushed_entries = 0
+        self.failed_flushes = 0
+
+    def add(self, key: Hashable, value: Any):
+        """Registrar valor para a chave (combinado com o pendente, se houver)"""
+        with self._lock:
+            if key in self._pending:
+                self._pending[key] = self.merge(self._pending[key], value)
+            else:
+                self._pending[key] = value
+            size = len(self._pending)
+
+        self._ensure_started()
+        if size >= self.max_entries:
+            self._wake.set()
+
+    def flush(self) -> int:
+        """Gravar imediatamente tudo que está pendente; retorna nº de chaves"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+
+            if not batch:
+                return 0
+
+            try:
+                self.flush_func(batch)
+                self.flushed_entries += len(batch)
+                return len(batch)
+            except Exception as e:
+                self.failed_flushes += 1
+                logger.error(f"Erro ao gravar buffer {self.name} ({len(batch)} itens): {e}")
+                # Devolver o lote ao buffer para a próxima tentativa
+                with self._lock:
+                    for key, value in batch.items():
+                        if key in self._pending:
+                            self._pending[key] = self.merge(value, self._pending[key])
+                        else:
+                            self._pending[key] = value
+                return 0
+
+    def start(self):
+        """Iniciar a thread de gravação periódica"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name=f"write-behind-{self.name}", daemon=True
+            )
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+
+    def stop(self, timeout: float = 10.0):
+        """Parar a thread e gravar o que restou no buffer"""
+        self._stopping.set()
+        self._wake.set()
+        thread = self._thread
+        if thread and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout)
+        self._thread = None
+        self.flush()
+
+    def pending_count(self) -> int:
+        """Quantidade de chaves aguardando gravação"""
+        with self._lock:
+            return len(self._pending)
+
+    def stats(self) -> dict:
+        """Estatísticas do buffer"""
+        return {
+            "name": self.name,
+            "pending": self.pending_count(),
+            "flushed_entries": self.flushed_entries,
+            "failed_flushes": self.failed_flushes,
+            "interval": self.interval,
+            "max_entries": self.max_entries
+        }
+
+    def _ensure_started(self):
+        if self._thread is None and not self._stopping.is_set():
+            self.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopping.is_set():
+                break
+            self.flush()